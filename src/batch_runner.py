@@ -0,0 +1,380 @@
+"""
+Batch API mode for offline evaluation and bulk inference.
+
+The OpenAI Batch API runs uploaded requests within 24 hours at half the price of the
+synchronous API, under a separate and much larger rate limit: the right tool when
+nobody waits for the answers (evaluation runs, bulk jobs). A query of the pipeline is a
+chain of dependent LLM calls though, so it can't be sent as one request. All queries are
+instead advanced together, one stage per batch:
+
+    1. every waiting query runs locally (`workers` at a time) until it needs an LLM
+       response that isn't known yet: llm_cache.py hands the request to the collector,
+       which queues it and raises RequestDeferred, ending this run of the query
+    2. the queued requests of all queries are uploaded as JSONL, one batch per endpoint
+       (/v1/chat/completions, /v1/responses), and polled until the batches end
+    3. every deferred query runs again from the start. The calls answered so far get
+       their response right away (from the response cache, or the collector when the
+       call bypasses it), local work such as the Simpful / Prolog sandboxes is redone,
+       and the query gets to its next stage
+
+This repeats until no query defers, so a query takes about as many rounds as it makes
+sequential LLM calls (rewrite, decide, generate, retries, summary, judge). The stages
+themselves don't change: they still call `cached_call` and friends.
+
+Requests, batch ids and responses are kept in the work directory, so an interrupted
+run resumes: batches still in flight are polled, not submitted again, and answered
+requests are never sent twice. Requests that an expired or cancelled batch didn't get
+to, or that failed with a transient status, go into the next batch.
+
+    python batch_runner.py queries.json --output answers.json
+"""
+import argparse
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from openai.lib._parsing._completions import type_to_response_format_param
+from openai.lib._parsing._responses import type_to_text_format_param
+from openai.types.responses import Response
+from pydantic import BaseModel
+
+import tracing
+from llm_cache import RequestDeferred, deferring, request_key
+from openai_clients import RETRY_STATUS, get_client, request
+from pipeline import run_pipeline
+
+POLL_SECONDS = float(os.getenv("FUZZY_LLM_BATCH_POLL_SECONDS", 30))
+COMPLETION_WINDOW = "24h"
+MAX_BATCH_REQUESTS = 50_000  # per input file (Batch API limit)
+MAX_ROUNDS = 20
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+##### REQUESTS AND RESPONSES #####
+
+def endpoint_of(response_type) -> str:
+    return "/v1/responses" if issubclass(response_type, Response) else "/v1/chat/completions"
+
+
+def request_body(params: dict) -> dict:
+    """The HTTP body the SDK would send for `params` (pydantic response schemas as JSON schema)."""
+    body = dict(params)
+    text_format = body.pop("text_format", None)
+    if text_format is not None:  # responses.parse
+        body["text"] = dict(body.get("text") or {}, format=type_to_text_format_param(text_format))
+    if isinstance(body.get("response_format"), type):  # chat.completions.parse
+        body["response_format"] = type_to_response_format_param(body["response_format"])
+    return body
+
+
+def _with_parsed(params: dict, body: dict) -> dict:
+    """`body` with the `parsed` fields the SDK's .parse() methods fill in."""
+    schema = params.get("text_format") or params.get("response_format")
+    if not (isinstance(schema, type) and issubclass(schema, BaseModel)):
+        return body
+
+    body = copy.deepcopy(body)
+    for choice in body.get("choices") or []:
+        message = choice.get("message") or {}
+        if message.get("content") and not message.get("refusal"):
+            message["parsed"] = json.loads(message["content"])
+    for item in body.get("output") or []:
+        for part in item.get("content") or []:
+            if part.get("type") == "output_text":
+                part["parsed"] = json.loads(part["text"])
+    return body
+
+
+def _usage(body: dict):
+    """(prompt, cached prompt, completion) tokens of a response body of either endpoint."""
+    usage = body.get("usage") or {}
+    details = usage.get("prompt_tokens_details") or usage.get("input_tokens_details") or {}
+    return (usage.get("prompt_tokens") or usage.get("input_tokens") or 0,
+            details.get("cached_tokens") or 0,
+            usage.get("completion_tokens") or usage.get("output_tokens") or 0)
+
+
+##### COLLECTOR #####
+
+class _CaseRequests:
+    """The collector as seen by one query (what `llm_cache.deferring` expects)."""
+
+    def __init__(self, collector, case_id):
+        self.collector = collector
+        self.case_tag = hashlib.sha256(str(case_id).encode("utf-8")).hexdigest()[:12]
+        self._calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def response(self, response_type, params, bypass):
+        key = request_key(response_type, params)
+        if bypass:  # a fresh sample per call: the n-th identical call of a query gets the n-th answer
+            with self._lock:
+                occurrence = self._calls[key]
+                self._calls[key] += 1
+            key = f"{key}-{self.case_tag}-{occurrence}"
+        return self.collector.response(key, response_type, params)
+
+
+class BatchCollector:
+    """
+    Answers of finished batches, and the requests waiting for the next one, kept in
+    `work_dir`. Thread-safe. `usage` totals the batches collected by this process.
+    """
+
+    def __init__(self, work_dir: str, client=None):
+        self.work_dir = work_dir
+        self.client = client or get_client()
+        self.bodies = {}  # key -> response body
+        self.errors = {}  # key -> error message of a request that failed for good
+        self.pending = {}  # key -> (endpoint, request body)
+        self.batches = []  # {"id", "input_path", "done"} of every batch submitted
+        self.usage = {"requests": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0,
+                      "completion_tokens": 0, "cost_usd": 0.0}
+        self._delivered = set()
+        self._lock = threading.Lock()
+
+        os.makedirs(work_dir, exist_ok=True)
+        self._responses_path = os.path.join(work_dir, "responses.jsonl")
+        self._batches_path = os.path.join(work_dir, "batches.json")
+        self._load()
+
+    def for_case(self, case_id) -> _CaseRequests:
+        return _CaseRequests(self, case_id)
+
+    def response(self, key, response_type, params):
+        """(response, fresh) for the request `key`; queues it and raises RequestDeferred if unknown."""
+        with self._lock:
+            body = self.bodies.get(key)
+            if body is None:
+                if key in self.errors:
+                    raise RuntimeError(f"Batch request failed: {self.errors[key]}")
+                self.pending.setdefault(key, (endpoint_of(response_type), request_body(params)))
+                raise RequestDeferred(key)
+            fresh = key not in self._delivered
+            self._delivered.add(key)
+        return response_type.model_validate(_with_parsed(params, body)), fresh
+
+    # ---- persistence ----
+
+    def _load(self):
+        if os.path.exists(self._responses_path):
+            with open(self._responses_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # partially written last line of a crashed run
+                    if "body" in record:
+                        self.bodies[record["key"]] = record["body"]
+                        self.errors.pop(record["key"], None)
+                    else:
+                        self.errors[record["key"]] = record["error"]
+        if os.path.exists(self._batches_path):
+            with open(self._batches_path, "r", encoding="utf-8") as f:
+                self.batches = json.load(f)
+
+    def _save_batches(self):
+        temporary = self._batches_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self.batches, f, indent=2)
+        os.replace(temporary, self._batches_path)
+
+    def _store(self, records):
+        with self._lock, open(self._responses_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if "body" in record:
+                    self.bodies[record["key"]] = record["body"]
+                else:
+                    self.errors[record["key"]] = record["error"]
+
+    # ---- batches ----
+
+    def submit(self, round_number: int) -> int:
+        """Upload the queued requests as batches; returns how many were submitted."""
+        with self._lock:
+            pending, self.pending = self.pending, {}
+
+        by_endpoint = defaultdict(list)
+        for key, (endpoint, body) in pending.items():
+            by_endpoint[endpoint].append({"custom_id": key, "method": "POST", "url": endpoint, "body": body})
+
+        for endpoint, lines in sorted(by_endpoint.items()):
+            for start in range(0, len(lines), MAX_BATCH_REQUESTS):
+                name = f"round{round_number:02d}_{endpoint.rsplit('/', 1)[-1]}_{start // MAX_BATCH_REQUESTS}.jsonl"
+                path = os.path.join(self.work_dir, name)
+                data = "".join(json.dumps(line, ensure_ascii=False) + "\n"
+                               for line in lines[start:start + MAX_BATCH_REQUESTS]).encode("utf-8")
+                with open(path, "wb") as f:
+                    f.write(data)
+
+                uploaded = request(lambda: self.client.files.create(file=(name, data), purpose="batch"))
+                batch = request(lambda: self.client.batches.create(
+                    input_file_id=uploaded.id, endpoint=endpoint, completion_window=COMPLETION_WINDOW,
+                    metadata={"description": name}))
+                self.batches.append({"id": batch.id, "input_path": path, "done": False})
+                self._save_batches()
+                print(f"[batch] submitted {batch.id}: {len(lines[start:start + MAX_BATCH_REQUESTS])} "
+                      f"requests to {endpoint}")
+        return len(pending)
+
+    def wait(self, poll_seconds: float = POLL_SECONDS):
+        """Poll the batches in flight until they end, and collect their results."""
+        while True:
+            open_batches = [record for record in self.batches if not record["done"]]
+            if not open_batches:
+                return
+            for record in open_batches:
+                batch = request(lambda: self.client.batches.retrieve(record["id"]))
+                if batch.status in TERMINAL_STATUSES:
+                    self._collect(record, batch)
+                    record["done"] = True
+                    self._save_batches()
+                elif batch.request_counts is not None:
+                    counts = batch.request_counts
+                    print(f"[batch] {batch.id} {batch.status}: {counts.completed + counts.failed}/{counts.total}")
+            if any(not record["done"] for record in self.batches):
+                time.sleep(poll_seconds)
+
+    def _collect(self, record, batch):
+        with open(record["input_path"], "r", encoding="utf-8") as f:
+            models = {line["custom_id"]: line["body"].get("model") for line in map(json.loads, f)}
+
+        records = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = request(lambda: self.client.files.content(file_id)).text
+            for line in filter(str.strip, content.splitlines()):
+                result = json.loads(line)
+                key, response = result["custom_id"], result.get("response") or {}
+                status = response.get("status_code")
+                if status == 200:
+                    records.append({"key": key, "body": response["body"]})
+                    self._account(models.get(key), response["body"])
+                elif status is not None and (status in RETRY_STATUS or status >= 500):
+                    continue  # asked again by the next run of its query
+                else:
+                    error = result.get("error") or (response.get("body") or {}).get("error") or {}
+                    records.append({"key": key, "error": error.get("message") or f"HTTP {status}"})
+
+        answered = {r["key"] for r in records}
+        if batch.status == "failed":  # the input was rejected: sending it again would fail again
+            reasons = [e.message for e in (batch.errors.data if batch.errors else None) or [] if e.message]
+            message = "; ".join(reasons) or "batch failed"
+            records += [{"key": key, "error": message} for key in models if key not in answered]
+        self._store(records)
+
+        failed = sum("error" in r for r in records)
+        print(f"[batch] {batch.id} {batch.status}: {len(records) - failed} answered, {failed} failed, "
+              f"{len(models) - len(records)} to retry")
+
+    def _account(self, model, body):
+        prompt_tokens, cached_tokens, completion_tokens = _usage(body)
+        cost = tracing.estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens) * tracing.BATCH_DISCOUNT
+        with self._lock:
+            self.usage["requests"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["cached_prompt_tokens"] += cached_tokens
+            self.usage["completion_tokens"] += completion_tokens
+            self.usage["cost_usd"] += cost
+
+
+##### RUNNER #####
+
+def _attempt(collector, process, case_id, case):
+    """(deferred, result) of one run of `process(case)`."""
+    try:
+        with deferring(collector.for_case(case_id)):
+            return False, process(case)
+    except RequestDeferred:
+        return True, None
+    except Exception as e:
+        print(f"[ERROR] Case {case_id} failed: {e}")
+        return False, {"id": case_id, "error": str(e)}
+
+
+def run_batched(cases: dict, process, collector: BatchCollector, workers: int = 8,
+                poll_seconds: float = POLL_SECONDS, max_rounds: int = MAX_ROUNDS) -> dict:
+    """
+    Run `process(case)` for every case of {case_id: case}, with its LLM requests sent
+    through the Batch API.
+
+    Args:
+        cases: the inputs of `process` by case id
+        process: the work for one case; run again from the start every round until
+            none of its LLM calls waits for a batch, so it must not have other side
+            effects that can't be repeated
+        collector: the batch state (work directory and client)
+        workers: cases run concurrently within a round
+        poll_seconds: delay between two status checks of a batch
+
+    Returns:
+        {case_id: result}. A case whose `process` raised gets {"id", "error"}; cases still
+        waiting after `max_rounds` are left out (a later run with the same work directory
+        picks them up).
+    """
+    collector.wait(poll_seconds)  # batches left in flight by an interrupted run
+
+    results, waiting = {}, dict(cases)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for round_number in range(1, max_rounds + 1):
+            outcomes = list(executor.map(lambda item: _attempt(collector, process, *item), waiting.items()))
+            for (case_id, case), (deferred, result) in zip(list(waiting.items()), outcomes):
+                if not deferred:
+                    results[case_id] = result
+                    del waiting[case_id]
+            if not waiting:
+                break
+
+            print(f"[batch] round {round_number}: {len(results)} cases done, {len(waiting)} waiting")
+            if not collector.submit(round_number):
+                break  # nothing to ask for: the waiting cases can't make progress
+            collector.wait(poll_seconds)
+
+    if waiting:
+        print(f"[WARN] {len(waiting)} cases still waiting for batch responses after {round_number} rounds")
+    return results
+
+
+##### BULK INFERENCE #####
+
+def _answer(case):
+    return {"id": case["id"], **run_pipeline(case["raw_context"], case["raw_question"])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer many queries through the OpenAI Batch API.")
+    parser.add_argument("json_file", help='JSON list of {"id", "raw_context", "raw_question"}')
+    parser.add_argument("--output", default=None, help="answers file (default: <name>_answers.json)")
+    parser.add_argument("--work-dir", default=None, help="batch files and responses (default: <name>_batch/)")
+    parser.add_argument("--workers", type=int, default=8, help="queries run concurrently between batches")
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS, help="delay between status checks")
+    args = parser.parse_args()
+
+    with open(args.json_file, "r", encoding="utf-8") as f:
+        queries = json.load(f)
+    stem = os.path.splitext(args.json_file)[0]
+    collector = BatchCollector(args.work_dir or stem + "_batch")
+
+    results = run_batched({query["id"]: query for query in queries}, _answer, collector,
+                          workers=args.workers, poll_seconds=args.poll_seconds)
+
+    output = args.output or stem + "_answers.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump([results[q["id"]] for q in queries if q["id"] in results], f,
+                  indent=2, ensure_ascii=False, default=str)
+    usage = collector.usage
+    print(f"{len(results)}/{len(queries)} queries answered, {usage['requests']} batch requests: "
+          f"{usage['prompt_tokens']} prompt + {usage['completion_tokens']} completion tokens, "
+          f"cost ${usage['cost_usd']:.4f}")
+    print(f"Answers saved to: {output}")
+
+
+if __name__ == "__main__":
+    main()
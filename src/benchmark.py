@@ -0,0 +1,302 @@
+"""
+Offline benchmark of the whole pipeline against the local fake OpenAI server.
+
+Runs the evaluation problems and the example queries through `run_many_async`
+with the OpenAI client pointed at `fake_llm_server`, so throughput and latency can be
+measured without network access or API cost. Besides end-to-end numbers it reports
+the latency of every pipeline stage and reasoning branch (from the tracing spans) and
+the overhead of the warm Simpful / Prolog sandboxes on their own.
+
+Results are written as JSON together with the git commit and the configuration, so
+two runs can be compared:
+
+    python benchmark.py --queries 50 --concurrency 10 --output bench_new.json
+    python benchmark.py --output bench_new.json --compare bench_old.json
+
+With --stream the queries run through `stream_pipeline_async` and the time to the
+first summary token is reported too (use --token-ms to give tokens a generation time).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import fake_llm_server
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _latency_stats(values):
+    from tracing import percentile
+
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "max": None}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "max": max(values),
+    }
+
+
+class SpanCollector:
+    """Tracing exporter keeping the duration of every finished span by name."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.branches = defaultdict(list)
+        self.totals = defaultdict(float)
+
+    def __call__(self, span):
+        self.durations[span.name].append(span.duration)
+        if span.name == "pipeline":
+            self.branches[span.attributes.get("mode", "unknown")].append(span.duration)
+            self.durations["queue_wait"].append(span.attributes.get("queue_wait", 0.0))
+            for key in ("llm_calls", "cache_hits", "prompt_tokens", "cached_prompt_tokens", "completion_tokens"):
+                self.totals[key] += span.attributes.get(key, 0)
+
+
+async def _run_streamed(queries, concurrency, first_tokens):
+    """Like run_many_async, but streams every query and records its time to the first summary token."""
+    from pipeline import stream_pipeline_async
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(raw_context, raw_question):
+        async with semaphore:
+            first_token = None
+            async for event in stream_pipeline_async(raw_context, raw_question):
+                if event["type"] == "token" and first_token is None:
+                    first_token = event["elapsed"]
+                    first_tokens.append(first_token)
+                elif event["type"] == "result":
+                    return event["result"]
+
+    return await asyncio.gather(*(run_one(c, q) for c, q in queries), return_exceptions=True)
+
+
+def benchmark_end_to_end(queries, concurrency, warmup=0, verbose=False, stream=False):
+    import tracing
+    from pipeline import run_many_async
+    from scheduler import get_scheduler
+
+    collector = SpanCollector()
+    first_tokens = []
+    api_retries = []
+
+    def retried():
+        return sum(value for _, _, value in tracing.metrics.llm_retries.samples())
+
+    async def run():
+        # Untimed warm-up on the same event loop, so sandbox workers and the HTTP
+        # connection pool are up before measuring
+        if warmup:
+            with contextlib.redirect_stdout(io.StringIO()):
+                await run_many_async(queries[:warmup], max_in_flight=concurrency)
+        first_tokens.clear()
+        api_retries.append(retried())
+
+        tracing.add_exporter(collector)
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        started = time.perf_counter()
+        try:
+            with output:
+                if stream:
+                    results = await _run_streamed(queries, concurrency, first_tokens)
+                else:
+                    results = await run_many_async(queries, max_in_flight=concurrency)
+        finally:
+            tracing.remove_exporter(collector)
+        return results, time.perf_counter() - started
+
+    results, wall = asyncio.run(run())
+
+    failures = [r for r in results if isinstance(r, BaseException)]
+    return {
+        "queries": len(queries),
+        "failures": len(failures),
+        "failure_examples": sorted({f"{type(e).__name__}: {e}"[:200] for e in failures})[:5],
+        "wall_seconds": wall,
+        "queries_per_second": len(queries) / wall if wall else None,
+        "latency": _latency_stats(collector.durations["pipeline"]),
+        "first_token": _latency_stats(first_tokens) if stream else None,
+        "stages": {name: _latency_stats(values)
+                   for name, values in sorted(collector.durations.items()) if name != "pipeline"},
+        "branches": {mode: _latency_stats(values) for mode, values in sorted(collector.branches.items())},
+        "llm": dict(collector.totals, api_retries=retried() - api_retries[0]),
+        "scheduler": get_scheduler().stats(),
+        "queue_wait": _latency_stats(collector.durations.get("queue_wait", [])),
+    }
+
+
+def _time_calls(func, repeat):
+    durations, last = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        last = func()
+        durations.append(time.perf_counter() - started)
+    return durations, last
+
+
+def benchmark_sandboxes(repeat):
+    """Per-call latency of the warm sandboxes (the first call after start-up is reported apart)."""
+    from engine_tools import run_compiled_fuzzy, run_crisp_prolog, run_fuzzy_simpful, run_fuzzy_spec
+
+    report = {}
+    cases = {
+        "fuzzy": lambda: run_fuzzy_simpful(fake_llm_server.SYNTHETIC_SIMPFUL_CODE),
+        "fuzzy_spec": lambda: run_fuzzy_spec(fake_llm_server.SYNTHETIC_FUZZY_SPEC),
+        "fuzzy_compiled": lambda: run_compiled_fuzzy(fake_llm_server.SYNTHETIC_FUZZY_SPEC),
+        "crisp": lambda: run_crisp_prolog(**fake_llm_server.SYNTHETIC_PROLOG_PROGRAM),
+    }
+    for engine, call in cases.items():
+        first, last = _time_calls(call, 1)
+        if isinstance(last, dict) and last.get("error") == "engine_unavailable":
+            warm = first  # e.g. SWI-Prolog is not installed: nothing to warm up
+        else:
+            warm, last = _time_calls(call, repeat)
+        error = last.get("error") if isinstance(last, dict) else None
+        report[engine] = {
+            "first_call_seconds": first[0],
+            "warm": _latency_stats(warm),
+            "error": error,
+            "message": last.get("message") if error else None,
+        }
+    return report
+
+
+def load_queries(count):
+    cases = fake_llm_server.load_cases()
+    pairs = [(case["raw_context"], case["raw_question"]) for case in cases]
+    if count is None:
+        return pairs
+    return [pairs[i % len(pairs)] for i in range(count)]
+
+
+def _flatten(report, prefix=""):
+    flat = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(new, old):
+    """Print every numeric metric present in both reports with its relative change."""
+    new_flat, old_flat = _flatten(new["results"]), _flatten(old["results"])
+    print(f"{'metric':<55} {'old':>12} {'new':>12} {'change':>9}")
+    for name in sorted(new_flat.keys() & old_flat.keys()):
+        before, after = old_flat[name], new_flat[name]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{name:<55} {before:>12.4g} {after:>12.4g} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Fuzzy-LLM pipeline.")
+    parser.add_argument("--queries", type=int, default=None,
+                        help="number of queries (cycles through the known cases; default: each case once)")
+    parser.add_argument("--concurrency", type=int, default=10, help="queries in flight at once")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fake API latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="uniform +/- jitter of the latency")
+    parser.add_argument("--recordings", default=None, help="JSONL of recorded API responses to replay")
+    parser.add_argument("--warmup", type=int, default=None,
+                        help="untimed queries run first (default: the concurrency)")
+    parser.add_argument("--sandbox-repeat", type=int, default=20, help="calls per sandbox micro-benchmark")
+    parser.add_argument("--cache", action="store_true", help="keep the LLM response cache enabled")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="fake generation time per token")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of fake API requests answered with a 429 (retried by openai_clients)")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream the pipeline and measure the time to the first summary token")
+    parser.add_argument("--front", choices=("separate", "fused"), default="separate",
+                        help="rewrite/decide as separate calls or as one fused call")
+    parser.add_argument("--speculate", action="store_true",
+                        help="start the likely reasoning branches while the mode is decided")
+    parser.add_argument("--semantic-cache", action="store_true",
+                        help="reuse the results of near-duplicate queries (fresh index in a temp dir)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="earlier benchmark JSON to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    args = parser.parse_args()
+
+    server, base_url = fake_llm_server.start_server(
+        recordings_path=args.recordings, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        token_ms=args.token_ms, error_rate=args.error_rate)
+
+    # Must be set before the OpenAI clients are created (at import of the pipeline modules)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+    os.environ["FUZZY_LLM_ROUTER_LOG"] = "off"  # fake decisions must not become router training data
+    if not args.cache:
+        os.environ["FUZZY_LLM_CACHE"] = "off"
+    os.environ["FUZZY_LLM_FRONT"] = args.front
+    os.environ["FUZZY_LLM_SPECULATE"] = "on" if args.speculate else "off"
+    os.environ["FUZZY_LLM_SEMANTIC_CACHE"] = "on" if args.semantic_cache else "off"
+    if args.semantic_cache:
+        os.environ["FUZZY_LLM_SEMANTIC_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "semantic_cache.npz")
+
+    from engine_tools import get_prolog_pool, get_simpful_pool
+    get_simpful_pool().start()
+    get_prolog_pool().start()
+
+    queries = load_queries(args.queries)
+    print(f"Running {len(queries)} queries against {base_url} (concurrency {args.concurrency})...")
+    results = {
+        "end_to_end": benchmark_end_to_end(
+            queries, args.concurrency,
+            warmup=args.concurrency if args.warmup is None else args.warmup,
+            verbose=args.verbose, stream=args.stream),
+        "sandbox": benchmark_sandboxes(args.sandbox_repeat),
+    }
+    server.shutdown()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    e2e = results["end_to_end"]
+    print(f"{e2e['queries']} queries ({e2e['failures']} failed) in {e2e['wall_seconds']:.2f}s "
+          f"-> {e2e['queries_per_second']:.2f} queries/s, "
+          f"p50 {e2e['latency']['p50'] or 0:.3f}s, p95 {e2e['latency']['p95'] or 0:.3f}s")
+    if e2e["first_token"]:
+        print(f"first summary token: p50 {e2e['first_token']['p50'] or 0:.3f}s, "
+              f"p95 {e2e['first_token']['p95'] or 0:.3f}s")
+    for engine, stats in results["sandbox"].items():
+        print(f"{engine} sandbox: first call {stats['first_call_seconds']:.3f}s, warm p50 {stats['warm']['p50']:.4f}s"
+              + (f" (skipped: {stats['message']})" if stats["error"] == "engine_unavailable"
+                 else f" (error: {stats['error']})" if stats["error"] else ""))
+    print(f"Saved benchmark to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,427 @@
+import asyncio
+import contextvars
+import functools
 import os
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai.types.chat import ChatCompletion
+from openai.types.responses import ParsedResponse
+from llm_cache import acached_call, adiscard, cached_call, discard
+from openai_clients import get_async_client, get_client
+import tracing
 import json
-from engine_tools import TOOL_DEFINITIONS,run_crisp_prolog,run_fuzzy_simpful
-from prompts import CRISP_PROLOG_GENERATOR_PROMPT, NO_LOGIC_PROMPT,FUZZY_SIMPFUL_GENERATOR_PROMPT
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from engine_tools import TOOL_DEFINITIONS,run_compiled_fuzzy,run_crisp_prolog,run_known_fuzzy,run_fuzzy_simpful
+from fuzzy_batch import batch_spec_errors
+from fuzzy_system_cache import evaluate_cached
+from fuzzy_spec import FuzzySpec, spec_errors
+from prompt_layout import chat_messages, user_content
+from prompts import CRISP_PROLOG_GENERATOR_PROMPT, NO_LOGIC_PROMPT,FUZZY_SIMPFUL_GENERATOR_PROMPT,FUZZY_SPEC_GENERATOR_PROMPT
+client = get_client()
+async_client = get_async_client()
 
 MAX_RETRIES = 3
 
+# How the fuzzy branch asks the LLM for a model:
+#   "code" - a complete Simpful Python program
+#   "spec" - a declarative FIS spec (fuzzy_spec.py), compiled once per rule base
+#            and cached (fuzzy_system_cache.py); opt-in
+FUZZY_MODE = os.getenv("FUZZY_LLM_FUZZY_MODE", "code")
+
+# Fuzzy candidates generated and run in parallel as the first attempt; the sequential
+# repair loop only runs when none of them succeeds (1 = one program at a time)
+FUZZY_CANDIDATES = int(os.getenv("FUZZY_LLM_FUZZY_CANDIDATES", 1))
+# "first": use the first candidate that runs successfully
+# "majority": wait for all candidates and use the largest group of agreeing results
+FUZZY_CANDIDATE_SELECTION = os.getenv("FUZZY_LLM_FUZZY_SELECTION", "first")
+FUZZY_AGREEMENT_TOLERANCE = 0.05  # relative difference of outputs still counted as agreeing
+
+# Threads that wait on the sandbox workers for the async pipeline; the workers
+# themselves bound the real parallelism, these threads only block on their pipes.
+sandbox_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="sandbox")
+
+
+def _run_in_sandbox_executor(func, *args, **kwargs):
+    # Run in the caller's context so tracing spans nest under the current query
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(
+        sandbox_executor, functools.partial(context.run, func, *args, **kwargs)
+    )
+
+
+# Requests keep the static prompt first and the per-query text last, so the prefix
+# stays byte-identical across queries and retries (see prompt_layout.py)
+
+def _no_logic_request(clean_question, clean_context):
+    return dict(
+            model="gpt-4o-mini",
+            messages=chat_messages(NO_LOGIC_PROMPT, user_content("no_logic", clean_context, clean_question)),
+            temperature=0.8
+        )
+
+
+def _fuzzy_request(clean_question, clean_context, last_error=None):
+    feedback = None
+    if last_error:
+        feedback = f"{last_error}\n\nFix the code and regenerate a corrected version."
+
+    content = user_content("codegen", clean_context, clean_question,
+                           ("The previous code FAILED with this error", feedback))
+    return dict(
+        model="gpt-4o-mini",
+        messages=chat_messages(FUZZY_SIMPFUL_GENERATOR_PROMPT, content),
+        temperature=0.4
+    )
+
+
+def _describe_columns(inputs):
+    lines = []
+    for name, column in inputs.items():
+        values = [float(v) for v in column]
+        value_range = f"range [{min(values):g}, {max(values):g}]" if values else "no rows"
+        lines.append(f"- {name}: {len(values)} rows, {value_range}")
+    return "\n".join(lines)
+
+
+def _fuzzy_spec_request(clean_question, clean_context, last_error=None, inputs=None):
+    columns = feedback = None
+    if inputs is not None:
+        columns = (
+            "The system will be evaluated over many rows of input data. Use exactly these input "
+            "variables; their values are supplied per row, so 'values' is ignored:\n"
+            f"{_describe_columns(inputs)}"
+        )
+    if last_error:
+        feedback = f"{last_error}\n\nFix the spec and return a corrected version."
+
+    content = user_content("codegen", clean_context, clean_question,
+                           ("Input data", columns), ("The previous spec FAILED with this error", feedback))
+    return dict(
+        model="gpt-4o-mini",
+        input=chat_messages(FUZZY_SPEC_GENERATOR_PROMPT, content),
+        text_format=FuzzySpec,
+        temperature=0.4
+    )
+
+
+def _invalid_spec(message):
+    return {
+        "success": False,
+        "output": None,
+        "error": message,
+        "results": None
+    }
+
+
+def _checked_spec(response):
+    """Return (spec dict, None), or (None, failed result) when the spec can't be compiled."""
+    spec = response.output_parsed
+    if spec is None:
+        return None, _invalid_spec("The response did not contain a fuzzy spec.")
+
+    errors = spec_errors(spec)
+    if errors:
+        return None, _invalid_spec("Invalid fuzzy spec:\n" + "\n".join(errors))
+
+    return spec.model_dump(), None
+
+
+def _unless_failed(result, response_type, request):
+    """
+    Return `result`; if it failed, drop the cached response it was generated from, so
+    a rerun (e.g. evaluate.py resuming errored cases) samples a new program instead
+    of replaying the failing one and its retries.
+    """
+    if not result.get("success"):
+        discard(response_type, **request)
+    return result
+
+
+async def _unless_failed_async(result, response_type, request):
+    """Async version of `_unless_failed`."""
+    if not result.get("success"):
+        await adiscard(response_type, **request)
+    return result
+
+
+def _fuzzy_attempt(clean_question, clean_context, last_error):
+    """
+    One generate-and-run round of the fuzzy branch (spec or code, see FUZZY_MODE).
+    Retries (with `last_error` feedback) are fresh samples, never cached.
+    """
+    if FUZZY_MODE == "spec":
+        request = _fuzzy_spec_request(clean_question, clean_context, last_error)
+        response = cached_call(client.responses.parse, ParsedResponse[FuzzySpec],
+                               bypass=last_error is not None, **request)
+        spec, failed = _checked_spec(response)
+        return _unless_failed(failed or run_compiled_fuzzy(spec, clean_context, clean_question), ParsedResponse[FuzzySpec], request)
+
+    request = _fuzzy_request(clean_question, clean_context, last_error)
+    response = cached_call(client.chat.completions.create, ChatCompletion,
+                           bypass=last_error is not None, **request)
+    code = response.choices[0].message.content.strip()
+    return _unless_failed(run_fuzzy_simpful(code), ChatCompletion, request)
+
+
+async def _fuzzy_attempt_async(clean_question, clean_context, last_error):
+    """Async version of `_fuzzy_attempt`."""
+    if FUZZY_MODE == "spec":
+        request = _fuzzy_spec_request(clean_question, clean_context, last_error)
+        response = await acached_call(async_client.responses.parse, ParsedResponse[FuzzySpec],
+                                      bypass=last_error is not None, **request)
+        spec, failed = _checked_spec(response)
+        result = failed or await _run_in_sandbox_executor(run_compiled_fuzzy, spec, clean_context, clean_question)
+        return await _unless_failed_async(result, ParsedResponse[FuzzySpec], request)
+
+    request = _fuzzy_request(clean_question, clean_context, last_error)
+    response = await acached_call(async_client.chat.completions.create, ChatCompletion,
+                                  bypass=last_error is not None, **request)
+    code = response.choices[0].message.content.strip()
+    return await _unless_failed_async(await _run_in_sandbox_executor(run_fuzzy_simpful, code), ChatCompletion, request)
+
+
+##### PARALLEL FUZZY CANDIDATES #####
+
+def _spec_candidate(clean_question, clean_context, index):
+    # only the first candidate may be replayed from the cache; the others are fresh samples
+    request = _fuzzy_spec_request(clean_question, clean_context)
+    response = cached_call(client.responses.parse, ParsedResponse[FuzzySpec], bypass=index > 0, **request)
+    spec, failed = _checked_spec(response)
+    return _unless_failed(failed or run_compiled_fuzzy(spec, clean_context, clean_question), ParsedResponse[FuzzySpec], request)
+
+
+async def _spec_candidate_async(clean_question, clean_context, index):
+    request = _fuzzy_spec_request(clean_question, clean_context)
+    response = await acached_call(async_client.responses.parse, ParsedResponse[FuzzySpec], bypass=index > 0,
+                                  **request)
+    spec, failed = _checked_spec(response)
+    result = failed or await _run_in_sandbox_executor(run_compiled_fuzzy, spec, clean_context, clean_question)
+    return await _unless_failed_async(result, ParsedResponse[FuzzySpec], request)
+
+
+def _candidate_codes(response):
+    return [choice.message.content.strip() for choice in response.choices]
+
+
+def _agree(a, b):
+    """Whether two fuzzy results give the same outputs (numbers within FUZZY_AGREEMENT_TOLERANCE)."""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return a == b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(a - b) <= FUZZY_AGREEMENT_TOLERANCE * max(1.0, abs(a), abs(b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_agree(a[name], b[name]) for name in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(map(_agree, a, b))
+    return a == b
+
+
+def _select_candidate(results, count):
+    """
+    The result to use from the candidates that finished, or None if none succeeded.
+    Records the number of candidates and successes on the current span.
+    """
+    succeeded = [result for result in results if result.get("success")]
+    tracing.set_attributes(fuzzy_candidates=count, fuzzy_candidates_ok=len(succeeded))
+    if not succeeded:
+        return None
+    if FUZZY_CANDIDATE_SELECTION != "majority":
+        return succeeded[0]
+
+    groups = []
+    for result in succeeded:
+        for group in groups:
+            if _agree(group[0]["results"], result["results"]):
+                group.append(result)
+                break
+        else:
+            groups.append([result])
+    best = max(groups, key=len)  # ties go to the group that finished first
+    tracing.set_attributes(fuzzy_candidates_agreeing=len(best))
+    return best[0]
+
+
+def _last_candidate_error(results):
+    errors = [result.get("error") for result in results if not result.get("success")]
+    return next((error for error in errors if error), "Unknown execution error")
+
+
+def _fuzzy_candidates(clean_question, clean_context):
+    """
+    Generate FUZZY_CANDIDATES fuzzy models and run them in parallel: with one
+    `n=k` request for Simpful code, or k concurrent requests for specs (the
+    Responses API has no `n`).
+
+    Returns:
+        tuple: (selected result or None, error of a failed candidate or None)
+    """
+    if FUZZY_MODE == "spec":
+        jobs = [functools.partial(_spec_candidate, clean_question, clean_context, i)
+                for i in range(FUZZY_CANDIDATES)]
+    else:
+        request = dict(_fuzzy_request(clean_question, clean_context), n=FUZZY_CANDIDATES)
+        response = cached_call(client.chat.completions.create, ChatCompletion, **request)
+        jobs = [functools.partial(run_fuzzy_simpful, code) for code in _candidate_codes(response)]
+
+    futures = [sandbox_executor.submit(contextvars.copy_context().run, job) for job in jobs]
+    results = []
+    for future in as_completed(futures):
+        results.append(future.result())
+        if FUZZY_CANDIDATE_SELECTION != "majority" and results[-1].get("success"):
+            break
+    for future in futures:
+        future.cancel()
+
+    selected = _select_candidate(results, len(jobs))
+    if selected is None and FUZZY_MODE != "spec":
+        discard(ChatCompletion, **request)  # spec candidates discard their own
+    return selected, None if selected else _last_candidate_error(results)
+
+
+async def _fuzzy_candidates_async(clean_question, clean_context):
+    """Async version of `_fuzzy_candidates`."""
+    if FUZZY_MODE == "spec":
+        jobs = [_spec_candidate_async(clean_question, clean_context, i) for i in range(FUZZY_CANDIDATES)]
+    else:
+        request = dict(_fuzzy_request(clean_question, clean_context), n=FUZZY_CANDIDATES)
+        response = await acached_call(async_client.chat.completions.create, ChatCompletion, **request)
+        jobs = [_run_in_sandbox_executor(run_fuzzy_simpful, code) for code in _candidate_codes(response)]
+
+    tasks = [asyncio.ensure_future(job) for job in jobs]
+    results = []
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            results.append(await next_result)
+            if FUZZY_CANDIDATE_SELECTION != "majority" and results[-1].get("success"):
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    selected = _select_candidate(results, len(tasks))
+    if selected is None and FUZZY_MODE != "spec":
+        await adiscard(ChatCompletion, **request)
+    return selected, None if selected else _last_candidate_error(results)
+
+
+def _batch_result(spec, key, results):
+    return {
+        "engine": "numpy",
+        "success": True,
+        "rows": len(next(iter(results.values()), [])),
+        "spec": spec,
+        "system_key": key,
+        "results": results
+    }
+
+
+def _checked_batch_spec(response, inputs):
+    """Like `_checked_spec`, with the input values taken from the `inputs` columns."""
+    spec = response.output_parsed
+    if spec is None:
+        return None, _invalid_spec("The response did not contain a fuzzy spec.")
+
+    errors = batch_spec_errors(spec, inputs)
+    if errors:
+        return None, _invalid_spec("Invalid fuzzy spec:\n" + "\n".join(errors))
+
+    return spec.model_dump(), None
+
+
+def _fuzzy_failure(last_error):
+    return {
+        "engine": "simpful",
+        "success": False,
+        "error": "generation_failed",
+        "message": "LLM failed to generate a working Simpful model after retries.",
+        "last_error": last_error
+    }
+
+
+def _crisp_messages(reasoning_mode, clean_question, clean_context):
+    # retries append to these messages, so every attempt extends the same prefix
+    return chat_messages(CRISP_PROLOG_GENERATOR_PROMPT,
+                         user_content("codegen", clean_context, clean_question, ("Reasoning Mode", reasoning_mode)))
+
+
+def _crisp_request(messages):
+    return dict(
+        model="gpt-4o-mini",
+        messages=messages,
+        tools=TOOL_DEFINITIONS,
+        temperature=0.9
+    )
+
+
+def _crisp_feedback(messages, msg, result):
+    """Append the failed attempt and its runtime error so the LLM can fix the program."""
+    error_feedback = (
+        "The generated  program failed at runtime.\n\n"
+        f"Error:\n{result['message']}\n\n"
+        "You must fix the program\n"
+        "Ensure:\n"
+        "- Use correct fuzzy or crisp syntax\n"
+    )
+
+    messages.append({
+        "role": "assistant",
+        "content": msg.content or ""
+    })
+    messages.append({
+        "role": "user",
+        "content": error_feedback
+    })
+
+
+def _crisp_failure():
+    return {
+        "error": "max_retries_exceeded",
+        "message": "Failed to generate valid Prolog after multiple attempts."
+    }
+
+
+@tracing.traced("inference")
 def inference(reasoning_mode,clean_question,clean_context):
-    system_prompt = NO_LOGIC_PROMPT
 
     if reasoning_mode=='no':
-
-        user_helper=(
-    
-            f"The question is:\n{clean_question}\n"
-            f"The context is:\n{clean_context}\n"
-            f"Please summarize and solve it in textual manner and return the answer"
-            )
-        response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": NO_LOGIC_PROMPT},
-                    {"role": "user", "content": user_helper}
-                ],
-                temperature=0.8
-            )
+        # a sampled answer (temperature 0.8): not replayed from the cache
+        response = cached_call(client.chat.completions.create, ChatCompletion, bypass=True,
+                               **_no_logic_request(clean_question, clean_context))
         final_summary = response.choices[0].message.content.strip()
         return final_summary
 
 
 
     # Combining 2 tools into single prompt, made LLM often hallucinate, that's why after decision of reasoning mode we act similarly
-    # for fuzzy and 'no' cases, we call external tools in those cases, but not through LLM. 
-    # during those steps we incorporate: code execution + Structured output for decision making + result interpretation by LLM 
+    # for fuzzy and 'no' cases, we call external tools in those cases, but not through LLM.
+    # during those steps we incorporate: code execution + Structured output for decision making + result interpretation by LLM
     # I wanted to still leave tool calling, that's why for crisp reasoning decision we still use tool calling, however in this
     # case LLM has only 1 tool and smaller system prompt, in this way we avoid hallucination, which was caused by large system prompt
-    # since for simpful I included some examples of code in system prompt and also 2 tool decision making was also harder. 
+    # since for simpful I included some examples of code in system prompt and also 2 tool decision making was also harder.
     if reasoning_mode == 'fuzzy':
 
-        system_prompt = FUZZY_SIMPFUL_GENERATOR_PROMPT
-
-        base_user_content = (
-            "Context:\n"
-            f"{clean_context}\n\n"
-            "Question:\n"
-            f"{clean_question}\n\n"
-            "Return ONLY executable Python code using the SIMPFUL library.\n"
-            "- No explanations\n"
-            "- No markdown\n"
-            "- Code must run as-is\n"
-        )
-
-        
         last_error = None
+        first_attempt = 1
 
-        for attempt in range(1, MAX_RETRIES + 1):
-
-            if last_error:
-                user_content = (
-                    base_user_content
-                    + "\n\nThe previous code FAILED with this error:\n"
-                    + f"{last_error}\n\n"
-                    + "Fix the code and regenerate a corrected version."
-                )
-            else:
-                user_content = base_user_content
+        # ---- SAME QUERY WITH OTHER NUMBERS SEEN BEFORE: NO GENERATION ----
+        if FUZZY_MODE == "spec":
+            result = run_known_fuzzy(clean_context, clean_question)
+            if result is not None:
+                return result
 
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_content}
-                ],
-                temperature=0.4
-            )
+        # ---- PARALLEL CANDIDATES FIRST ----
+        if FUZZY_CANDIDATES > 1:
+            print(f"\n[ATTEMPT 1] RUNNING {FUZZY_CANDIDATES} FUZZY SIMPFUL {FUZZY_MODE.upper()} CANDIDATES\n")
+            result, last_error = _fuzzy_candidates(clean_question, clean_context)
+            if result is not None:
+                return result
+            print(f"[ATTEMPT 1] All candidates failed: {last_error}")
+            tracing.record_retry()
+            first_attempt = 2
 
-            code = response.choices[0].message.content.strip()
+        for attempt in range(first_attempt, MAX_RETRIES + 1):
 
-            print(f"\n[ATTEMPT {attempt}] RUNNING FUZZY SIMPFUL CODE\n")
-           # print(code)
+            print(f"\n[ATTEMPT {attempt}] RUNNING FUZZY SIMPFUL {FUZZY_MODE.upper()}\n")
 
-            result = run_fuzzy_simpful(code)
+            result = _fuzzy_attempt(clean_question, clean_context, last_error)
 
             # ---- SUCCESS PATH ----
             if result.get("success"):
@@ -90,35 +430,21 @@ def inference(reasoning_mode,clean_question,clean_context):
             # ---- FAILURE -> RETRY ----
             last_error = result.get("error") or "Unknown execution error"
             print(f"[ATTEMPT {attempt}] Failed: {last_error}")
+            tracing.record_retry()
 
         # ---- ALL RETRIES FAILED ----
-        return {
-            "engine": "simpful",
-            "success": False,
-            "error": "generation_failed",
-            "message": "LLM failed to generate executable Simpful code after retries.",
-            "last_error": last_error
-        }
-
+        return _fuzzy_failure(last_error)
 
-    
-    else:
-        system_prompt=CRISP_PROLOG_GENERATOR_PROMPT
 
-    messages=[{"role": "system", "content": system_prompt},
-            {"role": "user", "content":f"Context: {clean_context}\nQuestion: {clean_question}\n Reasoning Mode: {reasoning_mode}, if reasoning mode is crisp, call crisp_prolog tool, but by all means call tool!"}
-            ]
+    messages = _crisp_messages(reasoning_mode, clean_question, clean_context)
     # print(len(TOOL_DEFINITIONS1), "MY LEEENGTH!")
     for attempt in range(1, MAX_RETRIES + 1):
 
         print(f"\n=== LOGIC GENERATION ATTEMPT {attempt} ===")
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            tools=TOOL_DEFINITIONS,
-            temperature=0.9
-        )
+        # only the first attempt may be replayed; retries depend on the error they fix
+        request = _crisp_request(messages)
+        response = cached_call(client.chat.completions.create, ChatCompletion, bypass=attempt > 1, **request)
 
         msg = response.choices[0].message
 
@@ -150,22 +476,10 @@ def inference(reasoning_mode,clean_question,clean_context):
             # -------------------------
             # FAILURE -> feedback to LLM
             # -------------------------
-            error_feedback = (
-                "The generated  program failed at runtime.\n\n"
-                f"Error:\n{result['message']}\n\n"
-                "You must fix the program\n"
-                "Ensure:\n"
-                "- Use correct fuzzy or crisp syntax\n"
-            )
-
-            messages.append({
-                "role": "assistant",
-                "content": msg.content or ""
-            })
-            messages.append({
-                "role": "user",
-                "content": error_feedback
-            })
+            if attempt == 1:
+                discard(ChatCompletion, **request)  # before the feedback extends `messages`
+            _crisp_feedback(messages, msg, result)
+            tracing.record_retry()
 
         else:
             # LLM didn't call a tool
@@ -175,10 +489,155 @@ def inference(reasoning_mode,clean_question,clean_context):
     # -------------------------
     # Hard fallback
     # -------------------------
-    return {
-        "error": "max_retries_exceeded",
-        "message": "Failed to generate valid Prolog after multiple attempts."
-    }
+    return _crisp_failure()
+
+
+@tracing.traced("inference")
+async def inference_async(reasoning_mode, clean_question, clean_context):
+    """
+    Async version of `inference`: LLM calls use the AsyncOpenAI client and sandbox
+    execution (Simpful / Prolog workers) runs on `sandbox_executor`, so many queries
+    can be in flight in one process.
+    """
+    if reasoning_mode == 'no':
+        response = await acached_call(async_client.chat.completions.create, ChatCompletion, bypass=True,
+                                      **_no_logic_request(clean_question, clean_context))
+        return response.choices[0].message.content.strip()
+
+    if reasoning_mode == 'fuzzy':
+
+        last_error = None
+        first_attempt = 1
+
+        if FUZZY_MODE == "spec":
+            result = await _run_in_sandbox_executor(run_known_fuzzy, clean_context, clean_question)
+            if result is not None:
+                return result
+
+        if FUZZY_CANDIDATES > 1:
+            print(f"\n[ATTEMPT 1] RUNNING {FUZZY_CANDIDATES} FUZZY SIMPFUL {FUZZY_MODE.upper()} CANDIDATES\n")
+            result, last_error = await _fuzzy_candidates_async(clean_question, clean_context)
+            if result is not None:
+                return result
+            print(f"[ATTEMPT 1] All candidates failed: {last_error}")
+            tracing.record_retry()
+            first_attempt = 2
+
+        for attempt in range(first_attempt, MAX_RETRIES + 1):
+
+            print(f"\n[ATTEMPT {attempt}] RUNNING FUZZY SIMPFUL {FUZZY_MODE.upper()}\n")
+
+            result = await _fuzzy_attempt_async(clean_question, clean_context, last_error)
+
+            if result.get("success"):
+                return result
+
+            last_error = result.get("error") or "Unknown execution error"
+            print(f"[ATTEMPT {attempt}] Failed: {last_error}")
+            tracing.record_retry()
+
+        return _fuzzy_failure(last_error)
+
+    messages = _crisp_messages(reasoning_mode, clean_question, clean_context)
+    for attempt in range(1, MAX_RETRIES + 1):
+
+        print(f"\n=== LOGIC GENERATION ATTEMPT {attempt} ===")
+
+        request = _crisp_request(messages)
+        response = await acached_call(async_client.chat.completions.create, ChatCompletion,
+                                      bypass=attempt > 1, **request)
+
+        msg = response.choices[0].message
+
+        if not msg.tool_calls:
+            print("TOOL CALL NOT USED!")
+            return msg.content
+
+        call = msg.tool_calls[0]
+        name = call.function.name
+        args = json.loads(call.function.arguments)
+
+        print(f"Calling tool: {name}")
+        print("Args:", args)
+        if name != "run_crisp_prolog":
+            return {
+                "error": "unknown_tool",
+                "message": name
+            }
+
+        result = await _run_in_sandbox_executor(run_crisp_prolog, **args)
+
+        if "error" not in result:
+            print("Execution successful.")
+            return result
+
+        if attempt == 1:
+            await adiscard(ChatCompletion, **request)
+        _crisp_feedback(messages, msg, result)
+        tracing.record_retry()
+
+    return _crisp_failure()
+
+
+@tracing.traced("inference_batch")
+def inference_batch(clean_question, clean_context, inputs):
+    """
+    Fuzzy inference of one question over many input rows (e.g. scoring every player
+    with the same rules): the LLM generates a single FIS spec, which is then evaluated
+    vectorized over all rows (see fuzzy_batch.py).
+
+    Args:
+        inputs: columnar input data {input variable: list of values}
+
+    Returns:
+        dict: {engine, success, rows, spec, results: {output variable: list of values}}
+        or a failure dict like the fuzzy branch of `inference`
+    """
+    last_error = None
+
+    for attempt in range(1, MAX_RETRIES + 1):
+
+        request = _fuzzy_spec_request(clean_question, clean_context, last_error, inputs)
+        response = cached_call(client.responses.parse, ParsedResponse[FuzzySpec],
+                               bypass=last_error is not None, **request)
+        spec, failed = _checked_batch_spec(response, inputs)
+
+        if spec is not None:
+            try:
+                return _batch_result(spec, *evaluate_cached(spec, inputs))
+            except ValueError as e:
+                failed = _invalid_spec(str(e))
+        _unless_failed(failed, ParsedResponse[FuzzySpec], request)
+
+        last_error = failed["error"]
+        print(f"[ATTEMPT {attempt}] Failed: {last_error}")
+        tracing.record_retry()
+
+    return _fuzzy_failure(last_error)
+
+
+@tracing.traced("inference_batch")
+async def inference_batch_async(clean_question, clean_context, inputs):
+    """Async version of `inference_batch`; the evaluation runs on `sandbox_executor`."""
+    last_error = None
+
+    for attempt in range(1, MAX_RETRIES + 1):
+
+        request = _fuzzy_spec_request(clean_question, clean_context, last_error, inputs)
+        response = await acached_call(async_client.responses.parse, ParsedResponse[FuzzySpec],
+                                      bypass=last_error is not None, **request)
+        spec, failed = _checked_batch_spec(response, inputs)
+
+        if spec is not None:
+            try:
+                key, results = await _run_in_sandbox_executor(evaluate_cached, spec, inputs)
+                return _batch_result(spec, key, results)
+            except ValueError as e:
+                failed = _invalid_spec(str(e))
+        await _unless_failed_async(failed, ParsedResponse[FuzzySpec], request)
+
+        last_error = failed["error"]
+        print(f"[ATTEMPT {attempt}] Failed: {last_error}")
+        tracing.record_retry()
 
-            
-   
\ No newline at end of file
+    return _fuzzy_failure(last_error)
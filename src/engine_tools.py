@@ -1,16 +1,60 @@
-from pyswip import Prolog
-import os
-from pyswip.prolog import PrologError
-import re
-import subprocess
-import sys
-import tempfile
 import os
+import threading
+from fuzzy_system_cache import evaluate_cached, evaluate_system, get_system_cache
+from prolog_analysis import PrologSyntaxError, check_program, is_ground, parse_term, prepare_program
+from sandbox_pool import WorkerPool, WorkerTimeout, WorkerUnavailable
+from simpful_analysis import code_errors
+import tracing
+
+
+# Warm sandbox workers: interpreter startup and the simpful/numpy/scipy (or SWI-Prolog)
+# import are paid once per worker instead of once per generated program.
+SIMPFUL_POOL_SIZE = 4
+SIMPFUL_MAX_JOBS_PER_WORKER = 50
+SIMPFUL_MEMORY_LIMIT_MB = 2048
+
+PROLOG_POOL_SIZE = 4
+PROLOG_MAX_JOBS_PER_WORKER = 200
+PROLOG_MEMORY_LIMIT_MB = 2048
+PROLOG_TIME_LIMIT = 10  # seconds per query
+PROLOG_INFERENCE_LIMIT = 10_000_000  # inferences per query
+PROLOG_MAX_SOLUTIONS = 100  # solutions collected per query
+PROLOG_SOLUTION_TIME_SHARE = 0.8  # of the time limit spent searching for more solutions
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def _get_pool(script: str, size: int, max_jobs_per_worker: int, memory_limit_mb: int) -> WorkerPool:
+    with _pool_lock:
+        if script not in _pools:
+            _pools[script] = WorkerPool(
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), script),
+                size=size,
+                max_jobs_per_worker=max_jobs_per_worker,
+                memory_limit_mb=memory_limit_mb,
+            )
+        return _pools[script]
+
 
+def get_simpful_pool() -> WorkerPool:
+    """Return the process-wide Simpful worker pool (created on first use)."""
+    return _get_pool("simpful_worker.py", SIMPFUL_POOL_SIZE,
+                     SIMPFUL_MAX_JOBS_PER_WORKER, SIMPFUL_MEMORY_LIMIT_MB)
 
+
+def get_prolog_pool() -> WorkerPool:
+    """Return the process-wide Prolog worker pool (created on first use)."""
+    return _get_pool("prolog_worker.py", PROLOG_POOL_SIZE,
+                     PROLOG_MAX_JOBS_PER_WORKER, PROLOG_MEMORY_LIMIT_MB)
+
+
+@tracing.traced("run_fuzzy_simpful")
 def run_fuzzy_simpful(code: str, timeout: int = 23):
     """
-    Executes LLM-generated Simpful Python code in a safe subprocess.
+    Executes LLM-generated Simpful Python code in a warm sandboxed worker process.
+    Programs with mistakes found statically (see simpful_analysis.py) are rejected
+    without using a worker.
     
     Args:
         code: Complete Python code string with simpful
@@ -21,56 +65,43 @@ def run_fuzzy_simpful(code: str, timeout: int = 23):
             "success": bool,
             "output": str (stdout),
             "error": str (stderr if any),
-            "results": dict (parsed results if available)
+            "results": dict returned by FS.inference() (a list of dicts if the code
+                       ran inference several times, None if it never did)
         }
     """
+    errors = code_errors(code)
+    if errors:
+        tracing.metrics.static_rejections.inc(engine="simpful")
+        return {
+            "success": False,
+            "output": None,
+            "error": "Static check failed:\n" + "\n".join(errors),
+            "results": None
+        }
+
     try:
-        # Create temporary file for the code
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            temp_file = f.name
-            f.write(code)
-        
-        # Execute in subprocess
-        result = subprocess.run(
-            [sys.executable, temp_file],
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
-        
-        # Clean up
-        os.unlink(temp_file)
-        
-        stdout = result.stdout.strip()
-        stderr = result.stderr.strip()
-        
-        # Try to parse numeric results from output
-        parsed_results = {}
-        if stdout:
-            # Look for dictionary-like output or key-value pairs
-            # Example: "{'variable': 0.75}" or "variable: 0.75"
-            try:
-                # Try eval for dict output
-                if '{' in stdout and '}' in stdout:
-                    dict_match = re.search(r'\{[^}]+\}', stdout)
-                    if dict_match:
-                        parsed_results = eval(dict_match.group())
-            except:
-                # Try regex for key-value pairs
-                matches = re.findall(r'(\w+)[:=]\s*([\d.]+)', stdout)
-                parsed_results = {k: float(v) for k, v in matches}
-        
+        result = get_simpful_pool().run({"code": code}, timeout=timeout)
+        tracing.record_sandbox_usage("simpful", result.get("_usage"))
+
+        stdout = result["stdout"].strip()
+        stderr = result["stderr"].strip()
+
+        # Inference results come typed from the worker, not from parsing stdout
+        inference_results = result.get("results") or []
+        if len(inference_results) == 1:
+            parsed_results = inference_results[0]
+        else:
+            parsed_results = inference_results or None
+
         return {
-            "success": result.returncode == 0,
+            "success": result["returncode"] == 0,
             "output": stdout,
             "error": stderr if stderr else None,
-            "results": parsed_results if parsed_results else None
+            "results": parsed_results
         }
 
         
-    except subprocess.TimeoutExpired:
-        if os.path.exists(temp_file):
-            os.unlink(temp_file)
+    except WorkerTimeout:
         return {
             "success": False,
             "output": None,
@@ -78,8 +109,6 @@ def run_fuzzy_simpful(code: str, timeout: int = 23):
             "results": None
         }
     except Exception as e:
-        if os.path.exists(temp_file):
-            os.unlink(temp_file)
         return {
             "success": False,
             "output": None,
@@ -88,15 +117,124 @@ def run_fuzzy_simpful(code: str, timeout: int = 23):
         }
 
 
-##### CRISP PROLOG REASONING #####
+@tracing.traced("run_fuzzy_spec")
+def run_fuzzy_spec(spec: dict, timeout: int = 10):
+    """
+    Compiles a declarative FIS spec (see fuzzy_spec.py) into a Simpful FuzzySystem
+    and runs inference in a warm sandboxed worker process.
+
+    Args:
+        spec: `FuzzySpec` as a dict (already checked with `fuzzy_spec.spec_errors`)
+        timeout: Maximum execution time in seconds
 
-prolog = Prolog()
+    Returns:
+        dict: same shape as `run_fuzzy_simpful`; "results" maps every output
+        variable to its crisp value
+    """
+    try:
+        result = get_simpful_pool().run({"spec": spec}, timeout=timeout)
+        tracing.record_sandbox_usage("simpful", result.get("_usage"))
 
+        stderr = result["stderr"].strip()
+        return {
+            "success": result["returncode"] == 0,
+            "output": str(result["results"]) if result["results"] is not None else "",
+            "error": stderr if stderr else None,
+            "results": result["results"]
+        }
+
+    except WorkerTimeout:
+        return {
+            "success": False,
+            "output": None,
+            "error": f"Execution timeout after {timeout} seconds",
+            "results": None
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "output": None,
+            "error": str(e),
+            "results": None
+        }
+
+
+@tracing.traced("run_compiled_fuzzy")
+def run_compiled_fuzzy(spec: dict, context: str = None, question: str = None):
+    """
+    Evaluates a declarative FIS spec with its cached compiled system (see
+    fuzzy_system_cache.py): a rule base seen before is neither rebuilt nor reparsed,
+    and no sandbox is needed since the spec contains no code.
+
+    Args:
+        spec: `FuzzySpec` as a dict (already checked with `fuzzy_spec.spec_errors`)
+        context, question: the query the spec was generated for; if given, a later
+            query with the same text and other numbers reuses the system
+            (see `run_known_fuzzy`)
+
+    Returns:
+        dict: same shape as `run_fuzzy_simpful`, plus "system_key" to evaluate the same
+        system for other inputs with `fuzzy_system_cache.evaluate_system`
+    """
+    inputs = {value["variable"]: [value["value"]] for value in spec["values"]}
+    try:
+        key, columns = evaluate_cached(spec, inputs)
+    except Exception as e:
+        return {
+            "success": False,
+            "output": None,
+            "error": str(e),
+            "results": None
+        }
+
+    if context is not None:
+        get_system_cache().remember_context(context, question, spec, key)
+    return _compiled_result(key, columns)
+
+
+def run_known_fuzzy(context: str, question: str):
+    """
+    Answers a fuzzy query without generating a spec when a query with the same text
+    and other numbers was answered before (see fuzzy_system_cache.lookup_context):
+    its compiled system is evaluated with this query's numbers as inputs.
+
+    Returns:
+        dict: a result like `run_compiled_fuzzy`, or None if the query is not known
+    """
+    known = get_system_cache().lookup_context(context, question)
+    if known is None:
+        return None
+
+    key, inputs = known
+    try:
+        columns = evaluate_system(key, inputs)
+    except Exception:
+        return None  # the stored mapping does not fit the system any more
+    if columns is None:
+        return None  # system evicted
+    tracing.set_attributes(system_cache="context")
+    return _compiled_result(key, columns)
+
+
+def _compiled_result(key, columns):
+    results = {name: values[0] for name, values in columns.items()}
+    return {
+        "success": True,
+        "output": str(results),
+        "error": None,
+        "results": results,
+        "system_key": key
+    }
+
+
+##### CRISP PROLOG REASONING #####
 
 # used for correct interpretation of crisp prolog results
-def normalize_prolog_result(raw_results):
+def normalize_prolog_result(raw_results, truncated: bool = False):
     """
-    Normalize PySwip query results into logical semantics.
+    Normalize query solutions (one binding dict per solution) into logical semantics.
+    Bindings are returned column-wise, {variable: [value per solution]}, which keeps
+    large result sets compact in the summary prompt.
     """
     if not raw_results:
         return {
@@ -106,7 +244,7 @@ def normalize_prolog_result(raw_results):
         }
 
     # Ground query succeeded
-    if raw_results == [{}]:
+    if all(not solution for solution in raw_results):
         return {
             "success": True,
             "bindings": None,
@@ -114,45 +252,161 @@ def normalize_prolog_result(raw_results):
         }
 
     # Variable bindings exist
-    return {
+    result = {
         "success": True,
-        "bindings": raw_results,
+        "bindings": {name: [solution.get(name) for solution in raw_results] for name in raw_results[0]},
+        "solutions": len(raw_results),
         "explanation": "Query succeeded with variable bindings."
     }
+    if truncated:
+        result["truncated"] = True
+        result["explanation"] = (f"Query succeeded with variable bindings; stopped after "
+                                 f"{len(raw_results)} solutions (more may exist).")
+    return result
+
+
+def _is_ground_query(query: str) -> bool:
+    try:
+        return is_ground(parse_term(query))
+    except PrologSyntaxError:
+        return False
 
 
-def run_crisp_prolog(program: str=None, query: str=None):
+class CrispSolutionStream:
+    """
+    Solutions of a crisp query, streamed from a Prolog worker while it is still
+    searching. Iterating yields one compact binding dict per solution ({"X": "bob"},
+    or {} for a ground query that succeeded); stopping early frees the search.
+
+    Once iteration has ended, `error` / `message` are set if the query failed
+    ("engine_unavailable" if SWI-Prolog could not be started), and `truncated`
+    tells whether it stopped at `max_solutions` or the time limit (solutions
+    found before a timeout are kept).
+    """
+
+    def __init__(self, job: dict, time_limit: float, run_stream=None):
+        self.job = job
+        self.time_limit = time_limit
+        self.count = 0
+        self.truncated = False
+        self.error = None
+        self.message = None
+        self.warnings = []  # what the static check could not read (SWI-Prolog decides)
+        self._run_stream = run_stream or get_prolog_pool().stream
+
+    def __iter__(self):
+        if self.error:
+            return
+
+        batches = self._run_stream(dict(self.job, stream=True), self.time_limit)
+        try:
+            while True:
+                try:
+                    batch = next(batches)
+                except StopIteration as stop:
+                    response = stop.value
+                    break
+                for solution in batch:
+                    self.count += 1
+                    yield solution
+        except WorkerTimeout:
+            response = {
+                "error": "resource_exceeded",
+                "message": f"Query did not finish within {self.time_limit} seconds."
+            }
+        except WorkerUnavailable as e:
+            response = {"error": "engine_unavailable", "message": str(e)}
+        except Exception as e:
+            response = {"error": "prolog_runtime_error", "message": str(e)}
+        finally:
+            batches.close()
+
+        tracing.record_sandbox_usage("prolog", response.get("_usage"))
+        if response.get("error") == "resource_exceeded" and self.count:
+            self.truncated = True  # keep what was found before the limit
+        elif "error" in response:
+            if response["error"] == "invalid_program":  # undefined predicates, found by the worker
+                tracing.metrics.static_rejections.inc(engine="prolog")
+            self.error, self.message = response["error"], response["message"]
+        else:
+            self.truncated = response["truncated"]
+
+
+def stream_crisp_prolog(program: str = None, query: str = None,
+                        max_solutions: int = PROLOG_MAX_SOLUTIONS,
+                        time_limit: int = PROLOG_TIME_LIMIT,
+                        inference_limit: int = PROLOG_INFERENCE_LIMIT) -> CrispSolutionStream:
+    """
+    Run a Prolog program and query like `run_crisp_prolog`, but return the solutions
+    lazily as a `CrispSolutionStream`.
+
+    Args:
+        max_solutions: stop after this many solutions (None for no limit); ground
+            (yes/no) queries always stop at the first one
+        time_limit: seconds for the whole query; the search for further solutions
+            stops after PROLOG_SOLUTION_TIME_SHARE of it
+    """
+    stream = CrispSolutionStream({"program": program, "query": query}, time_limit)
     if not program or not query:
-        return {
-            "engine": "crisp_prolog",
-            "error": "invalid_input",
-            "message": "Program or query is missing."
-        }
+        stream.error, stream.message = "invalid_input", "Program or query is missing."
+        return stream
 
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".pl", delete=False) as f:
-        f.write(program)
-        temp_file = f.name
+    errors, stream.warnings = check_program(program, query)
+    if stream.warnings:
+        tracing.set_attributes(prolog_warnings="\n".join(stream.warnings))
+    if errors:
+        tracing.metrics.static_rejections.inc(engine="prolog")
+        stream.error, stream.message = "invalid_program", "Static check failed:\n" + "\n".join(errors)
+        return stream
 
-    try:
-        prolog.consult(temp_file)
-        results = list(prolog.query(query))
+    program, tabled = prepare_program(program)
+    if tabled:
+        tracing.set_attributes(tabled=",".join(tabled))
+    if _is_ground_query(query):
+        max_solutions = 1  # yes/no: no need to look for alternative proofs
 
-        return {
-            "engine": "crisp_prolog",
-            "results": normalize_prolog_result(results)
-        }
+    stream.job.update(program=program, inference_limit=inference_limit,
+                      max_solutions=max_solutions, time_budget=time_limit * PROLOG_SOLUTION_TIME_SHARE)
+    return stream
 
-    except PrologError as e:
+
+@tracing.traced("run_crisp_prolog")
+def run_crisp_prolog(program: str=None, query: str=None,
+                     time_limit: int = PROLOG_TIME_LIMIT,
+                     inference_limit: int = PROLOG_INFERENCE_LIMIT,
+                     max_solutions: int = PROLOG_MAX_SOLUTIONS):
+    """
+    Runs an LLM-generated Prolog program and query in an isolated Prolog worker.
+
+    Every program is consulted into its own throwaway module of a pooled worker
+    process, so concurrent calls neither share clauses nor contend for one engine.
+    Programs with non-callable clause heads, or calling predicates that the worker's
+    engine neither defines nor can autoload, are rejected before they are consulted
+    (see prolog_analysis.check_program); text the static reader cannot parse is only
+    reported under "warnings". Recursive predicates are
+    tabled first (see prolog_analysis.prepare_program), so left-recursive rules and
+    cyclic relations terminate. The query is aborted after
+    `time_limit` seconds or `inference_limit` inferences with a "resource_exceeded"
+    error; at most `max_solutions` solutions are collected.
+    """
+    stream = stream_crisp_prolog(program, query, max_solutions, time_limit, inference_limit)
+    solutions = list(stream)
+
+    if stream.error:
         return {
             "engine": "crisp_prolog",
-            "error": "prolog_runtime_error",
-            "message": str(e),
+            "error": stream.error,
+            "message": stream.message,
             "program": program,
-            "query": query
+            "query": query,
+            **({"warnings": stream.warnings} if stream.warnings else {})
         }
 
-    finally:
-        os.remove(temp_file)
+    return {
+        "engine": "crisp_prolog",
+        "results": normalize_prolog_result(solutions, stream.truncated),
+        **({"warnings": stream.warnings} if stream.warnings else {})
+    }
 
 
 
@@ -1,14 +1,21 @@
 import json
-from rewriter import rewrite_text, decide_reasoning_mode
-from decider import inference
-from openai import OpenAI
-from prompts import FINAL_PROMPT, EVALUATION_PROMPT
+from pipeline import run_pipeline
+from openai.types.chat import ParsedChatCompletion
+from llm_cache import cached_call
+from openai_clients import get_client
+from prompts import EVALUATION_PROMPT
 import os
+import tracing
+from batch_runner import POLL_SECONDS, BatchCollector, run_batched
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limiter import RateLimiter, set_rate_limiter
+from scheduler import lane
 from pydantic import BaseModel
 from typing import Literal
 import matplotlib.pyplot as plt
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_client()
 
 class EvaluationResult(BaseModel):
     score: Literal[0, 1]  # Restricted to exactly 0 or 1
@@ -21,37 +28,13 @@ def process_single_case(case_id, raw_context, raw_question, expected_answer):
     print(f"Processing Case ID: {case_id}")
     print(f"{'='*60}")
     
-    # Step 1: Rewrite text
-    clean_context = rewrite_text(raw_context)
-    clean_question = rewrite_text(raw_question)
-    
-    # Step 2: Decide reasoning mode
-    mode = decide_reasoning_mode(clean_context, clean_question)
-    print(f"[INFO] Reasoning mode: {mode}")
-    
-    # Step 3: Do Inference
-    program_result = inference(mode, clean_question, clean_context)
-    print(f"[INFO] Tool execution result: {program_result}")
-    
-    # Step 4: Summarize results in natural language
-    user_text = (
-        f"We did inference from the context:\n{clean_context}\n"
-        f"and the question:\n{clean_question}\n"
-        f"Reasoning mode used was \n{mode}\n"
-        f"The tool returned the following result:\n{program_result}\n"
-        f"Please summarize it in clear natural language for the user."
-    )
-    
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": FINAL_PROMPT},
-            {"role": "user", "content": user_text}
-        ],
-        temperature=0.7
-    )
-    
-    final_summary = response.choices[0].message.content.strip()
+    # Steps 1-4: Rewrite, decide reasoning mode, do inference, summarize
+    # (the judge needs the whole summary, so only stage progress is reported)
+    def report_progress(event):
+        if event["type"] == "stage":
+            print(f"[{case_id}] {event['stage']} done after {event['elapsed']:.2f}s")
+
+    final_summary = run_pipeline(raw_context, raw_question, on_event=report_progress)["final_summary"]
     print(f"\n[GENERATED SUMMARY]:\n{final_summary}")
     print(f"\n[EXPECTED ANSWER]:\n{expected_answer}")
     
@@ -61,7 +44,11 @@ def process_single_case(case_id, raw_context, raw_question, expected_answer):
         f"Expected Answer:\n{expected_answer}"
     )
     
-    eval_response = client.beta.chat.completions.parse(
+    # the verdict is sampled (temperature 0.9): a rerun asks the judge again
+    eval_response = cached_call(
+        client.beta.chat.completions.parse,
+        ParsedChatCompletion[EvaluationResult],
+        bypass=True,
         model="gpt-4o-mini",
         messages=[
             {"role": "system", "content": EVALUATION_PROMPT},
@@ -131,9 +118,67 @@ def generate_visualization(results, output_path):
     plt.close()
 
 
-def evaluate_from_json(json_file_path):
+def _run_case(case):
+    case_span = None
+    try:
+        # batch lane: interactive queries of the same process are served first
+        with lane("batch"), tracing.span("evaluation_case", case_id=case["id"]) as case_span:
+            result = process_single_case(
+                case_id=case["id"],
+                raw_context=case["raw_context"],
+                raw_question=case["raw_question"],
+                expected_answer=case["answer"]
+            )
+    except Exception as e:
+        print(f"\n[ERROR] Failed to process case {case['id']}: {str(e)}")
+        result = {
+            "id": case["id"],
+            "generated_summary": None,
+            "expected_answer": case["answer"],
+            "score": 0,
+            "error": str(e)
+        }
+
+    # Latency, token usage and cost of the whole case (pipeline + judge)
+    if case_span is not None:
+        result.update({
+            "latency_seconds": case_span.duration,
+            "prompt_tokens": case_span.attributes.get("prompt_tokens", 0),
+            "completion_tokens": case_span.attributes.get("completion_tokens", 0),
+            "cost_usd": case_span.attributes.get("cost_usd", 0.0),
+        })
+    return result
+
+
+def _latency_summary(durations):
+    return {
+        "count": len(durations),
+        "p50_seconds": tracing.percentile(durations, 0.50),
+        "p95_seconds": tracing.percentile(durations, 0.95),
+    }
+
+
+def load_checkpoint(checkpoint_path):
+    """Return {case_id: result} for the cases that already finished without error."""
+    finished = {}
+    if not os.path.exists(checkpoint_path):
+        return finished
+
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # partially written last line of a crashed run
+            if "error" not in result:
+                finished[result["id"]] = result
+    return finished
+
+
+def evaluate_from_json(json_file_path, workers=4, requests_per_minute=None,
+                       tokens_per_minute=None, resume=True, batch=False, poll_seconds=POLL_SECONDS):
     """
-    Load test cases from JSON file and evaluate each one.
+    Load test cases from JSON file and evaluate them concurrently.
     
     Expected JSON format:
     [
@@ -145,6 +190,15 @@ def evaluate_from_json(json_file_path):
         },
         ...
     ]
+
+    Every finished case is appended to `<name>_checkpoint.jsonl` right away; with
+    `resume` the cases already recorded there (without error) are not run again.
+    `requests_per_minute` / `tokens_per_minute` limit the OpenAI traffic of the run.
+
+    With `batch` the LLM calls go through the Batch API instead, stage by stage for
+    all cases (see batch_runner.py; batch files in `<name>_batch/`): half the cost,
+    results within hours. Latencies are then meaningless and not reported, and tokens
+    and cost are those of the batches this run collected.
     """
     
     # Load test cases
@@ -152,34 +206,73 @@ def evaluate_from_json(json_file_path):
         test_cases = json.load(f)
     
     print(f"Loaded {len(test_cases)} test cases from {json_file_path}")
-    
-    results = []
-    
-    # Process each test case
-    for case in test_cases:
-        try:
-            result = process_single_case(
-                case_id=case["id"],
-                raw_context=case["raw_context"],
-                raw_question=case["raw_question"],
-                expected_answer=case["answer"]
-            )
-            results.append(result)
-        except Exception as e:
-            print(f"\n[ERROR] Failed to process case {case['id']}: {str(e)}")
-            results.append({
-                "id": case["id"],
-                "generated_summary": None,
-                "expected_answer": case["answer"],
-                "score": 0,
-                "error": str(e)
-            })
+
+    if requests_per_minute or tokens_per_minute:
+        set_rate_limiter(RateLimiter(requests_per_minute, tokens_per_minute))
+
+    checkpoint_path = json_file_path.replace('.json', '_checkpoint.jsonl')
+    finished = load_checkpoint(checkpoint_path) if resume else {}
+    if not resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    pending = [case for case in test_cases if case["id"] not in finished]
+    if finished:
+        print(f"Resuming: {len(test_cases) - len(pending)} cases already finished")
+
+    # Per-stage latencies of this run, and every span to <name>_traces.jsonl
+    stage_durations = defaultdict(list)
+
+    def collect_stage(span):
+        stage_durations[span.name].append(span.duration)
+
+    trace_exporter = tracing.JSONLExporter(json_file_path.replace('.json', '_traces.jsonl'))
+    tracing.add_exporter(collect_stage)
+    tracing.add_exporter(trace_exporter)
+
+    # Process test cases concurrently, checkpointing each one as soon as it finishes
+    collector = BatchCollector(json_file_path.replace('.json', '_batch')) if batch else None
+    try:
+        with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+            def save(result):
+                checkpoint.write(json.dumps(result, ensure_ascii=False) + "\n")
+                checkpoint.flush()
+                finished[result["id"]] = result
+
+            if batch:
+                batched = run_batched({case["id"]: case for case in pending}, _run_case, collector,
+                                      workers=workers, poll_seconds=poll_seconds)
+                for result in batched.values():
+                    # the case span only covers the last replay (see batch_runner.py)
+                    for key in ("latency_seconds", "prompt_tokens", "completion_tokens", "cost_usd"):
+                        result.pop(key, None)
+                    save(result)
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(_run_case, case) for case in pending]
+                    for future in as_completed(futures):
+                        save(future.result())
+    finally:
+        tracing.remove_exporter(collect_stage)
+        tracing.remove_exporter(trace_exporter)
+
+    results = [finished[case["id"]] for case in test_cases if case["id"] in finished]
     
     # Calculate overall statistics
     total = len(results)
     passed = sum(1 for r in results if r["score"] == 1)
     failed = total - passed
     accuracy = (passed / total * 100) if total > 0 else 0
+
+    latency = _latency_summary([r["latency_seconds"] for r in results if "latency_seconds" in r])
+    latency["stages"] = {name: _latency_summary(durations)
+                         for name, durations in sorted(stage_durations.items())}
+    prompt_tokens = sum(r.get("prompt_tokens", 0) for r in results)
+    completion_tokens = sum(r.get("completion_tokens", 0) for r in results)
+    cost = sum(r.get("cost_usd", 0.0) for r in results)
+    if collector is not None:
+        prompt_tokens = collector.usage["prompt_tokens"]
+        completion_tokens = collector.usage["completion_tokens"]
+        cost = collector.usage["cost_usd"]
     
     print("\n" + "="*60)
     print("EVALUATION SUMMARY")
@@ -188,6 +281,9 @@ def evaluate_from_json(json_file_path):
     print(f"Passed: {passed}")
     print(f"Failed: {failed}")
     print(f"Accuracy: {accuracy:.2f}%")
+    if latency["count"]:
+        print(f"Latency p50/p95: {latency['p50_seconds']:.2f}s / {latency['p95_seconds']:.2f}s")
+    print(f"Tokens: {prompt_tokens} prompt + {completion_tokens} completion, cost ${cost:.4f}")
     print("="*60)
     
     # Save results to JSON file
@@ -198,7 +294,10 @@ def evaluate_from_json(json_file_path):
                 "total": total,
                 "passed": passed,
                 "failed": failed,
-                "accuracy": accuracy
+                "accuracy": accuracy,
+                "latency": latency,
+                "tokens": {"prompt": prompt_tokens, "completion": completion_tokens},
+                "cost_usd": cost
             },
             "results": results
         }, f, indent=2, ensure_ascii=False)
@@ -213,11 +312,21 @@ def evaluate_from_json(json_file_path):
 
 
 if __name__ == "__main__":
-    import sys
-    
-    if len(sys.argv) < 2:
-        print("Usage: python evaluate_results.py <path_to_test_cases.json>")
-        sys.exit(1)
-    
-    json_file = sys.argv[1]
-    evaluate_from_json(json_file)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate the pipeline with an LLM judge.")
+    parser.add_argument("json_file", help="path to the test cases JSON file")
+    parser.add_argument("--workers", type=int, default=4, help="cases evaluated concurrently")
+    parser.add_argument("--rpm", type=float, default=None, help="max OpenAI requests per minute")
+    parser.add_argument("--tpm", type=float, default=None, help="max OpenAI tokens per minute")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="ignore the checkpoint of a previous run and start over")
+    parser.add_argument("--batch", action="store_true",
+                        help="send the LLM calls through the Batch API (half the cost, results within 24h)")
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS,
+                        help="delay between status checks of a batch (with --batch)")
+    args = parser.parse_args()
+
+    evaluate_from_json(args.json_file, workers=args.workers, requests_per_minute=args.rpm,
+                       tokens_per_minute=args.tpm, resume=not args.no_resume,
+                       batch=args.batch, poll_seconds=args.poll_seconds)
\ No newline at end of file
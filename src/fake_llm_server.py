@@ -0,0 +1,630 @@
+"""
+Local stand-in for the OpenAI API, used to benchmark the pipeline offline.
+
+Point the OpenAI client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+It serves /v1/chat/completions and /v1/responses and answers each request, in order
+of preference, with:
+
+    1. an exact recorded response (JSONL file captured with --record from the real API)
+    2. a replay of the recorded outcome of a known case: the reasoning mode and final
+       summary logged in examples/Q*.txt, or the summaries of evaluation/*_results.json
+    3. a synthetic but well-formed answer for the pipeline stage the request belongs to
+       (recognized by its system prompt)
+
+Every answer is delayed by a configurable latency (plus, optionally, a delay per
+generated token), so the benchmark sees realistic round-trip times without paying for
+tokens. Chat completions requested with stream=true are sent as server-sent events,
+word by word.
+
+A stub of the Batch API (/v1/files, /v1/batches) answers uploaded JSONL batches the
+same way; a batch reports "completed" --batch-ms after it was created, and
+--batch-error-rate of its requests fail with a transient 500 (see batch_runner.py).
+
+    python fake_llm_server.py --port 8765 --latency-ms 300
+    python fake_llm_server.py --port 8765 --record recordings.jsonl --upstream https://api.openai.com
+"""
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import prompts
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SYNTHETIC_SIMPFUL_CODE = '''from simpful import *
+
+FS = FuzzySystem(show_banner=False)
+
+S_1 = FuzzySet(function=Trapezoidal_MF(0, 0, 0.3, 0.5), term="low")
+S_2 = FuzzySet(function=Triangular_MF(0.3, 0.5, 0.7), term="medium")
+S_3 = FuzzySet(function=Trapezoidal_MF(0.5, 0.7, 1, 1), term="high")
+FS.add_linguistic_variable("evidence", LinguisticVariable([S_1, S_2, S_3], universe_of_discourse=[0, 1]))
+
+O_1 = FuzzySet(function=Triangular_MF(0, 0, 0.5), term="unlikely")
+O_2 = FuzzySet(function=Triangular_MF(0, 0.5, 1), term="possible")
+O_3 = FuzzySet(function=Triangular_MF(0.5, 1, 1), term="likely")
+FS.add_linguistic_variable("outcome", LinguisticVariable([O_1, O_2, O_3], universe_of_discourse=[0, 1]))
+
+FS.add_rules([
+    "IF (evidence IS low) THEN (outcome IS unlikely)",
+    "IF (evidence IS medium) THEN (outcome IS possible)",
+    "IF (evidence IS high) THEN (outcome IS likely)"
+])
+
+FS.set_variable("evidence", 0.8)
+results = FS.inference()
+print(results)
+'''
+
+SYNTHETIC_FUZZY_SPEC = {
+    "inputs": [{
+        "name": "evidence",
+        "universe": [0, 1],
+        "terms": [
+            {"term": "low", "shape": "trapezoidal", "params": [0, 0, 0.3, 0.5]},
+            {"term": "medium", "shape": "triangular", "params": [0.3, 0.5, 0.7]},
+            {"term": "high", "shape": "trapezoidal", "params": [0.5, 0.7, 1, 1]},
+        ],
+    }],
+    "outputs": [{
+        "name": "outcome",
+        "universe": [0, 1],
+        "terms": [
+            {"term": "unlikely", "shape": "triangular", "params": [0, 0, 0.5]},
+            {"term": "possible", "shape": "triangular", "params": [0, 0.5, 1]},
+            {"term": "likely", "shape": "triangular", "params": [0.5, 1, 1]},
+        ],
+    }],
+    "rules": [
+        "IF (evidence IS low) THEN (outcome IS unlikely)",
+        "IF (evidence IS medium) THEN (outcome IS possible)",
+        "IF (evidence IS high) THEN (outcome IS likely)",
+    ],
+    "values": [{"variable": "evidence", "value": 0.8}],
+}
+
+SYNTHETIC_PROLOG_PROGRAM = {
+    "program": "fact(yes).\nanswer(X) :- fact(X).",
+    "query": "answer(X)",
+}
+
+
+def request_key(path: str, body: dict) -> str:
+    """Hash of an HTTP request body, used to match recorded responses (streamed or not)."""
+    body = {name: value for name, value in body.items() if name not in ("stream", "stream_options")}
+    canonical = json.dumps({"path": path, "body": body}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def load_cases():
+    """Known cases with their recorded outcomes (reasoning mode and/or final summary)."""
+    cases = []
+
+    for path in sorted(glob.glob(os.path.join(ROOT, "evaluation", "*.json"))):
+        if path.endswith("_results.json"):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            problems = json.load(f)
+
+        summaries = {}
+        results_path = path.replace(".json", "_results.json")
+        if os.path.exists(results_path):
+            with open(results_path, "r", encoding="utf-8") as f:
+                summaries = {r["id"]: r.get("generated_summary") for r in json.load(f)["results"]}
+
+        for problem in problems:
+            cases.append({
+                "id": problem["id"],
+                "raw_context": problem["raw_context"],
+                "raw_question": problem["raw_question"],
+                "answer": problem.get("answer"),
+                "mode": None,
+                "summary": summaries.get(problem["id"]) or problem.get("answer"),
+            })
+
+    for path in sorted(glob.glob(os.path.join(ROOT, "examples", "Q*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+
+        context = re.search(r'raw_context\s*=\s*"""(.*?)"""', text, re.S)
+        question = re.search(r'raw_question\s*=\s*"(.*?)"', text)
+        if not context or not question:
+            continue
+        mode = re.search(r"\[INFO\] Reasoning mode: (\w+)", text)
+        summary = re.search(r"=== FINAL SUMMARY ===\n(.*?)\n\s*\n", text, re.S)
+
+        cases.append({
+            "id": os.path.splitext(os.path.basename(path))[0],
+            "raw_context": context.group(1).strip(),
+            "raw_question": question.group(1).strip(),
+            "answer": None,
+            "mode": mode.group(1) if mode else None,
+            "summary": summary.group(1).strip() if summary else None,
+        })
+
+    return cases
+
+
+def _guess_mode(text: str) -> str:
+    lowered = text.lower()
+    if re.search(r"\d", lowered) and re.search(r"how (many|much|far|long)|total|cost|sum|average|probability|what time", lowered):
+        return "no"
+    if re.search(r"\b(if|all|every|is a|are)\b", lowered) and not re.search(r"very|quite|likely|degree|how (good|bad)", lowered):
+        return "crisp"
+    return "fuzzy"
+
+
+def _sample_from_schema(schema: dict, defs=None):
+    """Smallest value that validates against a (strict) JSON schema."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return _sample_from_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    if "anyOf" in schema:
+        return _sample_from_schema(schema["anyOf"][0], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _sample_from_schema(prop, defs)
+                for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return []
+    if kind == "string":
+        return ""
+    if kind in ("number", "integer"):
+        return schema.get("minimum", 0)
+    if kind == "boolean":
+        return False
+    return None
+
+
+class FakeLLM:
+    """Produces responses for the fake endpoints."""
+
+    def __init__(self, recordings_path=None, latency_ms=0.0, jitter_ms=0.0, token_ms=0.0, error_rate=0.0,
+                 seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_ms = token_ms
+        self.error_rate = error_rate
+        self.cases = load_cases()
+        self.recordings = {}
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+
+        if recordings_path and os.path.exists(recordings_path):
+            with open(recordings_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.recordings[record["key"]] = record["response"]
+
+    def delay(self, completion_tokens: int = 0):
+        """Time to the first token, plus `token_ms` per generated token."""
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep((max(0.0, self.latency_ms + jitter) + completion_tokens * self.token_ms) / 1000.0)
+
+    def rate_limited(self) -> bool:
+        """Whether to answer this request with a 429, as an overloaded API would (`error_rate`)."""
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _find_case(self, text: str):
+        for case in self.cases:
+            if case["raw_context"] and case["raw_context"] in text:
+                return case
+        return None
+
+    def _usage(self, prompt_text: str, completion_text: str):
+        return max(1, len(prompt_text) // 4), max(1, len(completion_text) // 4)
+
+    def _cached_tokens(self, system: str, body: dict) -> int:
+        """
+        Prompt tokens a provider would serve from its prefix cache: the static part
+        (tools, response schema, system prompt) once seen before, in 128-token steps
+        from 1024 tokens on.
+        """
+        prefix = json.dumps([body.get("tools"), body.get("response_format"), body.get("text")]) + system
+        with self._lock:
+            seen = prefix in self._seen_prefixes
+            self._seen_prefixes.add(prefix)
+        tokens = len(prefix) // 4
+        return tokens // 128 * 128 if seen and tokens >= 1024 else 0
+
+    # ---- stage answers ----
+
+    def _answer(self, system: str, user: str, body: dict):
+        """Return (content, tool_call) for a chat-style request."""
+        case = self._find_case(user)
+
+        if system == prompts.REWRITER_PROMPT:
+            return user, None
+        if system == prompts.FUZZY_SIMPFUL_GENERATOR_PROMPT:
+            return SYNTHETIC_SIMPFUL_CODE, None
+        if system == prompts.FUZZY_SPEC_GENERATOR_PROMPT:
+            return json.dumps(SYNTHETIC_FUZZY_SPEC), None
+        if system == prompts.CRISP_PROLOG_GENERATOR_PROMPT or body.get("tools"):
+            tool = body["tools"][0]["function"]["name"]
+            return None, {"name": tool, "arguments": json.dumps(SYNTHETIC_PROLOG_PROGRAM)}
+        if system == prompts.REWRITE_AND_ROUTE_PROMPT:
+            parts = re.match(r"Context:\n(.*)\n\nQuestion:\n(.*)", user, re.S)
+            context, question = parts.groups() if parts else (user, user)
+            mode = (case or {}).get("mode") or _guess_mode(user)
+            return json.dumps({"reasoning_mode": mode, "clean_context": context,
+                               "clean_question": question}), None
+        if system == prompts.REASONING_DECIDER_PROMPT:
+            mode = (case or {}).get("mode") or _guess_mode(user)
+            return json.dumps({"reasoning_mode": mode}), None
+        if system == prompts.EVALUATION_PROMPT:
+            return json.dumps({"score": 1}), None
+        if system in (prompts.FINAL_PROMPT, prompts.NO_LOGIC_PROMPT):
+            answer = (case or {}).get("summary") or (case or {}).get("answer")
+            return answer or "Based on the given context, the answer is yes.", None
+
+        schema = self._json_schema(body)
+        if schema is not None:
+            return json.dumps(_sample_from_schema(schema)), None
+        return "OK.", None
+
+    @staticmethod
+    def _json_schema(body: dict):
+        fmt = body.get("response_format") or (body.get("text") or {}).get("format")
+        if not fmt or fmt.get("type") != "json_schema":
+            return None
+        return (fmt.get("json_schema") or fmt).get("schema")
+
+    @staticmethod
+    def _split_messages(messages):
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        user = "\n".join(m["content"] for m in messages
+                         if m.get("role") == "user" and isinstance(m.get("content"), str))
+        return system, user
+
+    def chat_completion(self, body: dict) -> dict:
+        system, user = self._split_messages(body.get("messages", []))
+        choices = []
+        completion_text = ""
+        for index in range(body.get("n") or 1):
+            content, tool_call = self._answer(system, user, body)
+            message = {"role": "assistant", "content": content}
+            if tool_call:
+                message["tool_calls"] = [{
+                    "id": f"call_fake_{next(self._ids)}",
+                    "type": "function",
+                    "function": tool_call,
+                }]
+            choices.append({
+                "index": index,
+                "finish_reason": "tool_calls" if tool_call else "stop",
+                "message": message,
+            })
+            completion_text += content or json.dumps(tool_call)
+
+        prompt_tokens, completion_tokens = self._usage(system + user, completion_text)
+        return {
+            "id": f"chatcmpl-fake-{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": self._cached_tokens(system, body)},
+            },
+        }
+
+    def response(self, body: dict) -> dict:
+        system, user = self._split_messages(body.get("input", []))
+        content, _ = self._answer(system, user, body)
+
+        prompt_tokens, completion_tokens = self._usage(system + user, content)
+        return {
+            "id": f"resp_fake_{next(self._ids)}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": body.get("model", "fake"),
+            "status": "completed",
+            "output": [{
+                "id": f"msg_fake_{next(self._ids)}",
+                "type": "message",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": content, "annotations": []}],
+            }],
+            "parallel_tool_calls": True,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": {
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "input_tokens_details": {"cached_tokens": self._cached_tokens(system, body)},
+                "output_tokens_details": {"reasoning_tokens": 0},
+            },
+        }
+
+    def chat_chunks(self, completion: dict, include_usage: bool):
+        """Stream a chat.completion payload as chat.completion.chunk dicts, word by word."""
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion["id"], "object": "chat.completion.chunk",
+                "created": completion["created"], "model": completion["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        choice = completion["choices"][0]
+        message = choice["message"]
+        yield chunk({"role": "assistant", "content": ""})
+        for piece in re.findall(r"\S*\s*", message.get("content") or ""):
+            if piece:
+                time.sleep(max(1, len(piece) // 4) * self.token_ms / 1000.0)
+                yield chunk({"content": piece})
+        if message.get("tool_calls"):
+            yield chunk({"tool_calls": [dict(call, index=i) for i, call in enumerate(message["tool_calls"])]})
+        yield chunk({}, choice["finish_reason"])
+        if include_usage:
+            yield dict(chunk({}), choices=[], usage=completion.get("usage"))
+
+    def handle(self, path: str, body: dict) -> dict:
+        recorded = self.recordings.get(request_key(path, body))
+        if recorded is not None:
+            return recorded
+        if path.endswith("/chat/completions"):
+            return self.chat_completion(body)
+        if path.endswith("/responses"):
+            return self.response(body)
+        raise KeyError(path)
+
+
+##### BATCH API #####
+
+class FakeBatches:
+    """
+    Files and batches of the stub Batch API. A batch is answered line by line when it
+    is created (no latency) and reported as in progress until `batch_ms` have passed.
+    A share `error_rate` of its requests gets a 500, which the Batch API reports for
+    transient server errors; the requests are then sent again in a later batch.
+    """
+
+    def __init__(self, fake: FakeLLM, batch_ms: float = 1000.0, error_rate: float = 0.0, seed: int = 0):
+        self.fake = fake
+        self.batch_seconds = batch_ms / 1000.0
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.files = {}  # id -> (metadata, content)
+        self.batches = {}  # id -> (batch object, completion time)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _new_id(self, prefix):
+        with self._lock:
+            return f"{prefix}-fake{next(self._ids)}"
+
+    def upload(self, filename: str, purpose: str, content: bytes) -> dict:
+        metadata = {"id": self._new_id("file"), "object": "file", "bytes": len(content),
+                    "created_at": int(time.time()), "filename": filename, "purpose": purpose,
+                    "status": "processed"}
+        self.files[metadata["id"]] = (metadata, content)
+        return metadata
+
+    def content(self, file_id: str) -> bytes:
+        return self.files[file_id][1]
+
+    def create(self, body: dict) -> dict:
+        lines = [json.loads(line) for line in self.content(body["input_file_id"]).splitlines() if line.strip()]
+        outputs, errors = [], []
+        for line in lines:
+            result = {"id": self._new_id("batch_req"), "custom_id": line["custom_id"], "error": None}
+            with self._lock:
+                transient = self._random.random() < self.error_rate
+            if transient:
+                result["response"] = {"status_code": 500, "request_id": self._new_id("req"),
+                                      "body": {"error": {"message": "The server had an error (fake)"}}}
+                errors.append(result)
+                continue
+            try:
+                result["response"] = {"status_code": 200, "request_id": self._new_id("req"),
+                                      "body": self.fake.handle(line["url"], line["body"])}
+                outputs.append(result)
+            except KeyError:
+                result["response"] = {"status_code": 404, "request_id": self._new_id("req"),
+                                      "body": {"error": {"message": f"Unknown endpoint {line['url']}"}}}
+                errors.append(result)
+
+        def stored(results, name):
+            if not results:
+                return None
+            data = "".join(json.dumps(r) + "\n" for r in results).encode("utf-8")
+            return self.upload(name, "batch_output", data)["id"]
+
+        now = int(time.time())
+        batch = {"id": self._new_id("batch"), "object": "batch", "endpoint": body["endpoint"],
+                 "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+                 "created_at": now, "metadata": body.get("metadata"),
+                 "output_file_id": stored(outputs, "output.jsonl"), "error_file_id": stored(errors, "errors.jsonl"),
+                 "request_counts": {"total": len(lines), "completed": len(outputs), "failed": len(errors)}}
+        self.batches[batch["id"]] = (batch, time.time() + self.batch_seconds)
+        return self.retrieve(batch["id"])
+
+    def retrieve(self, batch_id: str) -> dict:
+        batch, done_at = self.batches[batch_id]
+        if time.time() < done_at:
+            return dict(batch, status="in_progress", output_file_id=None, error_file_id=None,
+                        request_counts=dict(batch["request_counts"], completed=0, failed=0))
+        return dict(batch, status="completed", completed_at=int(done_at))
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the default backlog of 5 drops connections under load
+
+
+def make_handler(fake: FakeLLM, record_path=None, upstream=None, batches=None):
+    record_lock = threading.Lock()
+    batches = batches or FakeBatches(fake)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # headers and body are separate writes
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload, headers=None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, chunks):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write(event):
+                data = event.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            for chunk in chunks:  # written as generated, not buffered
+                write(f"data: {json.dumps(chunk)}\n\n")
+            write("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _send_bytes(self, data):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _upload(self, data):
+            """multipart/form-data upload of /v1/files."""
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + data)
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            upload = fields["file"]
+            return batches.upload(upload.get_filename() or "upload.jsonl",
+                                  fields["purpose"].get_content().strip(), upload.get_payload(decode=True))
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            try:
+                if re.search(r"/files/[^/]+/content$", path):
+                    self._send_bytes(batches.content(path.split("/")[-2]))
+                elif re.search(r"/batches/[^/]+$", path):
+                    self._send(200, batches.retrieve(path.split("/")[-1]))
+                else:
+                    self._send(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+            except KeyError:
+                self._send(404, {"error": {"message": f"No such object: {self.path}"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            data = self.rfile.read(length)
+            if self.path.endswith("/files"):
+                self._send(200, self._upload(data))
+                return
+            body = json.loads(data or b"{}")
+            if self.path.endswith("/batches"):
+                try:
+                    self._send(200, batches.create(body))
+                except KeyError:
+                    self._send(404, {"error": {"message": f"No such file: {body.get('input_file_id')}"}})
+                return
+            streaming = bool(body.get("stream")) and self.path.endswith("/chat/completions")
+
+            if upstream:
+                # streamed requests are recorded (and replayed) as complete responses
+                forwarded = {k: v for k, v in body.items() if k not in ("stream", "stream_options")}
+                payload = self._forward(forwarded)
+                with record_lock, open(record_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": request_key(self.path, body), "response": payload}) + "\n")
+            else:
+                if fake.rate_limited():
+                    self._send(429, {"error": {"message": "Rate limit reached (fake)", "type": "requests",
+                                               "code": "rate_limit_exceeded"}},
+                               headers={"retry-after-ms": "200"})
+                    return
+                try:
+                    payload = fake.handle(self.path, body)
+                except KeyError:
+                    self._send(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+                    return
+                usage = payload.get("usage") or {}
+                fake.delay(0 if streaming else usage.get("completion_tokens") or usage.get("output_tokens") or 0)
+
+            if streaming:
+                include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+                self._send_stream(fake.chat_chunks(payload, include_usage))
+            else:
+                self._send(200, payload)
+
+        def _forward(self, body):
+            request = urllib.request.Request(
+                upstream.rstrip("/") + self.path,
+                data=json.dumps(body).encode("utf-8"),
+                headers={"Content-Type": "application/json",
+                         "Authorization": self.headers.get("Authorization", "")},
+            )
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+
+    return Handler
+
+
+def start_server(host="127.0.0.1", port=0, **fake_options):
+    """Start the fake server on a background thread; returns (server, base_url)."""
+    server = FakeServer((host, port), make_handler(FakeLLM(**fake_options)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI API for offline benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="delay of every response")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="uniform +/- jitter of the delay")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="extra delay per generated token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--batch-ms", type=float, default=1000.0, help="time until a stub batch completes")
+    parser.add_argument("--batch-error-rate", type=float, default=0.0,
+                        help="share of batch requests answered with a transient 500")
+    parser.add_argument("--recordings", default=None, help="JSONL file of recorded responses to replay")
+    parser.add_argument("--record", default=None, help="proxy to --upstream and append responses to this file")
+    parser.add_argument("--upstream", default=None, help="real API base URL used with --record")
+    args = parser.parse_args()
+
+    if bool(args.record) != bool(args.upstream):
+        parser.error("--record and --upstream must be used together")
+
+    fake = FakeLLM(recordings_path=args.recordings, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                   token_ms=args.token_ms, error_rate=args.error_rate)
+    server = FakeServer((args.host, args.port),
+                        make_handler(fake, args.record, args.upstream, FakeBatches(fake, args.batch_ms, args.batch_error_rate)))
+    print(f"Fake OpenAI API listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,191 @@
+"""
+Declarative fuzzy inference system (FIS) spec.
+
+Instead of writing a whole Simpful program, the LLM can return a compact JSON spec
+(linguistic variables with their membership functions, rules and input values). The
+spec is validated here and cannot fail on Python syntax errors. It is evaluated with
+the vectorized engine of fuzzy_batch.py, compiled once per rule base (see
+fuzzy_system_cache.py), or with Simpful itself inside a warm Simpful worker
+(`build_fuzzy_system`, used by simpful_worker.py).
+"""
+import hashlib
+import json
+import re
+from typing import List, Literal
+
+from pydantic import BaseModel
+
+MF_PARAMETER_COUNT = {"triangular": 3, "trapezoidal": 4, "gaussian": 2}
+
+_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_KEYWORDS = {"IF", "THEN", "IS", "AND", "OR", "NOT"}
+# Simpful evaluates parts of the rule text, so rules may only contain plain words and parentheses
+_RULE_CHARACTERS = re.compile(r"^[A-Za-z0-9_\s()]+$")
+_RULE = re.compile(r"^\s*IF\s+(.+?)\s+THEN\s+(.+?)\s*$")
+_CLAUSE = re.compile(r"\(\s*([A-Za-z_]\w*)\s+IS\s+([A-Za-z_]\w*)\s*\)")
+
+
+class FuzzySetSpec(BaseModel):
+    term: str
+    shape: Literal["triangular", "trapezoidal", "gaussian"]
+    params: List[float]  # triangular: a, b, c; trapezoidal: a, b, c, d; gaussian: mean, sigma
+
+
+class VariableSpec(BaseModel):
+    name: str
+    universe: List[float]  # [min, max]
+    terms: List[FuzzySetSpec]
+
+
+class InputValue(BaseModel):
+    variable: str
+    value: float
+
+
+class FuzzySpec(BaseModel):
+    inputs: List[VariableSpec]
+    outputs: List[VariableSpec]
+    rules: List[str]
+    values: List[InputValue]
+
+
+def _variable_errors(variable: VariableSpec) -> list:
+    errors = []
+    if not _NAME.match(variable.name) or variable.name.upper() in _KEYWORDS:
+        errors.append(f"Invalid variable name '{variable.name}' (use letters, digits and underscores).")
+    if len(variable.universe) != 2 or variable.universe[0] >= variable.universe[1]:
+        errors.append(f"Variable '{variable.name}': universe must be [min, max] with min < max.")
+    if not variable.terms:
+        errors.append(f"Variable '{variable.name}' has no terms.")
+
+    for fuzzy_set in variable.terms:
+        if not _NAME.match(fuzzy_set.term) or fuzzy_set.term.upper() in _KEYWORDS:
+            errors.append(f"Variable '{variable.name}': invalid term name '{fuzzy_set.term}'.")
+        expected = MF_PARAMETER_COUNT[fuzzy_set.shape]
+        if len(fuzzy_set.params) != expected:
+            errors.append(f"Term '{variable.name}.{fuzzy_set.term}': {fuzzy_set.shape} needs "
+                          f"{expected} params, got {len(fuzzy_set.params)}.")
+        elif fuzzy_set.shape == "gaussian":
+            if fuzzy_set.params[1] <= 0:
+                errors.append(f"Term '{variable.name}.{fuzzy_set.term}': sigma must be > 0.")
+        elif fuzzy_set.params != sorted(fuzzy_set.params):
+            errors.append(f"Term '{variable.name}.{fuzzy_set.term}': {fuzzy_set.shape} params must be "
+                          f"in non-decreasing order.")
+    return errors
+
+
+def spec_errors(spec: FuzzySpec) -> list:
+    """
+    Check a spec for everything Simpful would fail on at run time.
+
+    Returns:
+        list: human readable error messages (empty when the spec is valid)
+    """
+    errors = []
+    if not spec.inputs:
+        errors.append("At least one input variable is required.")
+    if not spec.outputs:
+        errors.append("At least one output variable is required.")
+    if not spec.rules:
+        errors.append("At least one rule is required.")
+
+    terms = {}
+    for variable in spec.inputs + spec.outputs:
+        errors.extend(_variable_errors(variable))
+        if variable.name in terms:
+            errors.append(f"Variable '{variable.name}' is defined twice.")
+        terms[variable.name] = {fuzzy_set.term for fuzzy_set in variable.terms}
+    inputs = {variable.name for variable in spec.inputs}
+    outputs = {variable.name for variable in spec.outputs}
+
+    for rule in spec.rules:
+        match = _RULE.match(rule) if _RULE_CHARACTERS.match(rule) else None
+        if not match:
+            errors.append(f"Rule '{rule}' must look like 'IF (x IS a) AND (y IS b) THEN (z IS c)'.")
+            continue
+
+        antecedent, consequent = match.groups()
+        for part, allowed, role in ((antecedent, inputs, "input"), (consequent, outputs, "output")):
+            clauses = _CLAUSE.findall(part)
+            if not clauses:
+                errors.append(f"Rule '{rule}': no '(variable IS term)' clause in '{part}'.")
+            for name, term in clauses:
+                if name not in allowed:
+                    errors.append(f"Rule '{rule}': '{name}' is not an {role} variable.")
+                elif term not in terms[name]:
+                    errors.append(f"Rule '{rule}': '{name}' has no term '{term}'.")
+
+    given = set()
+    for value in spec.values:
+        if value.variable not in inputs:
+            errors.append(f"Value given for unknown input variable '{value.variable}'.")
+            continue
+        given.add(value.variable)
+        universe = next(v.universe for v in spec.inputs if v.name == value.variable)
+        if len(universe) != 2:
+            continue
+        low, high = universe
+        if not low <= value.value <= high:
+            errors.append(f"Value {value.value} of '{value.variable}' is outside its universe [{low}, {high}].")
+    for name in sorted(inputs - given):
+        errors.append(f"No value given for input variable '{name}'.")
+
+    return errors
+
+
+def normalize_spec(spec) -> dict:
+    """
+    Canonical form of the rule base and membership functions of a spec (a `FuzzySpec`
+    or its dict): input values dropped, variables and terms sorted by name, numbers as
+    floats, rules with collapsed whitespace, deduplicated and sorted.
+    """
+    spec = spec.model_dump() if isinstance(spec, FuzzySpec) else spec
+
+    def variables(items):
+        return [{
+            "name": variable["name"],
+            "universe": [float(x) for x in variable["universe"]],
+            "terms": sorted(({"term": s["term"], "shape": s["shape"], "params": [float(x) for x in s["params"]]}
+                             for s in variable["terms"]), key=lambda s: s["term"]),
+        } for variable in sorted(items, key=lambda v: v["name"])]
+
+    return {
+        "inputs": variables(spec["inputs"]),
+        "outputs": variables(spec["outputs"]),
+        "rules": sorted({" ".join(rule.split()) for rule in spec["rules"]}),
+    }
+
+
+def system_key(spec) -> str:
+    """Hash identifying the fuzzy system of a spec independently of its input values."""
+    canonical = json.dumps(normalize_spec(spec), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+##### WORKER SIDE #####
+
+def build_fuzzy_system(spec: dict):
+    """Compile a (validated) spec dict into a ready-to-infer `simpful.FuzzySystem`."""
+    from simpful import (FuzzySet, FuzzySystem, Gaussian_MF, LinguisticVariable,
+                         Trapezoidal_MF, Triangular_MF)
+
+    functions = {"triangular": Triangular_MF, "trapezoidal": Trapezoidal_MF, "gaussian": Gaussian_MF}
+
+    fs = FuzzySystem(show_banner=False)
+    for variable in spec["inputs"] + spec["outputs"]:
+        fuzzy_sets = [FuzzySet(function=functions[s["shape"]](*s["params"]), term=s["term"])
+                      for s in variable["terms"]]
+        fs.add_linguistic_variable(
+            variable["name"],
+            LinguisticVariable(fuzzy_sets, universe_of_discourse=variable["universe"]),
+        )
+    fs.add_rules(spec["rules"])
+    for value in spec["values"]:
+        fs.set_variable(value["variable"], value["value"])
+    return fs
+
+
+def evaluate_spec(spec: dict) -> dict:
+    """Run Mamdani inference for a spec dict; returns {output variable: crisp value}."""
+    results = build_fuzzy_system(spec).inference()
+    return {name: float(value) for name, value in results.items()}
@@ -0,0 +1,221 @@
+"""
+Cache of compiled fuzzy systems, keyed by their normalized rule base.
+
+Different queries over the same domain often produce the same fuzzy system and only
+differ in the input values. Systems are identified by `fuzzy_spec.system_key`, a
+hash of the normalized variables, membership functions and rules, and kept compiled
+(`BatchFuzzySystem`: sampled membership functions and parsed rules) in an in-memory
+LRU. Their normalized specs are also stored in SQLite (`.cache/fuzzy_systems.sqlite`,
+LRU eviction by size), so after a restart a known system is recompiled from disk
+without asking the LLM again.
+
+Callers that already hold a key (returned as "system_key" by the fuzzy branch) can
+evaluate new input values directly with `evaluate_system`, skipping generation,
+sandbox and rule parsing altogether.
+
+The fuzzy branch does this by itself for contexts it has effectively seen before.
+After a spec was evaluated, `remember_context` stores the query's template (context
+and question, lowercased, numbers replaced by "#") with the system key and the
+position of the number each input value was taken from. A later query with the same
+template, e.g. the same player description with other statistics, is answered by
+`lookup_context` and `evaluate_system` with its own numbers as inputs, without
+generating a spec. Numbers that were not inputs (scales, thresholds) must be the same
+as before, since the rule base may depend on them, and the new inputs must lie inside
+the universes of the stored system (outside them every membership is 0, so the output
+would be a meaningless default); otherwise the spec is generated as usual. Queries whose input values can't be
+traced to exactly one number of the text are not remembered.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+import tracing
+from fuzzy_batch import BatchFuzzySystem
+from fuzzy_spec import normalize_spec, system_key
+from llm_cache import MemoryLRUCache, SQLiteCache
+
+DEFAULT_SYSTEM_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "fuzzy_systems.sqlite"
+)
+DEFAULT_COMPILED_ENTRIES = 256
+DEFAULT_SYSTEM_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_SYSTEM_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_CONTEXT_ENTRIES = 1024
+
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.]*\d)")
+
+
+def context_template(context: str, question: str):
+    """
+    (template key, numbers) of a query: a hash of its lowercased text with whitespace
+    collapsed and numbers replaced by "#", and the numbers in order of appearance.
+    """
+    text = " ".join(f"{context}\n{question}".lower().split())
+    numbers = [float(match) for match in _NUMBER.findall(text)]
+    template = _NUMBER.sub("#", text)
+    return hashlib.sha256(template.encode("utf-8")).hexdigest(), numbers
+
+
+def input_positions(spec, numbers):
+    """
+    {input variable: index into `numbers`} for the input values of a spec, or None if
+    a value does not occur exactly once among the numbers (it was derived, not quoted).
+    """
+    positions = {}
+    for value in spec["values"]:
+        matches = [i for i, number in enumerate(numbers) if number == float(value["value"])]
+        if len(matches) != 1:
+            return None
+        positions[value["variable"]] = matches[0]
+    return positions
+
+
+class FuzzySystemCache:
+    """
+    Compiled systems in an in-memory LRU, backed by a store of normalized specs
+    (any object with get(key) / set(key, value), e.g. `SQLiteCache`; None for memory only).
+    """
+
+    def __init__(self, store=None, max_compiled: int = DEFAULT_COMPILED_ENTRIES):
+        self.store = store
+        self._compiled = MemoryLRUCache(max_compiled)
+        self._contexts = MemoryLRUCache(DEFAULT_CONTEXT_ENTRIES)
+
+    def get(self, key: str):
+        """Return the compiled system for `key`, or None if it is unknown."""
+        system = self._compiled.get(key)
+        if system is not None:
+            tracing.set_attributes(system_cache="memory")
+            return system
+
+        stored = self.store.get(key) if self.store is not None else None
+        if stored is None:
+            return None
+
+        system = BatchFuzzySystem(json.loads(stored))
+        self._compiled.set(key, system)
+        tracing.set_attributes(system_cache="disk")
+        return system
+
+    def compile(self, spec):
+        """
+        Return (key, compiled system) for a validated spec, compiling and storing it
+        only if this rule base has not been seen before.
+        """
+        key = system_key(spec)
+        system = self.get(key)
+        if system is not None:
+            return key, system
+
+        normalized = normalize_spec(spec)
+        system = BatchFuzzySystem(normalized)
+        self._compiled.set(key, system)
+        if self.store is not None:
+            self.store.set(key, json.dumps(normalized, separators=(",", ":")))
+        tracing.set_attributes(system_cache="miss")
+        return key, system
+
+
+    # ---- contexts seen before ----
+
+    def remember_context(self, context: str, question: str, spec, key: str):
+        """Map the template of a query to the system its spec compiled to (see module docstring)."""
+        template, numbers = context_template(context, question)
+        positions = input_positions(spec, numbers)
+        if positions is None:
+            return
+        fixed = [number for i, number in enumerate(numbers) if i not in positions.values()]
+        value = json.dumps({"system_key": key, "inputs": positions, "fixed": fixed},
+                           separators=(",", ":"))
+        self._contexts.set(template, value)
+        if self.store is not None:
+            self.store.set(f"context:{template}", value)
+
+    def lookup_context(self, context: str, question: str):
+        """
+        (system key, {input variable: [value]}) for a query seen with other numbers, or
+        None (also when a new value is outside its variable's universe).
+        """
+        template, numbers = context_template(context, question)
+        stored = self._contexts.get(template)
+        if stored is None and self.store is not None:
+            stored = self.store.get(f"context:{template}")
+        if stored is None:
+            return None
+
+        entry = json.loads(stored)
+        positions = entry["inputs"].values()
+        if [number for i, number in enumerate(numbers) if i not in positions] != entry["fixed"]:
+            return None
+        inputs = {variable: [numbers[position]] for variable, position in entry["inputs"].items()}
+
+        system = self.get(entry["system_key"])
+        if system is None:
+            return None  # evicted
+        for variable, (value,) in inputs.items():
+            low, high = system.input_universes.get(variable, (value, value))
+            if not low <= value <= high:
+                tracing.set_attributes(system_cache="context_out_of_range")
+                return None
+        return entry["system_key"], inputs
+
+
+_system_cache = None
+_system_cache_lock = threading.Lock()
+
+
+def get_system_cache() -> FuzzySystemCache:
+    """Process-wide cache; only kept in memory when FUZZY_LLM_CACHE=off."""
+    global _system_cache
+    with _system_cache_lock:
+        if _system_cache is None:
+            persistent = os.getenv("FUZZY_LLM_CACHE", "on").lower() not in ("off", "0", "false")
+            store = SQLiteCache(DEFAULT_SYSTEM_CACHE_PATH, ttl_seconds=DEFAULT_SYSTEM_TTL_SECONDS,
+                                max_bytes=DEFAULT_SYSTEM_MAX_BYTES) if persistent else None
+            _system_cache = FuzzySystemCache(store)
+        return _system_cache
+
+
+def set_system_cache(cache):
+    global _system_cache
+    with _system_cache_lock:
+        _system_cache = cache
+
+
+def _columnar(results):
+    return {name: values.tolist() for name, values in results.items()}
+
+
+@tracing.traced("fuzzy_batch")
+def evaluate_cached(spec, inputs: dict):
+    """
+    Evaluate a spec over columnar `inputs` with its cached compiled system.
+
+    Returns:
+        tuple: (system key, {output variable: list of values, one per row})
+    """
+    key, system = get_system_cache().compile(spec)
+    results = _columnar(system.evaluate(inputs))
+    tracing.set_attributes(rows=len(next(iter(results.values()), [])))
+    return key, results
+
+
+def evaluate_system(key: str, inputs: dict):
+    """
+    Evaluate an already known system (by its key) for new input values, without any
+    LLM call.
+
+    Args:
+        key: "system_key" of an earlier fuzzy result
+        inputs: {input variable: value or list of values}
+
+    Returns:
+        dict: {output variable: list of values}, or None if the system is not cached
+    """
+    system = get_system_cache().get(key)
+    if system is None:
+        return None
+    columns = {name: value if hasattr(value, "__len__") else [value] for name, value in inputs.items()}
+    return _columnar(system.evaluate(columns))
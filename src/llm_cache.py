@@ -0,0 +1,496 @@
+"""
+Content-addressed cache for OpenAI API responses.
+
+Every LLM call of the pipeline goes through `cached_call` / `acached_call`. The cache
+key is a hash of the request itself (endpoint, model, messages, temperature, tools,
+response schema, ...), so an identical request is answered from the cache instead
+of paying another round trip and its tokens.
+
+Two tiers are used by default:
+    - MemoryLRUCache: in-process, microsecond lookups
+    - SQLiteCache: on disk, survives restarts (e.g. evaluate.py reruns), with TTL
+      and size-based eviction
+
+Set FUZZY_LLM_CACHE=off to disable caching, or pass `bypass=True` for calls whose
+sampled output must not be replayed. `discard` removes a response that turned out
+unusable (e.g. generated code that failed to run), so a rerun samples a new one
+instead of replaying the failure. `stream_chat_completion` / `astream_chat_completion`
+yield the text of a chat completion while it is generated and cache the assembled
+response under the same key as the non-streamed request. The async functions only touch
+the memory tier on the event loop; the SQLite tier (and any custom cache) is used from a
+worker thread. Requests that do reach the API are sent
+through openai_clients.py: admitted by the request scheduler (scheduler.py: rate limits, adaptive
+concurrency, priority lanes) and retried on transient failures.
+
+Inside `deferring(collector)` (Batch API mode, see batch_runner.py) the requests that
+miss the cache don't reach the API: the collector answers them from a finished batch,
+or queues them for the next batch and raises RequestDeferred.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
+
+import tracing
+from openai_clients import arequest, astreamed, request, streamed
+from rate_limiter import estimate_tokens
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "llm_responses.sqlite"
+)
+DEFAULT_MEMORY_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class MemoryLRUCache:
+    """In-memory LRU tier."""
+
+    def __init__(self, max_entries: int = DEFAULT_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteCache:
+    """
+    On-disk tier. Entries expire after `ttl_seconds`; once the stored values exceed
+    `max_bytes` the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        self._db.commit()
+        self._total_bytes = self._db.execute(
+            "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= len(value)
+                self._db.commit()
+                return None
+
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return value
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            old = self._db.execute(
+                "SELECT LENGTH(value) FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if old:
+                self._total_bytes -= old[0]
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._total_bytes += len(value)
+            self._evict(now)
+            self._db.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            row = self._db.execute("SELECT LENGTH(value) FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= row[0]
+                self._db.commit()
+
+    def _evict(self, now: float):
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        # Expired entries go first, then the least recently used ones
+        expired = self._db.execute(
+            "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses WHERE created_at < ?",
+            (now - self.ttl_seconds,),
+        ).fetchone()[0]
+        if expired:
+            self._db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._total_bytes -= expired
+
+        if self._total_bytes > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT key, LENGTH(value) FROM responses ORDER BY last_access"
+            ).fetchall()
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes * 0.9:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+
+
+class TieredCache:
+    """Looks tiers up in order and back-fills the faster tiers on a hit."""
+
+    def __init__(self, *tiers):
+        self.tiers = tiers
+
+    def get(self, key: str):
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster in self.tiers[:i]:
+                    faster.set(key, value)
+                return value
+        return None
+
+    def set(self, key: str, value: str):
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def delete(self, key: str):
+        for tier in self.tiers:
+            tier.delete(key)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Return the process-wide cache (memory + SQLite), or None if caching is disabled."""
+    global _default_cache
+    if os.getenv("FUZZY_LLM_CACHE", "on").lower() in ("off", "0", "false"):
+        return None
+
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = TieredCache(MemoryLRUCache(), SQLiteCache())
+        return _default_cache
+
+
+# ---- async access: only memory on the event loop ----
+
+def _split_tiers(cache):
+    """(leading memory tiers, remaining tiers) of a cache."""
+    tiers = cache.tiers if isinstance(cache, TieredCache) else (cache,)
+    inline = 0
+    while inline < len(tiers) and isinstance(tiers[inline], MemoryLRUCache):
+        inline += 1
+    return tiers[:inline], tiers[inline:]
+
+
+async def _aget(cache, key: str):
+    memory, disk = _split_tiers(cache)
+    value = TieredCache(*memory).get(key)
+    if value is None and disk:
+        value = await asyncio.to_thread(TieredCache(*disk).get, key)
+        if value is not None:
+            TieredCache(*memory).set(key, value)
+    return value
+
+
+async def _aset(cache, key: str, value: str):
+    memory, disk = _split_tiers(cache)
+    TieredCache(*memory).set(key, value)
+    if disk:
+        await asyncio.to_thread(TieredCache(*disk).set, key, value)
+
+
+def set_default_cache(cache):
+    """
+    Replace the process-wide cache with any object exposing get(key) / set(key, value)
+    (and optionally delete(key), used by `discard`).
+    """
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
+
+
+def _canonical(value):
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return value.model_json_schema()  # response schema (response_format / text_format)
+    if isinstance(value, BaseModel):
+        return value.model_dump(exclude_none=True)
+    return str(value)
+
+
+def request_key(response_type, params: dict) -> str:
+    """Hash of everything that determines the response of a request."""
+    payload = {"endpoint": getattr(response_type, "__name__", str(response_type)), "params": params}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=_canonical)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+##### BATCH MODE #####
+
+_collector = contextvars.ContextVar("batch_collector", default=None)
+
+
+class RequestDeferred(BaseException):
+    """
+    A request was queued for the next batch instead of being sent (see batch_runner.py).
+    Derived from BaseException, like asyncio.CancelledError, so the `except Exception`
+    handlers of the stages let it end the run of the query.
+    """
+
+    def __init__(self, key: str):
+        super().__init__(key)
+        self.key = key
+
+
+@contextmanager
+def deferring(collector):
+    """
+    Answer the requests that miss the cache (inside the block, and in tasks started in
+    it) with `collector.response(response_type, params, bypass) -> (response, fresh)`
+    instead of the API. `fresh` is False when the response was delivered before.
+    """
+    token = _collector.set(collector)
+    try:
+        yield
+    finally:
+        _collector.reset(token)
+
+
+def _record(params, response, cache_hit=False, batch=False):
+    tracing.record_llm_call(params.get("model"), response, cache_hit=cache_hit, batch=batch)
+    return response
+
+
+def _fetch(create, response_type, params, bypass):
+    """The (recorded) response to a request that missed the cache."""
+    collector = _collector.get()
+    if collector is not None:
+        response, fresh = collector.response(response_type, params, bypass)
+        return _record(params, response, cache_hit=not fresh, batch=True)
+    return _record(params, request(lambda: create(**params), params.get("model"), estimate_tokens(params)))
+
+
+async def _afetch(create, response_type, params, bypass):
+    collector = _collector.get()
+    if collector is not None:
+        response, fresh = collector.response(response_type, params, bypass)
+        return _record(params, response, cache_hit=not fresh, batch=True)
+    return _record(params, await arequest(lambda: create(**params), params.get("model"),
+                                          estimate_tokens(params)))
+
+
+##### CACHED CALLS #####
+
+def cached_call(create, response_type, bypass: bool = False, cache=None, **params):
+    """
+    Call `create(**params)` (e.g. client.chat.completions.create) through the cache.
+
+    Args:
+        create: the OpenAI client method to call on a miss
+        response_type: pydantic type of the response, used to rebuild cached entries
+            (ChatCompletion, ParsedResponse[Schema], ParsedChatCompletion[Schema], ...)
+        bypass: skip the cache entirely (sampling-sensitive calls)
+        cache: cache to use instead of the process-wide default
+    """
+    cache = cache or get_default_cache()
+    if bypass or cache is None:
+        return _fetch(create, response_type, params, bypass)
+
+    key = request_key(response_type, params)
+    hit = cache.get(key)
+    if hit is not None:
+        return _record(params, response_type.model_validate_json(hit), cache_hit=True)
+
+    response = _fetch(create, response_type, params, bypass)
+    cache.set(key, response.model_dump_json())
+    return response
+
+
+async def acached_call(create, response_type, bypass: bool = False, cache=None, **params):
+    """Async counterpart of `cached_call` for AsyncOpenAI client methods."""
+    cache = cache or get_default_cache()
+    if bypass or cache is None:
+        return await _afetch(create, response_type, params, bypass)
+
+    key = request_key(response_type, params)
+    hit = await _aget(cache, key)
+    if hit is not None:
+        return _record(params, response_type.model_validate_json(hit), cache_hit=True)
+
+    response = await _afetch(create, response_type, params, bypass)
+    await _aset(cache, key, response.model_dump_json())
+    return response
+
+
+def discard(response_type, cache=None, **params):
+    """Remove the cached response of a request made with `cached_call` (if there is one)."""
+    cache = cache or get_default_cache()
+    if cache is not None and hasattr(cache, "delete"):
+        cache.delete(request_key(response_type, params))
+
+
+async def adiscard(response_type, cache=None, **params):
+    """Async counterpart of `discard` (the disk tier is updated from a worker thread)."""
+    cache = cache or get_default_cache()
+    if cache is None or not hasattr(cache, "delete"):
+        return
+    key = request_key(response_type, params)
+    memory, disk = _split_tiers(cache)
+    TieredCache(*memory).delete(key)
+    if disk:
+        await asyncio.to_thread(TieredCache(*disk).delete, key)
+
+
+##### STREAMING #####
+
+def _assembled_completion(last_chunk, content: str, finish_reason, usage) -> ChatCompletion:
+    """The ChatCompletion equivalent to a finished stream of chunks."""
+    return ChatCompletion(
+        id=last_chunk.id,
+        object="chat.completion",
+        created=last_chunk.created,
+        model=last_chunk.model,
+        choices=[{
+            "index": 0,
+            "finish_reason": finish_reason or "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        usage=usage.model_dump() if usage is not None else None,
+    )
+
+
+def _stream_params(params: dict) -> dict:
+    return dict(params, stream=True, stream_options={"include_usage": True})
+
+
+class _StreamAssembler:
+    def __init__(self):
+        self.parts, self.last, self.finish_reason, self.usage = [], None, None, None
+
+    def add(self, chunk) -> str:
+        """Take one chunk; returns its text delta ("" if none)."""
+        self.last = chunk
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return ""
+        choice = chunk.choices[0]
+        self.finish_reason = choice.finish_reason or self.finish_reason
+        delta = choice.delta.content or ""
+        self.parts.append(delta)
+        return delta
+
+    def completion(self):
+        if self.last is None:
+            return None
+        return _assembled_completion(self.last, "".join(self.parts), self.finish_reason, self.usage)
+
+
+def stream_chat_completion(create, bypass: bool = False, cache=None, **params):
+    """
+    Yield the text of a chat completion piece by piece as it is generated (`create` is
+    client.chat.completions.create). A cached response is yielded in one piece. A
+    stream that was read to the end is recorded and cached like `cached_call`.
+    """
+    cache = None if bypass else cache or get_default_cache()
+    key = request_key(ChatCompletion, params)
+    hit = cache.get(key) if cache is not None else None
+    if hit is not None:
+        response = _record(params, ChatCompletion.model_validate_json(hit), cache_hit=True)
+        yield response.choices[0].message.content or ""
+        return
+    if _collector.get() is not None:  # batches aren't streamed: the text comes in one piece
+        response = _fetch(create, ChatCompletion, params, bypass)
+        if cache is not None:
+            cache.set(key, response.model_dump_json())
+        yield response.choices[0].message.content or ""
+        return
+
+    assembler = _StreamAssembler()
+    with streamed(lambda: create(**_stream_params(params)), params.get("model"), estimate_tokens(params),
+                  response=assembler.completion) as stream:
+        for chunk in stream:
+            delta = assembler.add(chunk)
+            if delta:
+                yield delta
+
+    response = assembler.completion()
+    if response is not None:
+        _record(params, response)
+        if cache is not None:
+            cache.set(key, response.model_dump_json())
+
+
+async def astream_chat_completion(create, bypass: bool = False, cache=None, **params):
+    """Async counterpart of `stream_chat_completion` for AsyncOpenAI client methods."""
+    cache = None if bypass else cache or get_default_cache()
+    key = request_key(ChatCompletion, params)
+    hit = await _aget(cache, key) if cache is not None else None
+    if hit is not None:
+        response = _record(params, ChatCompletion.model_validate_json(hit), cache_hit=True)
+        yield response.choices[0].message.content or ""
+        return
+    if _collector.get() is not None:
+        response = await _afetch(create, ChatCompletion, params, bypass)
+        if cache is not None:
+            await _aset(cache, key, response.model_dump_json())
+        yield response.choices[0].message.content or ""
+        return
+
+    assembler = _StreamAssembler()
+    async with astreamed(lambda: create(**_stream_params(params)), params.get("model"),
+                         estimate_tokens(params), response=assembler.completion) as stream:
+        async for chunk in stream:
+            delta = assembler.add(chunk)
+            if delta:
+                yield delta
+
+    response = assembler.completion()
+    if response is not None:
+        _record(params, response)
+        if cache is not None:
+            await _aset(cache, key, response.model_dump_json())
@@ -1,46 +1,28 @@
-from rewriter import rewrite_text, decide_reasoning_mode
-from decider import inference
-from openai import OpenAI
-from prompts import FINAL_PROMPT
-import os
+import asyncio
+from engine_tools import get_simpful_pool
+from pipeline import stream_pipeline_async
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Warm up the Simpful sandbox workers while the user is typing
+get_simpful_pool().start()
 
 # ---- Step 0: Get user input ----
 raw_context = input("Please give the context, describe facts: ")
 raw_question = input("Please give the query in natural language: ")
 
-# ---- Step 1: Rewrite text ----
-clean_context = rewrite_text(raw_context)
-clean_question = rewrite_text(raw_question)
 
-# ---- Step 2: Decide reasoning mode ----
-mode = decide_reasoning_mode(clean_context, clean_question)
-print(f"[INFO] Reasoning mode: {mode}")
+async def main():
+    # ---- Steps 1-4: Rewrite, decide reasoning mode, do inference, summarize ----
+    # ---- Step 5: Print the final natural-language answer as it is generated ----
+    summary_started = False
+    async for event in stream_pipeline_async(raw_context, raw_question):
+        if event["type"] == "stage":
+            print(f"[PROGRESS] {event['stage']} done after {event['elapsed']:.2f}s")
+        elif event["type"] == "token":
+            if not summary_started:
+                print("\n=== FINAL SUMMARY ===")
+                summary_started = True
+            print(event["text"], end="", flush=True)
+    print()
 
-# ---- Step 3: Do Inference  ----
-program_result = inference(mode, clean_question, clean_context)
-print(f"[INFO] Tool execution result: {program_result}")
 
-# ---- Step 4: Summarize results in natural language ----
-user_text = (
-    f"We did inference from the context:\n{clean_context}\n"
-    f"and the question:\n{clean_question}\n"
-    f"Reasoning mode used was \n{mode}\n"
-    f"The tool returned the following result:\n{program_result}\n"
-    f"Please summarize it in clear natural language for the user."
-)
-
-response = client.chat.completions.create(
-    model="gpt-4o-mini",
-    messages=[
-        {"role": "system", "content": FINAL_PROMPT},
-        {"role": "user", "content": user_text}
-    ],
-    temperature=0.7
-)
-
-# ---- Step 5: Print final natural-language answer ----
-final_summary = response.choices[0].message.content.strip()
-print("\n=== FINAL SUMMARY ===")
-print(final_summary)
+asyncio.run(main())
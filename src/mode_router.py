@@ -0,0 +1,321 @@
+"""
+Local fast path for reasoning-mode selection.
+
+Choosing between crisp, fuzzy and no reasoning used to cost a full LLM round trip per
+query. `ModeRouter` scores the three modes on the CPU in microseconds, from keyword
+rules (arithmetic questions, graded vocabulary, universal rules, ...) plus, once
+trained, a multinomial logistic model over question and context n-grams. When its
+top probability reaches the confidence threshold the mode is used directly; otherwise
+`rewriter.decide_reasoning_mode` falls back to the LLM.
+
+Every LLM decision is appended to `.cache/mode_decisions.jsonl`, so the router can be
+retrained from real traffic:
+
+    python mode_router.py --label      # let the LLM label evaluation/problems.json
+    python mode_router.py --train      # fit on the log + examples/Q*.txt, save the model
+
+Set FUZZY_LLM_ROUTER=off to always ask the LLM, FUZZY_LLM_ROUTER_CONFIDENCE to change
+the threshold (default 0.85).
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import threading
+
+import tracing
+
+MODES = ("crisp", "fuzzy", "no")
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_MODEL_PATH = os.path.join(ROOT, ".cache", "mode_router.json")
+DEFAULT_DECISION_LOG = os.path.join(ROOT, ".cache", "mode_decisions.jsonl")
+DEFAULT_CONFIDENCE = 0.85
+MIN_TRAINING_EXAMPLES = 30  # below this the keyword rules alone are used
+
+# (feature, pattern, text searched, prior weight per mode); the feature value is the
+# number of matches, capped at 3
+KEYWORD_RULES = [
+    ("quantity_question",
+     r"\bhow (many|much|far|long|old)\b|\bwhat time\b|\b(total|sum|average|area|perimeter|percentage|speed)\b",
+     "question", {"no": 2.5}),
+    ("math_terms", r"\b(angle|triangle|rectangle|km/h|costs?|price|spends?|minus|plus|times)\b|\$\d",
+     "both", {"no": 0.8}),
+    ("numbers", r"(?<![\w.])\d+(\.\d+)?", "context", {"no": 0.6}),
+    ("graded_words",
+     r"\b(very|quite|rather|somewhat|slightly|extremely|highly|fairly|likely|probably|degree|strong|weak|"
+     r"good|bad|great|poor|high|low|heavy|happy|satisfied|impressed|liked?|enjoy(ed)?|risk)\b",
+     "both", {"fuzzy": 0.9}),
+    ("graded_question", r"\bhow (good|bad|likely|strong|well)\b|\b(succeed|happy|like|hire|good)\b",
+     "question", {"fuzzy": 1.5}),
+    ("universal", r"\b(every|all|each|any|none)\b", "context", {"crisp": 1.0}),
+    ("conditional", r"\b(if|whenever|implies|only if)\b", "context", {"crisp": 1.2, "fuzzy": 0.3}),
+    ("yes_no_question", r"^\s*(is|are|can|does|do|will|did|was|were|has|have)\b", "question",
+     {"crisp": 0.7, "fuzzy": 0.7}),
+    ("ordering", r"\b(taller|shorter|older|younger|bigger|smaller|before|after)\b", "context",
+     {"crisp": 0.8}),
+]
+PRIOR_BIAS = {"fuzzy": 0.4}  # the decider prompt favours fuzzy for graded questions
+
+_log_lock = threading.Lock()
+
+_COMPILED_RULES = [(name, re.compile(pattern, re.I), field, weights)
+                   for name, pattern, field, weights in KEYWORD_RULES]
+_WORD = re.compile(r"[a-z]+|\d+")
+
+
+def features(clean_context: str, clean_question: str) -> dict:
+    """Sparse feature vector {name: value} of a query."""
+    texts = {"question": clean_question, "context": clean_context,
+             "both": f"{clean_context}\n{clean_question}"}
+    vector = {"bias": 1.0}
+
+    for name, pattern, field, _ in _COMPILED_RULES:
+        count = len(pattern.findall(texts[field]))
+        if count:
+            vector[f"rule:{name}"] = float(min(count, 3))
+
+    question = ["<num>" if w.isdigit() else w for w in _WORD.findall(clean_question.lower())]
+    for word in question:
+        vector[f"q:{word}"] = 1.0
+    for first, second in zip(question, question[1:]):
+        vector[f"q:{first}_{second}"] = 1.0
+    for word in set(_WORD.findall(clean_context.lower())):
+        vector["c:<num>" if word.isdigit() else f"c:{word}"] = 1.0
+    return vector
+
+
+def _prior_weights() -> dict:
+    weights = {"bias": [PRIOR_BIAS.get(mode, 0.0) for mode in MODES]}
+    for name, _, _, prior in KEYWORD_RULES:
+        weights[f"rule:{name}"] = [prior.get(mode, 0.0) for mode in MODES]
+    return weights
+
+
+class ModeRouter:
+    """
+    Linear scorer over `features`; without trained weights it is the keyword scorer
+    of KEYWORD_RULES.
+    """
+
+    def __init__(self, weights: dict = None, threshold: float = DEFAULT_CONFIDENCE):
+        self.weights = weights if weights is not None else _prior_weights()
+        self.threshold = threshold
+
+    def probabilities(self, clean_context: str, clean_question: str) -> dict:
+        scores = [0.0] * len(MODES)
+        for name, value in features(clean_context, clean_question).items():
+            weights = self.weights.get(name)
+            if weights is not None:
+                for i, weight in enumerate(weights):
+                    scores[i] += weight * value
+
+        top = max(scores)
+        exps = [math.exp(score - top) for score in scores]
+        total = sum(exps)
+        return {mode: e / total for mode, e in zip(MODES, exps)}
+
+    def predict(self, clean_context: str, clean_question: str):
+        """Return (most likely mode, its probability)."""
+        probabilities = self.probabilities(clean_context, clean_question)
+        mode = max(probabilities, key=probabilities.get)
+        return mode, probabilities[mode]
+
+    def route(self, clean_context: str, clean_question: str):
+        """The mode if the router is confident enough, else None (ask the LLM)."""
+        mode, confidence = self.predict(clean_context, clean_question)
+        return mode if confidence >= self.threshold else None
+
+    def save(self, path: str = DEFAULT_MODEL_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"modes": list(MODES), "weights": self.weights}, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH, threshold: float = DEFAULT_CONFIDENCE):
+        with open(path, "r", encoding="utf-8") as f:
+            model = json.load(f)
+        return cls(model["weights"], threshold)
+
+
+##### TRAINING #####
+
+def train(examples, epochs: int = 300, learning_rate: float = 0.5, l2: float = 1e-3) -> ModeRouter:
+    """
+    Fit a multinomial logistic model on (clean_context, clean_question, mode) examples
+    with full-batch gradient descent, starting from the keyword rule weights.
+    """
+    import numpy as np
+
+    vectors = [features(context, question) for context, question, _ in examples]
+    names = sorted({name for vector in vectors for name in vector} | set(_prior_weights()))
+    column = {name: i for i, name in enumerate(names)}
+
+    x = np.zeros((len(vectors), len(names)))
+    for row, vector in enumerate(vectors):
+        for name, value in vector.items():
+            x[row, column[name]] = value
+    y = np.zeros((len(examples), len(MODES)))
+    y[np.arange(len(examples)), [MODES.index(mode) for _, _, mode in examples]] = 1.0
+
+    prior = np.zeros((len(names), len(MODES)))
+    for name, weights in _prior_weights().items():
+        prior[column[name]] = weights
+
+    w = prior.copy()
+    for _ in range(epochs):
+        scores = x @ w
+        scores -= scores.max(axis=1, keepdims=True)
+        p = np.exp(scores)
+        p /= p.sum(axis=1, keepdims=True)
+        gradient = x.T @ (p - y) / len(examples) + l2 * (w - prior)
+        w -= learning_rate * gradient
+
+    return ModeRouter({name: [round(float(v), 6) for v in w[i]] for name, i in column.items()
+                       if np.abs(w[i]).max() > 1e-4})
+
+
+def log_decision(clean_context: str, clean_question: str, mode: str, path: str = DEFAULT_DECISION_LOG):
+    """Append an LLM decision to the decision log (training data for the router)."""
+    if os.getenv("FUZZY_LLM_ROUTER_LOG", "on").lower() in ("off", "0", "false"):
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    line = json.dumps({"context": clean_context, "question": clean_question, "mode": mode}, ensure_ascii=False)
+    with _log_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def load_decisions(path: str = DEFAULT_DECISION_LOG) -> list:
+    """Logged (context, question, mode) decisions; the latest one wins for repeated queries."""
+    if not os.path.exists(path):
+        return []
+    decisions = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # partially written line
+            if entry.get("mode") in MODES:
+                decisions[(entry["context"], entry["question"])] = entry["mode"]
+    return [(context, question, mode) for (context, question), mode in decisions.items()]
+
+
+def recorded_examples() -> list:
+    """(context, question, mode) of the example runs in examples/Q*.txt."""
+    examples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "examples", "Q*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        context = re.search(r'raw_context\s*=\s*"""(.*?)"""', text, re.S)
+        question = re.search(r'raw_question\s*=\s*"(.*?)"', text)
+        mode = re.search(r"\[INFO\] Reasoning mode: (\w+)", text)
+        if context and question and mode and mode.group(1) in MODES:
+            examples.append((context.group(1).strip(), question.group(1).strip(), mode.group(1)))
+    return examples
+
+
+def cross_validate(examples, threshold: float = DEFAULT_CONFIDENCE, folds: int = 5) -> dict:
+    """Share of queries the router would answer locally, and its accuracy on them."""
+    routed = correct = 0
+    for fold in range(folds):
+        held_out = examples[fold::folds]
+        training = [e for i, e in enumerate(examples) if i % folds != fold]
+        router = train(training) if len(training) >= MIN_TRAINING_EXAMPLES else ModeRouter()
+        router.threshold = threshold
+        for context, question, mode in held_out:
+            predicted = router.route(context, question)
+            if predicted is not None:
+                routed += 1
+                correct += predicted == mode
+    return {
+        "examples": len(examples),
+        "coverage": routed / len(examples) if examples else 0.0,
+        "accuracy": correct / routed if routed else None,
+    }
+
+
+##### RUNTIME #####
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def router_enabled() -> bool:
+    return os.getenv("FUZZY_LLM_ROUTER", "on").lower() not in ("off", "0", "false")
+
+
+def get_router() -> ModeRouter:
+    """Process-wide router: the trained model if one was saved, else the keyword scorer."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            threshold = float(os.getenv("FUZZY_LLM_ROUTER_CONFIDENCE", DEFAULT_CONFIDENCE))
+            try:
+                _router = ModeRouter.load(DEFAULT_MODEL_PATH, threshold)
+            except (OSError, ValueError, KeyError):
+                _router = ModeRouter(threshold=threshold)
+        return _router
+
+
+def set_router(router):
+    global _router
+    with _router_lock:
+        _router = router
+
+
+def route_locally(clean_context: str, clean_question: str):
+    """
+    Mode chosen by the local router, or None when it is disabled or not confident.
+    Records the outcome on the current span and in the metrics.
+    """
+    if not router_enabled():
+        return None
+
+    mode, confidence = get_router().predict(clean_context, clean_question)
+    local = confidence >= get_router().threshold
+    tracing.set_attributes(router="local" if local else "llm", router_confidence=round(confidence, 3))
+    tracing.metrics.router_decisions.inc(source="local" if local else "llm")
+    return mode if local else None
+
+
+def label_problems(path: str):
+    """Ask the LLM for the mode of every problem in an evaluation file (logged as decisions)."""
+    from rewriter import decide_reasoning_mode, rewrite_text
+
+    with open(path, "r", encoding="utf-8") as f:
+        problems = json.load(f)
+    for problem in problems:
+        clean_context = rewrite_text(problem["raw_context"])
+        clean_question = rewrite_text(problem["raw_question"])
+        mode = decide_reasoning_mode(clean_context, clean_question, use_router=False)
+        print(f"{problem['id']}: {mode}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local reasoning-mode router.")
+    parser.add_argument("--label", action="store_true",
+                        help="label evaluation/problems.json with the LLM first (adds to the decision log)")
+    parser.add_argument("--train", action="store_true", help="fit and save the router model")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_CONFIDENCE)
+    args = parser.parse_args()
+
+    if args.label:
+        label_problems(os.path.join(ROOT, "evaluation", "problems.json"))
+
+    examples = load_decisions() + recorded_examples()
+    print(json.dumps(cross_validate(examples, args.threshold), indent=2))
+
+    if args.train:
+        if len(examples) < MIN_TRAINING_EXAMPLES:
+            print(f"Only {len(examples)} examples (need {MIN_TRAINING_EXAMPLES}); keeping the keyword rules.")
+            return
+        router = train(examples)
+        router.save(DEFAULT_MODEL_PATH)
+        print(f"Saved {len(router.weights)} weights to {os.path.abspath(DEFAULT_MODEL_PATH)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Shared OpenAI clients with a tuned HTTP transport and retries.
+
+Every module used to build its own `OpenAI(...)` client, each with a separate
+connection pool, the SDK's default timeouts and its own retries. `get_client()` /
+`get_async_client()` return one process-wide client of each kind instead, so all
+stages reuse the same warm keep-alive connections (and HTTP/2 streams, when the
+`h2` package is installed: `pip install httpx[http2]`).
+
+The SDK's own retries are turned off; `request` / `arequest` and `streamed` /
+`astreamed` (used by llm_cache.py for every call that reaches the API) retry
+instead, which lets them:
+
+- send every attempt through the request scheduler (scheduler.py: rate limits,
+  adaptive concurrency, priority lanes), holding its slot only while the request is
+  in flight, not while backing off, and report 429s and latencies back to it
+- wait the `retry-after` / `retry-after-ms` the server asks for (up to
+  MAX_RETRY_AFTER seconds), otherwise an exponential backoff with jitter, so many
+  callers failing at once don't retry in lockstep
+- count every retry by reason in `tracing.metrics.llm_retries`
+
+Settings (environment, read once when this module is imported):
+    FUZZY_LLM_MAX_CONNECTIONS          connection pool size (default 100)
+    FUZZY_LLM_HTTP2                    off disables HTTP/2 (default: used if h2 is installed)
+    FUZZY_LLM_CONNECT_TIMEOUT / FUZZY_LLM_READ_TIMEOUT   seconds (default 5 / 120)
+    FUZZY_LLM_MAX_RETRIES              retries per request (default 4)
+"""
+import asyncio
+import importlib.util
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+import tracing
+from scheduler import MAX_CONCURRENT_REQUESTS, get_scheduler
+
+MAX_CONNECTIONS = int(os.getenv("FUZZY_LLM_MAX_CONNECTIONS", 100))
+KEEPALIVE_EXPIRY = 60.0  # seconds an idle connection stays open
+CONNECT_TIMEOUT = float(os.getenv("FUZZY_LLM_CONNECT_TIMEOUT", 5.0))
+READ_TIMEOUT = float(os.getenv("FUZZY_LLM_READ_TIMEOUT", 120.0))  # long generations
+WRITE_TIMEOUT = 30.0
+POOL_TIMEOUT = 30.0  # waiting for a free connection
+
+MAX_RETRIES = int(os.getenv("FUZZY_LLM_MAX_RETRIES", 4))
+BACKOFF_BASE = 0.5  # seconds before the first retry, doubled for every further one
+BACKOFF_MAX = 20.0
+MAX_RETRY_AFTER = 60.0  # a longer retry-after is ignored in favour of the backoff
+
+RETRY_STATUS = {408, 409, 429}  # and every 5xx
+OVERLOAD_STATUS = {429, 503, 529}  # the API is saturated: the scheduler backs off
+
+
+def http2_enabled() -> bool:
+    if os.getenv("FUZZY_LLM_HTTP2", "auto").lower() in ("off", "0", "false"):
+        return False
+    return importlib.util.find_spec("h2") is not None
+
+
+def _transport_options() -> dict:
+    return dict(
+        http2=http2_enabled(),
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                            max_keepalive_connections=min(MAX_CONNECTIONS, MAX_CONCURRENT_REQUESTS),
+                            keepalive_expiry=KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, write=WRITE_TIMEOUT, pool=POOL_TIMEOUT),
+    )
+
+
+##### CLIENTS #####
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _shared(kind, build):
+    with _clients_lock:
+        if kind not in _clients:
+            _clients[kind] = build()
+        return _clients[kind]
+
+
+def get_client() -> OpenAI:
+    """The process-wide blocking client (base URL and key from OPENAI_BASE_URL / OPENAI_API_KEY)."""
+    return _shared("sync", lambda: OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+        http_client=DefaultHttpxClient(**_transport_options())))
+
+
+def get_async_client() -> AsyncOpenAI:
+    """The process-wide AsyncOpenAI client."""
+    return _shared("async", lambda: AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+        http_client=DefaultAsyncHttpxClient(**_transport_options())))
+
+
+##### RETRIES #####
+
+def _status(error):
+    return getattr(error, "status_code", None)
+
+
+def retry_reason(error):
+    """Why `error` is worth retrying ("timeout", "connection", "429", "503", ...), or None."""
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    status = _status(error)
+    if status is None:
+        return None
+    should_retry = error.response.headers.get("x-should-retry")
+    if should_retry in ("true", "false"):
+        return str(status) if should_retry == "true" else None
+    return str(status) if status in RETRY_STATUS or status >= 500 else None
+
+
+def retry_after(error):
+    """Seconds the server asked to wait before retrying, or None."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, error=None) -> float:
+    """
+    Wait before retry number `attempt` (0-based): the server's retry-after if it
+    gave a usable one, otherwise half of the exponential delay plus a random part
+    of the other half.
+    """
+    requested = retry_after(error) if error is not None else None
+    if requested is not None and 0 < requested <= MAX_RETRY_AFTER:
+        return requested
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def overloaded(error) -> bool:
+    return isinstance(error, openai.APITimeoutError) or _status(error) in OVERLOAD_STATUS
+
+
+def _retry_or_raise(error, attempt):
+    """The delay before the next attempt; re-raises `error` when it must not be retried."""
+    reason = retry_reason(error)
+    if reason is None or attempt >= MAX_RETRIES:
+        raise error
+    delay = backoff_delay(attempt, error)
+    tracing.metrics.llm_retries.inc(reason=reason)
+    print(f"[WARN] OpenAI request failed ({reason}), retrying in {delay:.2f}s")
+    return delay
+
+
+def request(call, model=None, tokens=0):
+    """
+    Run `call()` (one API request for `model`, about `tokens` tokens) once the
+    scheduler admits it, retrying transient failures.
+    """
+    scheduler = get_scheduler()
+    for attempt in range(MAX_RETRIES + 1):
+        ticket = scheduler.acquire(model, tokens)
+        try:
+            response = call()
+        except openai.APIError as error:
+            ticket.release(overloaded=overloaded(error), failed=True)
+            delay = _retry_or_raise(error, attempt)
+        except BaseException:
+            ticket.release(failed=True)
+            raise
+        else:
+            ticket.release(response)
+            return response
+        time.sleep(delay)
+
+
+async def arequest(call, model=None, tokens=0):
+    """Async version of `request`; `call()` returns an awaitable."""
+    scheduler = get_scheduler()
+    for attempt in range(MAX_RETRIES + 1):
+        ticket = await scheduler.acquire_async(model, tokens)
+        try:
+            response = await call()
+        except openai.APIError as error:
+            ticket.release(overloaded=overloaded(error), failed=True)
+            delay = _retry_or_raise(error, attempt)
+        except BaseException:  # cancelled
+            ticket.release(failed=True)
+            raise
+        else:
+            ticket.release(response)
+            return response
+        await asyncio.sleep(delay)
+
+
+@contextmanager
+def streamed(call, model=None, tokens=0, response=None):
+    """
+    Like `request` for a streamed response (`call()` opens the stream): yields the
+    open stream and holds the scheduler slot until it is closed. `response()`, if
+    given, returns the assembled response whose usage settles the token estimate.
+    """
+    scheduler = get_scheduler()
+    for attempt in range(MAX_RETRIES + 1):
+        ticket = scheduler.acquire(model, tokens)
+        try:
+            stream = call()
+        except openai.APIError as error:
+            ticket.release(overloaded=overloaded(error), failed=True)
+            delay = _retry_or_raise(error, attempt)
+        except BaseException:
+            ticket.release(failed=True)
+            raise
+        else:
+            try:
+                with stream:
+                    yield stream
+            except BaseException:
+                ticket.release(failed=True)
+                raise
+            ticket.release(response() if response else None)
+            return
+        time.sleep(delay)
+
+
+@asynccontextmanager
+async def astreamed(call, model=None, tokens=0, response=None):
+    """Async version of `streamed`; `call()` returns an awaitable opening the stream."""
+    scheduler = get_scheduler()
+    for attempt in range(MAX_RETRIES + 1):
+        ticket = await scheduler.acquire_async(model, tokens)
+        try:
+            stream = await call()
+        except openai.APIError as error:
+            ticket.release(overloaded=overloaded(error), failed=True)
+            delay = _retry_or_raise(error, attempt)
+        except BaseException:
+            ticket.release(failed=True)
+            raise
+        else:
+            try:
+                async with stream:
+                    yield stream
+            except BaseException:
+                ticket.release(failed=True)
+                raise
+            ticket.release(response() if response else None)
+            return
+        await asyncio.sleep(delay)
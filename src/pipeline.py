@@ -0,0 +1,388 @@
+"""
+End-to-end Fuzzy-LLM pipeline: rewrite -> decide -> inference -> summarize.
+
+`run_pipeline` is the blocking version used by the command line scripts.
+`run_pipeline_async` does the same on the AsyncOpenAI client: the context and
+question rewrites run concurrently and sandbox execution happens on an executor,
+so one process can keep many queries in flight (see `run_many_async`).
+
+`stream_pipeline` (a generator) and `stream_pipeline_async` (an async iterator)
+report progress while the pipeline runs: an event when each stage finishes, the
+summary token by token as the LLM generates it, and finally the complete result.
+
+With FUZZY_LLM_SEMANTIC_CACHE=on a near-duplicate of an earlier query returns the
+stored result without any LLM call (see semantic_cache.py).
+"""
+import asyncio
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from openai.types.chat import ChatCompletion
+from llm_cache import acached_call, astream_chat_completion, cached_call, stream_chat_completion
+from openai_clients import get_async_client, get_client
+import tracing
+from prompt_layout import chat_messages, user_content
+from prompts import FINAL_PROMPT
+from rewriter import (decide_reasoning_mode, decide_reasoning_mode_async,
+                      rewrite_and_route, rewrite_and_route_async, rewrite_text, rewrite_text_async)
+from decider import inference, inference_async, inference_batch, inference_batch_async
+from semantic_cache import get_semantic_cache
+from speculative import branch_failed, speculative_inference, speculative_inference_async
+
+client = get_client()
+async_client = get_async_client()
+
+_rewrite_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rewrite")
+
+# "fused": rewrite both texts and decide the mode in one LLM call (see rewriter.rewrite_and_route)
+FRONT_MODE = os.getenv("FUZZY_LLM_FRONT", "separate")
+# Start the likely reasoning branches while the mode is decided (see speculative.py)
+SPECULATE = os.getenv("FUZZY_LLM_SPECULATE", "off").lower() in ("on", "1", "true")
+
+SUMMARY_TEXT_CHARS = 1000  # raw program output / errors passed to the summarizer are cut to this
+SUMMARY_DIGITS = 4
+
+
+def _rounded(value):
+    if isinstance(value, float):
+        return round(value, SUMMARY_DIGITS)
+    if isinstance(value, dict):
+        return {k: _rounded(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rounded(v) for v in value]
+    if isinstance(value, str) and len(value) > SUMMARY_TEXT_CHARS:
+        return "..." + value[-SUMMARY_TEXT_CHARS:]
+    return value
+
+
+def compact_result(program_result):
+    """
+    What the summarizer needs from an inference result: typed, rounded numbers as
+    compact JSON, without raw stdout, generated programs or specs. Raw output is only
+    kept (truncated) when the engine returned no structured results.
+    """
+    if not isinstance(program_result, dict):
+        return program_result  # text answer ('no' branch, or crisp without a tool call)
+
+    compact = {key: program_result[key] for key in ("success", "results", "error", "message")
+               if program_result.get(key) is not None}
+    if "results" not in compact and program_result.get("output"):
+        compact["output"] = program_result["output"]
+
+    return json.dumps(_rounded(compact), ensure_ascii=False, separators=(",", ":"))
+
+
+def _summary_request(mode, clean_context, clean_question, program_result):
+    user_text = user_content("summary", clean_context, clean_question,
+                             ("Reasoning mode", mode), ("Result", compact_result(program_result)))
+    return dict(
+        model="gpt-4o-mini",
+        messages=chat_messages(FINAL_PROMPT, user_text),
+        temperature=0.7
+    )
+
+
+@tracing.traced("summarize")
+def summarize(mode, clean_context, clean_question, program_result, on_token=None) -> str:
+    """
+    Step (4): turn the inference result into a natural-language answer. With
+    `on_token`, the answer is streamed and each piece is passed to it as it arrives.
+    """
+    request = _summary_request(mode, clean_context, clean_question, program_result)
+    if on_token is None:
+        response = cached_call(client.chat.completions.create, ChatCompletion, **request)
+        return response.choices[0].message.content.strip()
+
+    parts = []
+    for piece in stream_chat_completion(client.chat.completions.create, **request):
+        parts.append(piece)
+        on_token(piece)
+    return "".join(parts).strip()
+
+
+@tracing.traced("summarize")
+async def summarize_async(mode, clean_context, clean_question, program_result, on_token=None) -> str:
+    """Async version of `summarize`."""
+    request = _summary_request(mode, clean_context, clean_question, program_result)
+    if on_token is None:
+        response = await acached_call(async_client.chat.completions.create, ChatCompletion, **request)
+        return response.choices[0].message.content.strip()
+
+    parts = []
+    async for piece in astream_chat_completion(async_client.chat.completions.create, **request):
+        parts.append(piece)
+        on_token(piece)
+    return "".join(parts).strip()
+
+
+def _emitter(on_event):
+    """Event callback adding the type and the seconds since the pipeline started."""
+    started = time.perf_counter()
+
+    def emit(kind, **fields):
+        if on_event is not None:
+            on_event({"type": kind, "elapsed": time.perf_counter() - started, **fields})
+    return emit
+
+
+def _token_callback(emit, on_event):
+    return (lambda piece: emit("token", text=piece)) if on_event is not None else None
+
+
+def _semantic_lookup(raw_context, raw_question, emit, on_event):
+    """The stored result of a near-duplicate query (see semantic_cache.py), or None."""
+    cache = get_semantic_cache()
+    result = cache.get(raw_context, raw_question) if cache is not None else None
+    if result is not None:
+        tracing.set_attributes(mode=result["mode"])
+        emit("stage", stage="semantic_cache", mode=result["mode"])
+        if on_event is not None:
+            emit("token", text=result["final_summary"])
+        print(f"[INFO] Semantic cache hit, reusing the {result['mode']} result")
+    return result
+
+
+def _context_cuts(result):
+    """
+    Add to `result` how many context tokens the capped stages dropped (see
+    prompt_layout.py), rolled up into the current pipeline span; nothing if none.
+    """
+    dropped = tracing.current_span().attributes.get("context_tokens_dropped")
+    if dropped:
+        result["context_tokens_dropped"] = dropped
+    return result
+
+
+def _semantic_store(raw_context, raw_question, result):
+    """Remember a result for near-duplicate queries; failed inference is not stored."""
+    cache = get_semantic_cache()
+    if cache is not None and not branch_failed(result["program_result"]):
+        cache.put(raw_context, raw_question, result)
+
+
+@tracing.traced("pipeline")
+def run_pipeline(raw_context: str, raw_question: str, on_event=None) -> dict:
+    """
+    Run the whole pipeline for one query.
+
+    Args:
+        on_event: optional callback receiving progress events (see `stream_pipeline`);
+            the summary is then streamed token by token
+
+    Returns:
+        dict: {clean_context, clean_question, mode, program_result, final_summary},
+            plus context_tokens_dropped if a stage's context was cut to its limit
+    """
+    emit = _emitter(on_event)
+    cached = _semantic_lookup(raw_context, raw_question, emit, on_event)
+    if cached is not None:
+        return cached
+
+    if FRONT_MODE == "fused":
+        # ---- Steps 1+2: Rewrite and decide in a single call ----
+        clean_context, clean_question, mode = rewrite_and_route(raw_context, raw_question)
+        emit("stage", stage="rewrite", clean_context=clean_context, clean_question=clean_question)
+    else:
+        # ---- Step 1: Rewrite text (both rewrites are independent) ----
+        context_future = _rewrite_executor.submit(contextvars.copy_context().run, rewrite_text, raw_context)
+        clean_question = rewrite_text(raw_question)
+        clean_context = context_future.result()
+
+        emit("stage", stage="rewrite", clean_context=clean_context, clean_question=clean_question)
+
+    def decided(mode):
+        emit("stage", stage="decide", mode=mode)
+        print(f"[INFO] Reasoning mode: {mode}")
+
+    if FRONT_MODE != "fused" and SPECULATE:
+        # ---- Steps 2+3: Decide while the likely branches already run ----
+        mode, program_result = speculative_inference(clean_context, clean_question, on_decided=decided)
+    else:
+        # ---- Step 2: Decide reasoning mode ----
+        if FRONT_MODE != "fused":
+            mode = decide_reasoning_mode(clean_context, clean_question)
+        decided(mode)
+
+        # ---- Step 3: Do Inference  ----
+        program_result = inference(mode, clean_question, clean_context)
+    tracing.set_attributes(mode=mode)
+    emit("stage", stage="inference", result=program_result)
+    print(f"[INFO] Tool execution result: {program_result}")
+
+    # ---- Step 4: Summarize results in natural language ----
+    final_summary = summarize(mode, clean_context, clean_question, program_result,
+                              on_token=_token_callback(emit, on_event))
+
+    result = _context_cuts({
+        "clean_context": clean_context,
+        "clean_question": clean_question,
+        "mode": mode,
+        "program_result": program_result,
+        "final_summary": final_summary,
+    })
+    _semantic_store(raw_context, raw_question, result)
+    return result
+
+
+@tracing.traced("pipeline")
+async def run_pipeline_async(raw_context: str, raw_question: str, on_event=None) -> dict:
+    """Async version of `run_pipeline`; context and question are rewritten concurrently."""
+    emit = _emitter(on_event)
+    cached = _semantic_lookup(raw_context, raw_question, emit, on_event)
+    if cached is not None:
+        return cached
+
+    if FRONT_MODE == "fused":
+        clean_context, clean_question, mode = await rewrite_and_route_async(raw_context, raw_question)
+        emit("stage", stage="rewrite", clean_context=clean_context, clean_question=clean_question)
+    else:
+        clean_context, clean_question = await asyncio.gather(
+            rewrite_text_async(raw_context),
+            rewrite_text_async(raw_question),
+        )
+        emit("stage", stage="rewrite", clean_context=clean_context, clean_question=clean_question)
+
+    def decided(mode):
+        emit("stage", stage="decide", mode=mode)
+        print(f"[INFO] Reasoning mode: {mode}")
+
+    if FRONT_MODE != "fused" and SPECULATE:
+        mode, program_result = await speculative_inference_async(clean_context, clean_question,
+                                                                 on_decided=decided)
+    else:
+        if FRONT_MODE != "fused":
+            mode = await decide_reasoning_mode_async(clean_context, clean_question)
+        decided(mode)
+        program_result = await inference_async(mode, clean_question, clean_context)
+    tracing.set_attributes(mode=mode)
+    emit("stage", stage="inference", result=program_result)
+    print(f"[INFO] Tool execution result: {program_result}")
+
+    final_summary = await summarize_async(mode, clean_context, clean_question, program_result,
+                                          on_token=_token_callback(emit, on_event))
+
+    result = _context_cuts({
+        "clean_context": clean_context,
+        "clean_question": clean_question,
+        "mode": mode,
+        "program_result": program_result,
+        "final_summary": final_summary,
+    })
+    _semantic_store(raw_context, raw_question, result)
+    return result
+
+
+def stream_pipeline(raw_context: str, raw_question: str):
+    """
+    Run the pipeline on a background thread and yield its progress as it happens:
+
+        {"type": "stage", "stage": "rewrite", "clean_context": ..., "clean_question": ...}
+        {"type": "stage", "stage": "decide", "mode": ...}
+        {"type": "stage", "stage": "inference", "result": ...}
+        {"type": "token", "text": ...}        (for every piece of the summary)
+        {"type": "result", "result": ...}     (the dict returned by `run_pipeline`)
+
+    A semantic cache hit yields {"type": "stage", "stage": "semantic_cache", "mode": ...}
+    and the whole summary as one token event instead of the stage events.
+
+    Every event but the result also carries "elapsed", the seconds since the start.
+    Exceptions of the pipeline are raised from the generator.
+    """
+    events = queue.Queue()
+
+    def run():
+        try:
+            events.put({"type": "result", "result": run_pipeline(raw_context, raw_question, on_event=events.put)})
+        except BaseException as e:
+            events.put(e)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+    while True:
+        event = events.get()
+        if isinstance(event, BaseException):
+            raise event
+        yield event
+        if event["type"] == "result":
+            return
+
+
+async def stream_pipeline_async(raw_context: str, raw_question: str):
+    """Async iterator version of `stream_pipeline` (runs `run_pipeline_async` as a task)."""
+    events = asyncio.Queue()
+    task = asyncio.ensure_future(run_pipeline_async(raw_context, raw_question, on_event=events.put_nowait))
+    try:
+        while not task.done() or not events.empty():
+            next_event = asyncio.ensure_future(events.get())
+            await asyncio.wait({next_event, task}, return_when=asyncio.FIRST_COMPLETED)
+            if next_event.done():
+                yield next_event.result()
+            else:
+                next_event.cancel()
+        yield {"type": "result", "result": task.result()}
+    finally:
+        task.cancel()  # no-op once finished; stops the pipeline if the caller gave up
+
+
+@tracing.traced("pipeline_batch")
+def run_batch_pipeline(raw_context: str, raw_question: str, inputs: dict) -> dict:
+    """
+    Answer one fuzzy question for many input rows: rewrite once, generate one fuzzy
+    system and evaluate it vectorized over `inputs` ({input variable: list of values}).
+    No per-row summary is generated; the results stay columnar.
+
+    Returns:
+        dict: {clean_context, clean_question, mode, program_result}, plus
+            context_tokens_dropped as in `run_pipeline`
+    """
+    context_future = _rewrite_executor.submit(contextvars.copy_context().run, rewrite_text, raw_context)
+    clean_question = rewrite_text(raw_question)
+    clean_context = context_future.result()
+
+    program_result = inference_batch(clean_question, clean_context, inputs)
+
+    return _context_cuts({
+        "clean_context": clean_context,
+        "clean_question": clean_question,
+        "mode": "fuzzy",
+        "program_result": program_result,
+    })
+
+
+@tracing.traced("pipeline_batch")
+async def run_batch_pipeline_async(raw_context: str, raw_question: str, inputs: dict) -> dict:
+    """Async version of `run_batch_pipeline`."""
+    clean_context, clean_question = await asyncio.gather(
+        rewrite_text_async(raw_context),
+        rewrite_text_async(raw_question),
+    )
+
+    program_result = await inference_batch_async(clean_question, clean_context, inputs)
+
+    return _context_cuts({
+        "clean_context": clean_context,
+        "clean_question": clean_question,
+        "mode": "fuzzy",
+        "program_result": program_result,
+    })
+
+
+async def run_many_async(queries, max_in_flight: int = 100) -> list:
+    """
+    Run the pipeline for many (raw_context, raw_question) pairs concurrently,
+    with at most `max_in_flight` queries in progress at once. Results keep the
+    input order; a failed query yields its exception instead of a result dict.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def run_one(raw_context, raw_question):
+        async with semaphore:
+            return await run_pipeline_async(raw_context, raw_question)
+
+    return await asyncio.gather(
+        *(run_one(raw_context, raw_question) for raw_context, raw_question in queries),
+        return_exceptions=True,
+    )
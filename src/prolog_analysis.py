@@ -0,0 +1,669 @@
+"""
+Static analysis of LLM-generated Prolog programs.
+
+A small reader (tokenizer plus an operator precedence parser for the standard SWI-Prolog
+operators) turns program text into clause terms, from which we build the call graph
+between the predicates the program defines. The graph tells which predicates are
+recursive, so they can be tabled before the program is consulted (see
+`prepare_program`), and which calls go to predicates that do not exist (see
+`program_errors`, used to reject broken programs before they are consulted).
+
+The reader covers the syntax LLMs produce (facts, rules, DCG rules, directives,
+lists, strings, quoted atoms, operators). It is not the real Prolog reader, so text it
+cannot read is never rejected: `prepare_program` passes such programs on unchanged and
+`check_program` reports the parse failure as a warning, leaving the verdict to
+SWI-Prolog. Programs that load other code or declare operators are not checked.
+"""
+import re
+from collections import namedtuple
+
+Var = namedtuple("Var", "name")
+Struct = namedtuple("Struct", "name args")  # an atom is a Struct without args
+PString = namedtuple("PString", "text")
+Clause = namedtuple("Clause", "term line")
+
+
+class PrologSyntaxError(ValueError):
+    def __init__(self, message, line):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+##### OPERATORS #####
+
+# name -> (priority, type)
+INFIX_OPS = {
+    ":-": (1200, "xfx"), "-->": (1200, "xfx"),
+    ";": (1100, "xfy"), "|": (1100, "xfy"),
+    "->": (1050, "xfy"), "*->": (1050, "xfy"),
+    ",": (1000, "xfy"),
+    "=": (700, "xfx"), "\\=": (700, "xfx"), "==": (700, "xfx"), "\\==": (700, "xfx"),
+    "@<": (700, "xfx"), "@>": (700, "xfx"), "@=<": (700, "xfx"), "@>=": (700, "xfx"),
+    "=..": (700, "xfx"), "is": (700, "xfx"), "=:=": (700, "xfx"), "=\\=": (700, "xfx"),
+    "<": (700, "xfx"), ">": (700, "xfx"), "=<": (700, "xfx"), ">=": (700, "xfx"),
+    ">:<": (700, "xfx"), ":<": (700, "xfx"), "as": (700, "xfx"),
+    ":": (200, "xfy"),
+    "+": (500, "yfx"), "-": (500, "yfx"), "/\\": (500, "yfx"), "\\/": (500, "yfx"), "xor": (500, "yfx"),
+    "*": (400, "yfx"), "/": (400, "yfx"), "//": (400, "yfx"), "rem": (400, "yfx"), "mod": (400, "yfx"),
+    "div": (400, "yfx"), "<<": (400, "yfx"), ">>": (400, "yfx"), "divmod": (400, "yfx"),
+    "rdiv": (400, "yfx"),
+    "**": (200, "xfx"), "^": (200, "xfy"),
+}
+
+PREFIX_OPS = {
+    ":-": (1200, "fx"), "?-": (1200, "fx"),
+    "dynamic": (1150, "fx"), "discontiguous": (1150, "fx"), "initialization": (1150, "fx"),
+    "module_transparent": (1150, "fx"), "multifile": (1150, "fx"), "public": (1150, "fx"),
+    "thread_local": (1150, "fx"), "table": (1150, "fx"),
+    "\\+": (900, "fy"),
+    "-": (200, "fy"), "+": (200, "fy"), "\\": (200, "fy"),
+}
+
+_SYMBOL_CHARS = "+-*/\\^<>=~:.?@#&$"
+
+_TOKEN = re.compile(r"""
+    (?P<layout>\s+|%[^\n]*|/\*.*?\*/)
+  | (?P<number>0'(?:\\.|''|.)|0x[0-9a-fA-F]+|0o[0-7]+|0b[01]+|\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<word>[^\W\d]\w*)
+  | (?P<quoted>'(?:[^'\\]|\\.|'')*')
+  | (?P<string>"(?:[^"\\]|\\.|"")*")
+  | (?P<backquoted>`(?:[^`\\]|\\.|``)*`)
+  | (?P<punct>[()\[\]{},|])
+  | (?P<solo>[!;])
+  | (?P<symbol>[+\-*/\\^<>=~:.?@#&$]+)
+""", re.VERBOSE | re.DOTALL)
+
+Token = namedtuple("Token", "kind value line layout_before")
+
+
+def tokenize(text: str):
+    """Split program text into tokens; a clause ends with an "end" token."""
+    tokens = []
+    pos, line, layout = 0, 1, True
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if not match:
+            raise PrologSyntaxError(f"unexpected character {text[pos]!r}", line)
+        kind, value = match.lastgroup, match.group()
+        pos = match.end()
+
+        if kind == "word":  # variables start with a capital or "_" (Unicode letters too)
+            kind = "var" if value[0] == "_" or value[0].isupper() else "name"
+
+        if kind == "layout":
+            layout = True
+        elif kind == "symbol" and value == "." and (pos >= len(text) or text[pos].isspace() or text[pos] == "%"):
+            tokens.append(Token("end", ".", line, layout))
+            layout = False
+        elif (kind == "symbol" and value.endswith(".") and value not in INFIX_OPS and value not in PREFIX_OPS
+              and (pos >= len(text) or text[pos].isspace())):
+            # e.g. "X = a+." is rare; split the final "." off a symbol atom (but not off "=..")
+            tokens.append(Token("name", value[:-1], line, layout))
+            tokens.append(Token("end", ".", line, False))
+            layout = False
+        else:
+            tokens.append(Token(kind, value, line, layout))
+            layout = False
+        line += value.count("\n")
+    return tokens
+
+
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "a": "\a", "b": "\b", "f": "\f", "v": "\v",
+            "e": "\x1b", "s": " "}
+
+
+def _number(text: str):
+    if text.startswith("0'"):
+        char = text[2:]
+        if char == "''":
+            return ord("'")
+        return ord(_ESCAPES.get(char[1], char[1]) if char.startswith("\\") else char)
+    if text[:2] in ("0x", "0o", "0b"):
+        return int(text, 0)
+    return float(text) if any(c in text for c in ".eE") else int(text)
+
+
+def _unquote(text: str) -> str:
+    body = text[1:-1]
+    quote = text[0]
+    body = body.replace(quote * 2, quote)
+    return re.sub(r"\\(.)", lambda m: _ESCAPES.get(m.group(1), m.group(1)), body)
+
+
+##### PARSER #####
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise PrologSyntaxError("unexpected end of program", self.tokens[-1].line if self.tokens else 1)
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        token = self.next()
+        if token.value != value or token.kind in ("quoted", "string", "backquoted"):
+            raise PrologSyntaxError(f"expected {value!r}, found {token.value!r}", token.line)
+        return token
+
+    @staticmethod
+    def _atom_name(token):
+        if token.kind in ("name", "symbol", "solo"):
+            return token.value
+        if token.kind == "quoted":
+            return _unquote(token.value)
+        if token.kind == "punct" and token.value in (",", "|"):
+            return token.value
+        return None
+
+    def _starts_term(self, token):
+        if token is None or token.kind == "end":
+            return False
+        if token.kind == "punct":
+            return token.value in ("(", "[", "{")
+        name = self._atom_name(token)
+        return not (name in INFIX_OPS and token.kind != "quoted" and not self._is_functional(self.pos + 1))
+
+    def _is_functional(self, index):
+        token = self.tokens[index] if index < len(self.tokens) else None
+        return token is not None and token.value == "(" and token.kind == "punct" and not token.layout_before
+
+    def _arguments(self, close):
+        args = [self.parse(999)]
+        while self.peek() is not None and self.peek().value == "," and self.peek().kind == "punct":
+            self.next()
+            args.append(self.parse(999))
+        self.expect(close)
+        return args
+
+    def _primary(self, max_priority):
+        token = self.next()
+
+        if token.kind == "number":
+            return _number(token.value), 0
+        if token.kind == "var":
+            return Var(token.value), 0
+        if token.kind in ("string", "backquoted"):
+            return PString(_unquote(token.value)), 0
+
+        if token.kind == "punct":
+            if token.value == "(":
+                term = self.parse(1200)
+                self.expect(")")
+                return term, 0
+            if token.value == "[":
+                if self.peek() is not None and self.peek().value == "]":
+                    self.next()
+                    return Struct("[]", ()), 0
+                items = [self.parse(999)]
+                while self.peek() is not None and self.peek().value == ",":
+                    self.next()
+                    items.append(self.parse(999))
+                tail = Struct("[]", ())
+                if self.peek() is not None and self.peek().value == "|":
+                    self.next()
+                    tail = self.parse(999)
+                self.expect("]")
+                for item in reversed(items):
+                    tail = Struct("[|]", (item, tail))
+                return tail, 0
+            if token.value == "{":
+                if self.peek() is not None and self.peek().value == "}":
+                    self.next()
+                    return Struct("{}", ()), 0
+                term = self.parse(1200)
+                self.expect("}")
+                return Struct("{}", (term,)), 0
+
+        name = self._atom_name(token)
+        if name is None:
+            raise PrologSyntaxError(f"unexpected {token.value!r}", token.line)
+
+        if self._is_functional(self.pos):
+            self.next()
+            return Struct(name, tuple(self._arguments(")"))), 0
+
+        if token.kind != "quoted" and name in PREFIX_OPS:
+            following = self.peek()
+            if name == "-" and following is not None and following.kind == "number" and not following.layout_before:
+                return -_number(self.next().value), 0
+            if self._starts_term(following):
+                priority, kind = PREFIX_OPS[name]
+                priority = min(priority, max_priority)
+                operand = self.parse(priority if kind == "fy" else priority - 1)
+                return Struct(name, (operand,)), priority
+
+        priority = max(INFIX_OPS.get(name, (0,))[0], PREFIX_OPS.get(name, (0,))[0])
+        return Struct(name, ()), priority if priority <= max_priority else 0
+
+    def parse(self, max_priority):
+        return self._parse(max_priority)[0]
+
+    def _parse(self, max_priority):
+        left, left_priority = self._primary(max_priority)
+
+        while True:
+            token = self.peek()
+            if token is None or token.kind in ("end", "quoted", "string", "backquoted", "var", "number"):
+                break
+            name = self._atom_name(token)
+            if name not in INFIX_OPS:
+                break
+            priority, kind = INFIX_OPS[name]
+            if priority > max_priority:
+                break
+            left_max = priority if kind == "yfx" else priority - 1
+            if left_priority > left_max:
+                break
+            self.next()
+            right = self.parse(priority if kind == "xfy" else priority - 1)
+            left, left_priority = Struct(";" if name == "|" else name, (left, right)), priority
+        return left, left_priority
+
+    def clause(self):
+        first = self.peek()
+        term = self.parse(1200)
+        token = self.next()
+        if token.kind != "end":
+            raise PrologSyntaxError(f"operator expected, found {token.value!r}", token.line)
+        return Clause(term, first.line)
+
+
+def parse_program(text: str) -> list:
+    """
+    Read all clauses of a program.
+
+    Raises:
+        PrologSyntaxError: with the line of the first syntax error
+    """
+    parser = _Parser(tokenize(text))
+    clauses = []
+    while parser.peek() is not None:
+        clauses.append(parser.clause())
+    return clauses
+
+
+def parse_term(text: str):
+    """Read a single term such as a query (a trailing "." is optional)."""
+    tokens = tokenize(text)
+    if not tokens or tokens[-1].kind != "end":  # not text.endswith("."): e.g. "X = 0'."
+        tokens = tokenize(text + " .")
+    parser = _Parser(tokens)
+    clauses = []
+    while parser.peek() is not None:
+        clauses.append(parser.clause())
+    if len(clauses) != 1:
+        raise PrologSyntaxError("expected a single term", 1)
+    return clauses[0].term
+
+
+def is_ground(term) -> bool:
+    """True if a term contains no variables (a yes/no query)."""
+    pending = [term]
+    while pending:
+        term = pending.pop()
+        if isinstance(term, Var):
+            return False
+        if isinstance(term, Struct):
+            pending.extend(term.args)
+    return True
+
+
+##### CALL GRAPH #####
+
+# meta-predicates: (name, arity) -> indexes of arguments that are goals
+META_ARGUMENTS = {
+    ("\\+", 1): [0], ("not", 1): [0], ("once", 1): [0], ("ignore", 1): [0], ("call", 1): [0],
+    ("findall", 3): [1], ("findall", 4): [1], ("forall", 2): [0, 1],
+    ("bagof", 3): [1], ("setof", 3): [1], ("aggregate_all", 3): [1], ("aggregate_all", 4): [2],
+    ("catch", 3): [0, 2], ("call_cleanup", 2): [0, 1], ("setup_call_cleanup", 3): [0, 1, 2],
+    ("call_with_inference_limit", 3): [0], ("call_with_time_limit", 2): [1],
+    ("tabled_call", 1): [0], ("limit", 2): [1], ("offset", 2): [1], ("order_by", 2): [1],
+    ("distinct", 1): [0], ("distinct", 2): [1],
+}
+CONTROL = {(",", 2), (";", 2), ("->", 2), ("*->", 2)}
+
+
+def indicator(term):
+    """(name, arity) of a callable term, None for variables and non-callables."""
+    if isinstance(term, Struct):
+        return term.name, len(term.args)
+    return None
+
+
+def split_clause(term):
+    """
+    Return (head, body, is_dcg) of a clause term; (None, directive goal, False) for
+    directives. Facts have the body `true`.
+    """
+    if isinstance(term, Struct) and term.name == ":-" and len(term.args) == 1:
+        return None, term.args[0], False
+    if isinstance(term, Struct) and term.name in (":-", "-->") and len(term.args) == 2:
+        head = term.args[0]
+        if isinstance(head, Struct) and head.name == "," and len(head.args) == 2:  # pushback
+            head = head.args[0]
+        return head, term.args[1], term.name == "-->"
+    return term, Struct("true", ()), False
+
+
+def _strip_module(goal):
+    while isinstance(goal, Struct) and goal.name == ":" and len(goal.args) == 2:
+        goal = goal.args[1]
+    return goal
+
+
+def body_goals(body, dcg=False):
+    """Yield (goal term, (name, arity)) for every predicate called by a clause body."""
+    goal = _strip_module(body)
+    if not isinstance(goal, Struct):
+        return  # variable goal (call at run time) or a number
+
+    key = indicator(goal)
+
+    if dcg:
+        if key in CONTROL:
+            for arg in goal.args:
+                yield from body_goals(arg, dcg=True)
+        elif key == ("\\+", 1):
+            yield from body_goals(goal.args[0], dcg=True)
+        elif key == ("{}", 1):
+            yield from body_goals(goal.args[0])
+        elif goal.name in ("[]", "[|]", "!") or isinstance(goal, PString):
+            return
+        elif goal.name == "call":
+            return
+        else:
+            yield goal, (goal.name, len(goal.args) + 2)
+        return
+
+    if key in CONTROL:
+        for arg in goal.args:
+            yield from body_goals(arg)
+        return
+
+    yield goal, key
+
+    if key in META_ARGUMENTS:
+        for index in META_ARGUMENTS[key]:
+            inner = goal.args[index]
+            while isinstance(inner, Struct) and inner.name == "^" and len(inner.args) == 2:
+                inner = inner.args[1]  # bagof/setof: Var^Goal
+            yield from body_goals(inner)
+    elif goal.name == "call" and len(goal.args) > 1:
+        inner = _strip_module(goal.args[0])
+        if isinstance(inner, Struct):
+            yield from body_goals(Struct(inner.name, inner.args + goal.args[1:]))
+
+
+def head_indicator(head, dcg=False):
+    head = _strip_module(head)
+    if not isinstance(head, Struct):
+        return None
+    return head.name, len(head.args) + (2 if dcg else 0)
+
+
+def call_graph(clauses) -> dict:
+    """{(name, arity): set of called (name, arity)} for every predicate defined by `clauses`."""
+    graph = {}
+    for clause in clauses:
+        head, body, dcg = split_clause(clause.term)
+        key = head_indicator(head, dcg) if head is not None else None
+        if key is None:
+            continue
+        callees = graph.setdefault(key, set())
+        callees.update(called for _, called in body_goals(body, dcg) if called is not None)
+    return graph
+
+
+def recursive_predicates(graph: dict) -> set:
+    """Defined predicates that can call themselves (directly or through other predicates)."""
+    index, low, on_stack, stack = {}, {}, set(), []
+    recursive = set()
+    counter = [0]
+
+    def strongconnect(node):
+        # iterative Tarjan, so deep call chains cannot hit Python's recursion limit
+        work = [(node, iter(sorted(graph.get(node, ()))))]
+        index[node] = low[node] = counter[0]
+        counter[0] += 1
+        stack.append(node)
+        on_stack.add(node)
+
+        while work:
+            current, children = work[-1]
+            advanced = False
+            for child in children:
+                if child not in graph:
+                    continue  # built-in or undefined
+                if child not in index:
+                    index[child] = low[child] = counter[0]
+                    counter[0] += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(sorted(graph.get(child, ())))))
+                    advanced = True
+                    break
+                if child in on_stack:
+                    low[current] = min(low[current], index[child])
+            if advanced:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[current])
+            if low[current] == index[current]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == current:
+                        break
+                if len(component) > 1 or current in graph.get(current, ()):
+                    recursive.update(component)
+
+    for node in sorted(graph):
+        if node not in index:
+            strongconnect(node)
+    return recursive
+
+
+##### TABLING #####
+
+# Predicates whose answers must not be memoized (side effects, clause database updates)
+SIDE_EFFECTS = {
+    "assert", "asserta", "assertz", "retract", "retractall", "abolish", "write", "writeln", "print",
+    "format", "nl", "read", "read_term", "nb_setval", "b_setval", "nb_getval", "b_getval",
+    "flag", "random", "random_between", "random_member", "get_time",
+}
+
+
+def _declared(clauses, directive_name):
+    declared = set()
+    for clause in clauses:
+        head, body, _ = split_clause(clause.term)
+        if head is not None or not isinstance(body, Struct) or body.name != directive_name:
+            continue
+        pending = list(body.args)
+        while pending:
+            spec = pending.pop()
+            if isinstance(spec, Struct) and spec.name in (",", "[|]", "as") and spec.args:
+                pending.extend(spec.args[:1] if spec.name == "as" else spec.args)
+            elif isinstance(spec, Struct) and spec.name in ("/", "//") and len(spec.args) == 2:
+                name, arity = _strip_module(spec.args[0]), spec.args[1]
+                if isinstance(name, Struct) and isinstance(arity, int):
+                    declared.add((name.name, arity + (2 if spec.name == "//" else 0)))
+    return declared
+
+
+def tabling_candidates(clauses) -> list:
+    """
+    Recursive predicates that are safe to table: not dynamic, not already tabled, and
+    without cuts or side effects in their clauses.
+    """
+    graph = call_graph(clauses)
+    excluded = _declared(clauses, "table") | _declared(clauses, "dynamic")
+
+    impure = set()
+    for clause in clauses:
+        head, body, dcg = split_clause(clause.term)
+        key = head_indicator(head, dcg) if head is not None else None
+        if key is None:
+            continue
+        for goal, called in body_goals(body, dcg):
+            if called is None:
+                continue
+            if called[0] == "!" or called[0] in SIDE_EFFECTS:
+                impure.add(key)
+
+    return sorted(recursive_predicates(graph) - excluded - impure)
+
+
+def prepare_program(program: str):
+    """
+    Prepend `:- table` directives for the recursive predicates of a program, so left
+    recursion and cyclic data (ancestor/path/transitive closures) terminate instead of
+    looping until a limit is hit.
+
+    Returns:
+        tuple: (program to consult, list of tabled "name/arity" strings)
+    """
+    try:
+        clauses = parse_program(program)
+    except PrologSyntaxError:
+        return program, []  # let SWI-Prolog report the error
+
+    if any(head is None and isinstance(body, Struct) and body.name == "module"
+           for head, body, _ in map(split_clause, (c.term for c in clauses))):
+        return program, []  # directives may not precede :- module/2
+
+    tabled = [f"{quote_atom(name)}/{arity}" for name, arity in tabling_candidates(clauses)]
+    if not tabled:
+        return program, []
+    return f":- table {', '.join(tabled)}.\n" + program, tabled
+
+
+def quote_atom(name: str) -> str:
+    if name[:1].islower() and re.fullmatch(r"\w+", name):
+        return name
+    return "'" + name.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+##### VALIDATION #####
+
+# Control constructs and common built-ins, accepted without asking `is_known` (by name)
+BUILTINS = {
+    # control
+    "true", "fail", "false", "!", ",", ";", "->", "*->", "\\+", "not", "call", "once", "ignore",
+    "catch", "throw", "halt", "forall", "findall", "bagof", "setof", "aggregate_all", "between",
+    "succ", "plus", "phrase", "dif", "freeze", "when",
+    # comparison and arithmetic
+    "=", "\\=", "==", "\\==", "@<", "@>", "@=<", "@>=", "=..", "is", "=:=", "=\\=",
+    "<", ">", "=<", ">=", "compare",
+    # type checks and term inspection
+    "var", "nonvar", "atom", "number", "integer", "float", "atomic", "compound", "callable",
+    "is_list", "ground", "string", "functor", "arg", "copy_term",
+    # lists
+    "length", "append", "member", "memberchk", "reverse", "nth0", "nth1", "last", "msort", "sort",
+    "sum_list", "max_list", "min_list", "maplist", "foldl", "select", "exclude", "include",
+    # database and output
+    "assert", "asserta", "assertz", "retract", "retractall", "dynamic", "discontiguous", "table",
+    "write", "writeln", "print", "nl", "format",
+}
+
+# Directives that bring in code (and operators) this reader cannot see; such programs are not checked
+_LOADS_CODE = re.compile(r":-\s*(use_module|ensure_loaded|consult|include|load_files|module|op)\s*\(")
+
+
+def _format_indicator(key):
+    return f"{key[0]}/{key[1]}"
+
+
+def _undefined_errors(calls, defined, is_known):
+    """
+    Diagnostics for (where, caller, goal key) calls to predicates that are neither
+    defined by the program nor known to `is_known(name, arity)`.
+    """
+    arities = {}
+    for name, arity in defined:
+        arities.setdefault(name, []).append(arity)
+
+    errors, reported = [], set()
+    for where, caller, key in calls:
+        if key in defined or key[0] in BUILTINS or (where, key) in reported or is_known(*key):
+            continue
+        reported.add((where, key))
+        message = f"{where}: undefined predicate {_format_indicator(key)}"
+        if caller is not None:
+            message += f" (called by {_format_indicator(caller)})"
+        if key[0] in arities:
+            message += f"; {key[0]} is defined with arity {', '.join(map(str, sorted(arities[key[0]])))}"
+        errors.append(message)
+    return errors
+
+
+def program_errors(program: str, query: str = None, is_known=None) -> list:
+    """Errors found by `check_program` (a program with errors is not consulted)."""
+    return check_program(program, query, is_known)[0]
+
+
+def check_program(program: str, query: str = None, is_known=None):
+    """
+    Statically check a program (and optionally its query) before it is consulted:
+    clause heads that are not callable and, when `is_known` is given,
+    calls to predicates that are neither defined by the program nor known to
+    `is_known(name, arity)` (with the arities that do exist when only the arity is
+    wrong). Only the Prolog system knows every built-in and autoloadable library
+    predicate, so the Prolog worker passes a lookup into its engine; without one,
+    calls are not checked.
+
+    Text this reader cannot parse is only a warning: the program may still be valid
+    Prolog, so SWI-Prolog decides. Programs that load other code or declare operators
+    are not checked.
+
+    Returns:
+        tuple: (errors, warnings), lists of diagnostics such as "line 4: undefined
+        predicate older/2 (called by ...)" / "possible syntax error at line 2: ..."
+    """
+    if _LOADS_CODE.search(program):
+        return [], []
+    try:
+        clauses = parse_program(program)
+    except PrologSyntaxError as e:
+        return [], [f"possible syntax error at {e}"]
+
+    errors, calls = [], []
+    defined = _declared(clauses, "dynamic")
+    for clause in clauses:
+        head, body, dcg = split_clause(clause.term)
+        if head is None:
+            continue  # directives run at load time; their errors are reported by Prolog
+        key = head_indicator(head, dcg)
+        if key is None or isinstance(_strip_module(head), PString):
+            errors.append(f"line {clause.line}: clause head is not a callable term")
+            continue
+        defined.add(key)
+        calls.extend((f"line {clause.line}", key, called) for _, called in body_goals(body, dcg) if called)
+
+    warnings = []
+    if query:
+        try:
+            goal = parse_term(query)
+        except PrologSyntaxError as e:
+            warnings.append(f"possible syntax error in the query at {e}")
+        else:
+            if isinstance(goal, Struct) and goal.name == "?-" and len(goal.args) == 1:
+                goal = goal.args[0]
+            calls.extend(("query", None, called) for _, called in body_goals(goal) if called)
+
+    if is_known is None:
+        return errors, warnings
+    return errors + _undefined_errors(calls, defined, is_known), warnings
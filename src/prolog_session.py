@@ -0,0 +1,176 @@
+"""
+Persistent Prolog knowledge bases for multi-question sessions.
+
+`run_crisp_prolog` writes and consults the whole program for every query. When many
+questions are asked about the same context, a `PrologSession` loads the program once
+into a named module of its own Prolog worker process; follow-up questions only run
+queries, and facts can be added or removed incrementally with `assertz` / `retract`
+instead of reloading thousands of clauses.
+
+    with PrologSession(program) as kb:
+        kb.query("grandparent(tom, X)")
+        kb.assertz("parent(ann, joe)")
+        kb.query("grandparent(tom, joe)")
+
+A session owns one worker for its lifetime (they are not taken from the shared pool,
+so open sessions never starve `run_crisp_prolog`). If the worker times out or dies,
+the next call starts a new one and replays the program and all deltas applied so far
+(a worker whose replay fails is discarded, so the next call tries again from scratch).
+
+Programs get the static checks and tabling of one-shot programs (prolog_analysis.py):
+clause heads that are not callable are rejected, and recursive predicates are tabled
+(declared dynamic as well, since knowledge base clauses are asserted). The worker
+abolishes all tables after every update, so answers never come from stale tables.
+Calls to undefined predicates are not rejected: a session may define them later with
+`assertz`.
+"""
+import os
+import threading
+import uuid
+
+import tracing
+from engine_tools import (PROLOG_INFERENCE_LIMIT, PROLOG_MAX_SOLUTIONS, PROLOG_MEMORY_LIMIT_MB,
+                          PROLOG_SOLUTION_TIME_SHARE, PROLOG_TIME_LIMIT, normalize_prolog_result)
+from prolog_analysis import check_program, prepare_program
+from sandbox_pool import Worker, WorkerCrashed, WorkerTimeout, WorkerUnavailable
+
+PROLOG_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prolog_worker.py")
+LOAD_TIMEOUT = 60  # seconds to load (or replay) a knowledge base
+
+
+class PrologSession:
+    """
+    A knowledge base kept loaded in a dedicated Prolog worker. Thread-safe.
+
+    Raises (on creation):
+        ValueError: the program could not be loaded (e.g. a syntax error or a
+            non-callable clause head)
+        WorkerCrashed / WorkerTimeout: the Prolog worker failed to start or load it
+    """
+
+    def __init__(self, program: str, time_limit: float = PROLOG_TIME_LIMIT,
+                 inference_limit: int = PROLOG_INFERENCE_LIMIT):
+        errors, _ = check_program(program)
+        if errors:
+            raise ValueError("Could not load knowledge base: " + "\n".join(errors))
+        program, self.tabled = prepare_program(program)
+        if self.tabled:
+            program = f":- dynamic {', '.join(self.tabled)}.\n" + program
+
+        self.program = program
+        self.time_limit = time_limit
+        self.inference_limit = inference_limit
+        self.module = f"kb_{uuid.uuid4().hex[:12]}"
+
+        self._deltas = []  # (op, clauses) applied after loading, replayed on a new worker
+        self._worker = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+        try:
+            error = self._load()
+        except (WorkerTimeout, WorkerCrashed):
+            self.close()
+            raise
+        if error:
+            self.close()
+            raise ValueError(f"Could not load knowledge base: {error['message']}")
+
+    def _load(self):
+        """Start a worker and load the program plus all deltas; returns an error dict or None."""
+        self._worker = Worker(PROLOG_WORKER_SCRIPT, PROLOG_MEMORY_LIMIT_MB)
+        jobs = [{"op": "load", "module": self.module, "program": self.program}]
+        jobs += [{"op": op, "module": self.module, "clauses": clauses} for op, clauses in self._deltas]
+
+        for job in jobs:
+            response = self._worker.run(job, timeout=LOAD_TIMEOUT)
+            if "error" in response:
+                return response
+        return None
+
+    def _run(self, job: dict, timeout: float, delta=None) -> dict:
+        with self._lock:
+            if self._closed:
+                return {"error": "invalid_input", "message": "The knowledge base session is closed."}
+
+            try:
+                if self._worker is None or not self._worker.is_alive():
+                    error = self._load()
+                    if error:
+                        self._discard_worker()  # half loaded
+                        return error
+                response = self._worker.run(job, timeout=timeout)
+            except WorkerTimeout:
+                self._discard_worker()
+                return {
+                    "error": "resource_exceeded",
+                    "message": f"Query did not finish within {timeout} seconds."
+                }
+            except WorkerUnavailable as e:
+                self._discard_worker()
+                return {"error": "engine_unavailable", "message": str(e)}
+            except WorkerCrashed as e:
+                self._discard_worker()
+                return {"error": "prolog_runtime_error", "message": str(e)}
+
+            tracing.record_sandbox_usage("prolog", response.get("_usage"))
+            if delta is not None and "error" not in response:
+                self._deltas.append(delta)
+            return response
+
+    def _discard_worker(self):
+        if self._worker is not None:
+            self._worker.kill()
+            self._worker = None
+
+    @tracing.traced("prolog_session_query")
+    def query(self, query: str, max_solutions: int = PROLOG_MAX_SOLUTIONS) -> dict:
+        """
+        Run `query` against the knowledge base, collecting at most `max_solutions` solutions.
+
+        Returns:
+            dict: like `run_crisp_prolog`: {engine, results} or {engine, error, message, query}
+        """
+        if not query:
+            return {"engine": "crisp_prolog", "error": "invalid_input", "message": "Query is missing."}
+
+        response = self._run({"op": "query", "module": self.module, "query": query,
+                              "inference_limit": self.inference_limit, "max_solutions": max_solutions,
+                              "time_budget": self.time_limit * PROLOG_SOLUTION_TIME_SHARE},
+                             timeout=self.time_limit)
+        if "error" in response:
+            return {
+                "engine": "crisp_prolog",
+                "error": response["error"],
+                "message": response["message"],
+                "query": query
+            }
+
+        return {
+            "engine": "crisp_prolog",
+            "results": normalize_prolog_result(response["results"], response["truncated"])
+        }
+
+    def _update(self, op: str, clauses) -> dict:
+        clauses = list(clauses)
+        return self._run({"op": op, "module": self.module, "clauses": clauses},
+                         timeout=self.time_limit, delta=(op, clauses))
+
+    def assertz(self, *clauses: str) -> dict:
+        """Add facts or rules (e.g. "parent(ann, joe)"); returns {"asserted": n} or an error."""
+        return self._update("assert", clauses)
+
+    def retract(self, *clauses: str) -> dict:
+        """Remove the first clause matching each pattern; returns {"retracted": n} or an error."""
+        return self._update("retract", clauses)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._discard_worker()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,286 @@
+"""
+Sandbox worker for crisp Prolog programs (see sandbox_pool.py).
+
+Every worker owns its own embedded SWI-Prolog engine, so crisp queries running in
+different workers never share state or need a lock. Inside a worker each program is
+consulted into a fresh throwaway module that is wiped once its query has run, so
+clauses of one request never leak into the next.
+
+Jobs with an "op" serve a persistent knowledge base instead (see prolog_session.py):
+"load" puts a program into a named `kb_*` module that stays loaded across jobs,
+"query" runs a goal against it and "assert" / "retract" apply clause deltas. Knowledge
+base clauses are asserted rather than compiled, so all their predicates are dynamic
+and can be updated incrementally; tables are abolished after every change.
+
+Before a program is consulted, its calls are checked against the predicates this
+engine actually provides (see prolog_analysis.program_errors): its built-ins, collected
+once at start, and whatever `predicate_property(user:Head, visible)` accepts, which
+includes the exports of autoloadable libraries. A program calling a predicate that is
+neither defined nor importable is rejected without running.
+
+Solutions are enumerated lazily and stop at the job's "max_solutions" or after its
+"time_budget" seconds, so queries with huge or infinite solution sets cannot exhaust
+memory. Jobs with "stream" set send them in batches while the search goes on.
+"""
+import itertools
+import os
+import re
+import tempfile
+import time
+
+from prolog_analysis import program_errors, quote_atom
+from sandbox_pool import serve
+
+prolog = None
+_job_ids = itertools.count(1)
+_known = set()  # (name, arity) of the predicates the engine provides, filled in lazily
+
+# Goal wrapper enforcing the inference limit; exceeding it raises a clear error
+SANDBOX_CALL = (
+    "sandbox_call(Goal, Limit) :- "
+    "call_with_inference_limit(Goal, Limit, Result), "
+    "( Result == inference_limit_exceeded -> throw(inference_limit_exceeded) ; true )"
+)
+
+# Remove every predicate defined in a job module (imported ones are left alone)
+SANDBOX_WIPE = (
+    "sandbox_wipe(M) :- "
+    "findall(M:P/A, ( current_predicate(M:P/A), functor(H, P, A), "
+    "\\+ predicate_property(M:H, imported_from(_)) ), Preds), "
+    "forall(member(Pred, Preds), catch(abolish(Pred), _, true))"
+)
+
+
+# Load a file clause by clause with assertz (after term expansion, so DCG rules work);
+# directives such as :- dynamic/1 or :- op/3 are run in the module (and read with its
+# operators). A directive that raises or fails aborts the load with that error.
+SANDBOX_LOAD = [
+    "sandbox_load(M, File) :- "
+    "setup_call_cleanup(open(File, read, S), sandbox_load_terms(M, S), close(S))",
+    "sandbox_load_terms(M, S) :- "
+    "read_term(S, T, [module(M)]), "
+    "( T == end_of_file -> true ; expand_term(T, X), sandbox_load_term(M, X), sandbox_load_terms(M, S) )",
+    "sandbox_load_term(M, X) :- is_list(X), !, forall(member(C, X), sandbox_load_term(M, C))",
+    "sandbox_load_term(M, (:- Goal)) :- !, ( M:Goal -> true ; throw(error(directive_failed(Goal), _)) )",
+    "sandbox_load_term(M, Clause) :- M:assertz(Clause)",
+]
+
+_KB_MODULE = re.compile(r"^kb_[A-Za-z0-9_]+$")
+
+# Kept below the worker's address space limit, so deep recursion and huge answer
+# tables raise a Prolog resource error instead of killing the process
+STACK_LIMIT_BYTES = 1024 * 1024 * 1024
+TABLE_SPACE_BYTES = 256 * 1024 * 1024
+
+STREAM_BATCH_SOLUTIONS = 50
+STREAM_FLUSH_SECONDS = 0.1
+
+
+def _preload():
+    global prolog
+    from pyswip import Prolog
+
+    prolog = Prolog()
+    prolog.assertz(SANDBOX_CALL)
+    prolog.assertz(SANDBOX_WIPE)
+    for clause in SANDBOX_LOAD:
+        prolog.assertz(clause)
+    list(prolog.query(f"set_prolog_flag(stack_limit, {STACK_LIMIT_BYTES})"))
+    list(prolog.query(f"set_prolog_flag(table_space, {TABLE_SPACE_BYTES})"))
+    for solution in prolog.query("predicate_property(system:H, built_in), functor(H, N, A)"):
+        _known.add((_plain(solution["N"]), solution["A"]))
+
+
+def is_known(name: str, arity: int) -> bool:
+    """Whether a module without clauses of its own can call name/arity (built in or autoloadable)."""
+    if (name, arity) in _known:
+        return True
+    visible = bool(list(prolog.query(
+        f"functor(H, {quote_atom(name)}, {int(arity)}), predicate_property(user:H, visible)", maxresult=1)))
+    if visible:
+        _known.add((name, arity))
+    return visible
+
+
+def _write_temp_program(program: str) -> str:
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".pl", delete=False) as f:
+        f.write(program)
+        return f.name
+
+
+def _prolog_path(path: str) -> str:
+    return path.replace("\\", "/").replace("'", "\\'")
+
+
+def _limit_error(e, inference_limit):
+    if "inference_limit_exceeded" in str(e):
+        return {
+            "error": "resource_exceeded",
+            "message": f"Query exceeded the limit of {inference_limit} inferences."
+        }
+    if "resource_error" in str(e):
+        return {
+            "error": "resource_exceeded",
+            "message": f"Query ran out of Prolog stack or table space: {e}"
+        }
+    return {"error": "prolog_runtime_error", "message": str(e)}
+
+
+def _clause(text: str) -> str:
+    return text.strip().rstrip(".")
+
+
+def _plain(value):
+    """Compact JSON form of a PySwip value: atoms and compound terms as Prolog text."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def _solutions(goal: str, job: dict):
+    """
+    Yield the solutions of `goal` one by one as compact binding dicts. Returns why the
+    search stopped early ("max_solutions" / "time_budget"), or None if it was exhausted
+    (`_job_solutions` may return an error dict instead, without yielding).
+    """
+    max_solutions = job.get("max_solutions")
+    deadline = time.monotonic() + job["time_budget"] if job.get("time_budget") else None
+
+    query = prolog.query(goal)
+    try:
+        for count, solution in enumerate(query, 1):
+            yield {name: _plain(value) for name, value in solution.items()}
+            if max_solutions and count >= max_solutions:
+                return "max_solutions"
+            if deadline and time.monotonic() >= deadline:
+                return "time_budget"
+    finally:
+        query.close()  # cuts the open Prolog query
+    return None
+
+
+def _stream(solutions, job: dict):
+    """Send solutions in batches as partial responses (see sandbox_pool.serve)."""
+    from pyswip.prolog import PrologError
+
+    batch, flushed = [], 0.0  # the first solution goes out at once, the rest in batches
+    try:
+        while True:
+            try:
+                batch.append(next(solutions))
+            except StopIteration as stop:
+                stopped = stop.value
+                break
+            if len(batch) >= STREAM_BATCH_SOLUTIONS or time.monotonic() - flushed >= STREAM_FLUSH_SECONDS:
+                yield batch
+                batch, flushed = [], time.monotonic()
+    except PrologError as e:
+        if batch:
+            yield batch
+        return _limit_error(e, job.get("inference_limit"))
+    finally:
+        solutions.close()
+
+    if isinstance(stopped, dict):  # rejected before running
+        return stopped
+    if batch:
+        yield batch
+    return {"truncated": stopped is not None, "stopped": stopped}
+
+
+def _collect(batches) -> dict:
+    results = []
+    while True:
+        try:
+            results.extend(next(batches))
+        except StopIteration as stop:
+            response = stop.value
+            break
+    return response if "error" in response else dict(response, results=results)
+
+
+def _answer(solutions, job: dict):
+    batches = _stream(solutions, job)
+    return batches if job.get("stream") else _collect(batches)
+
+
+def run_kb_job(job: dict) -> dict:
+    from pyswip.prolog import PrologError
+
+    module = job["module"]
+    if not _KB_MODULE.match(module):
+        return {"error": "invalid_input", "message": f"Invalid knowledge base module name: {module}"}
+
+    op = job["op"]
+    try:
+        if op == "load":
+            list(prolog.query(f"sandbox_wipe({module})"))
+            temp_file = _write_temp_program(job["program"])
+            try:
+                list(prolog.query(f"sandbox_load({module}, '{_prolog_path(temp_file)}')"))
+            finally:
+                os.remove(temp_file)
+                list(prolog.query("abolish_all_tables"))
+            return {"loaded": module}
+
+        if op == "query":
+            goal = f"sandbox_call({module}:({_clause(job['query'])}), {int(job['inference_limit'])})"
+            return _answer(_solutions(goal, job), job)
+
+        if op == "assert":
+            try:
+                for clause in job["clauses"]:
+                    list(prolog.query(f"{module}:assertz(({_clause(clause)}))"))
+            finally:
+                list(prolog.query("abolish_all_tables"))
+            return {"asserted": len(job["clauses"])}
+
+        if op == "retract":
+            retracted = 0
+            try:
+                for clause in job["clauses"]:
+                    retracted += len(list(prolog.query(f"{module}:retract(({_clause(clause)}))", maxresult=1)))
+            finally:
+                list(prolog.query("abolish_all_tables"))
+            return {"retracted": retracted}
+
+    except PrologError as e:
+        return _limit_error(e, job.get("inference_limit"))
+
+    return {"error": "invalid_input", "message": f"Unknown operation: {op}"}
+
+
+def _job_solutions(job: dict):
+    """Consult the program into a throwaway module and yield the query's solutions."""
+    errors = program_errors(job["program"], job["query"], is_known=is_known)
+    if errors:
+        return {"error": "invalid_program", "message": "Static check failed:\n" + "\n".join(errors)}
+
+    module = f"sandbox_job_{next(_job_ids)}"
+    query = _clause(job["query"])
+    temp_file = _write_temp_program(job["program"])
+
+    try:
+        list(prolog.query(f"{module}:consult('{_prolog_path(temp_file)}')"))
+        return (yield from _solutions(
+            f"sandbox_call({module}:({query}), {int(job['inference_limit'])})", job
+        ))
+
+    finally:
+        list(prolog.query(f"sandbox_wipe({module})"))
+        list(prolog.query("abolish_all_tables"))
+        os.remove(temp_file)
+
+
+def run_job(job: dict):
+    if "op" in job:
+        return run_kb_job(job)
+    return _answer(_job_solutions(job), job)
+
+
+if __name__ == "__main__":
+    serve(run_job, setup=_preload)
@@ -0,0 +1,135 @@
+"""
+Prompt assembly for provider-side prompt caching, and local token budgeting.
+
+OpenAI caches the longest prompt prefix it has seen recently (from 1024 tokens on,
+in 128-token steps): cached input tokens are billed at a discount and shorten the
+time to the first token. Only byte-identical prefixes are reused, so every stage
+builds its messages the same way:
+
+    system: the stage's prompt from prompts.py, sent verbatim (static instructions
+            belong there, never after the per-query text)
+    user:   labelled sections in a fixed order, "Context" first, then "Question",
+            then whatever changes per call or per attempt (mode, results, errors)
+
+Retry feedback goes after everything else (or into further messages), so a retry
+shares the whole prefix of the attempt before it. Tools and response schemas are
+part of the prefix too and are module constants.
+
+`count_tokens` counts locally (tiktoken's o200k_base, the gpt-4o tokenizer, when
+installed; otherwise an estimate) and `user_content` caps the context of the stages
+in CONTEXT_TOKEN_LIMITS, so one huge input can't blow up the cost of every stage.
+The mode decision and code generation are never capped: a fact cut from their
+context would silently change the answer. Every cut is printed as a warning and
+rolled up into the trace (`context_tokens_dropped`), which the pipeline copies into
+its result. The prefix-cache hit rate of each call is taken from `usage` in tracing.py.
+"""
+import functools
+import os
+import re
+
+import tracing
+
+# Most context tokens a stage receives; longer contexts keep their start and their
+# end (see `cap_tokens`). Override with FUZZY_LLM_CONTEXT_TOKENS_<STAGE>; stages
+# left out ("decide", "codegen") get the whole context unless a limit is set there.
+CONTEXT_TOKEN_LIMITS = {
+    "rewrite": 4000,  # raw text, before anything was dropped
+    "no_logic": 3000,
+    "summary": 2000,
+}
+
+_PIECE = re.compile(r"\w+|[^\w\s]+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+GAP_MARKER = " [...] "
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Tokens of `text` for the gpt-4o models. Without tiktoken this is an estimate:
+    one token per word or punctuation run, plus one per further 6 characters.
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum(1 + (len(piece) - 1) // 6 for piece in _PIECE.findall(text))
+
+
+def context_limit(stage: str):
+    """Most context tokens `stage` receives, or None if its context is never capped."""
+    limit = os.getenv(f"FUZZY_LLM_CONTEXT_TOKENS_{stage.upper()}")
+    return int(limit) if limit else CONTEXT_TOKEN_LIMITS.get(stage)
+
+
+def cap_tokens(text: str, limit) -> str:
+    """
+    `text` if it fits in `limit` tokens (or `limit` is None); otherwise its first and last whole sentences
+    (half of the budget each) joined by GAP_MARKER. Facts are usually stated first
+    and the situation asked about last.
+    """
+    if limit is None or count_tokens(text) <= limit:
+        return text
+
+    sentences = [s for s in _SENTENCE_END.split(text.strip()) if s]
+    head, tail, used = [], [], count_tokens(GAP_MARKER)
+    for sentence in sentences:
+        cost = count_tokens(sentence) + 1
+        if used + cost > limit // 2:
+            break
+        head.append(sentence)
+        used += cost
+    for sentence in reversed(sentences[len(head):]):
+        cost = count_tokens(sentence) + 1
+        if used + cost > limit:
+            break
+        tail.insert(0, sentence)
+        used += cost
+
+    if not head and not tail:  # a single enormous sentence: cut by characters
+        return text[:limit * 2] + GAP_MARKER
+    return " ".join(head) + GAP_MARKER + " ".join(tail)
+
+
+def stage_context(stage: str, text: str) -> str:
+    """
+    `text` capped to the context limit of `stage`. A cut is never silent: it is
+    printed and its dropped tokens are recorded in the trace (see tracing.py).
+    """
+    capped = cap_tokens(text, context_limit(stage))
+    if capped is not text:
+        dropped = count_tokens(text) - count_tokens(capped)
+        print(f"[WARN] {stage} context cut to {context_limit(stage)} tokens, "
+              f"{dropped} tokens from its middle were dropped")
+        tracing.record_context_cut(stage, dropped)
+    return capped
+
+
+def user_content(stage: str, context: str = None, question: str = None, *sections) -> str:
+    """
+    The user message of a stage: "Context", "Question", then the (label, text) pairs
+    of `sections` in the order given, each as "Label:\\ntext", separated by blank lines.
+    The context is capped to the stage's token limit (`stage_context`); None values
+    are left out.
+    """
+    parts = []
+    if context is not None:
+        parts.append(("Context", stage_context(stage, context)))
+    if question is not None:
+        parts.append(("Question", question))
+    parts.extend(section for section in sections if section[1] is not None)
+    return "\n\n".join(f"{label}:\n{text}" for label, text in parts)
+
+
+def chat_messages(system_prompt: str, content: str) -> list:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content},
+    ]
@@ -48,6 +48,7 @@ Rules:
 
 You are a reasoning decider. 
 Your output will be parsed automatically and must comply strictly with this JSON format.
+Return only one of of three: 'crisp', 'fuzzy' or 'no'; return only those string! nothing additional! Choose fuzzy more often, Since questions often involve degrees!
 """
 
 
@@ -71,6 +72,8 @@ Instructions:
 If the question involves probability, statistics, or arithmetic:
 - Clearly state the reasoning.
 - Present the final numeric result cleanly.
+
+Please summarize and solve it in textual manner and return the answer.
 """
 )
 
@@ -79,39 +82,46 @@ If the question involves probability, statistics, or arithmetic:
 
 
 FINAL_PROMPT=("""
-You are a logic reasoning assistant. 
-
-Your task is to produce a clear natural-language answer to the user's question, based on the results returned by a Prolog or fuzzy Prolog engine.
+You are a logic reasoning assistant. Answer the user's question in clear natural language, based on the result of the reasoning engine.
 
-Inputs you receive:
-- reasoning_mode: either "crisp" or "fuzzy"
-- clean_question: the user's rewritten question in natural language
-- clean_context: the context that user gave us rewritten in better formulated natural language.
-- tool_results: the structured results from the Prolog engine:
-    - For crisp logic: a list of dictionaries with variable bindings
-    - For fuzzy logic: a list of dictionaries with variable bindings including truth degrees (numbers between 0 and 1 usually, but can be higher than 1)
+Inputs: the reasoning mode ("crisp", "fuzzy" or "no"), the rewritten context and question, and the engine result as compact JSON:
+- crisp: whether the Prolog query succeeded, with its variable bindings
+- fuzzy: the crisp values of the fuzzy system's output variables (usually degrees between 0 and 1; the scale follows the variable's universe)
 
 Rules:
-1. Generate a **concise and clear answer** in natural language.
-2. Always interpret fuzzy truth values correctly:
-   - e.g., T=0.8 means "John is very tall" or "John is likely a good player" depending on context
-3. Only include information present in the tool_results; do NOT invent facts.
-4. Adapt phrasing based on reasoning_mode:
-   - crisp: binary logic (yes/no, true/false)
-   - fuzzy: include degrees or likelihoods in the explanation
-5. Output only natural-language text, no JSON or extra formatting.
-6. Make the answer understandable to a general user, not just Prolog programmers.
-7. If the results are empty, explain that no solution was found.
-
-Example outputs:
-- Crisp: "Yes, Alice is a good player."
-- Fuzzy: "John is likely a good player with a degree of 0.7."
+1. Be concise; use only information present in the result, do NOT invent facts.
+2. crisp: answer in binary terms (yes/no, true/false).
+3. fuzzy: interpret the numbers (e.g. 0.8 -> "very likely") and mention the degree.
+4. If the result is empty or an error, explain that no solution was found.
+5. Output plain natural-language text for a general user, no JSON.
+
+Examples: "Yes, Alice is a good player." / "John is likely a good player, with a degree of 0.7."
 """
+)
 
 
-)
 
 
+REWRITE_AND_ROUTE_PROMPT = """
+You prepare a user's context and question for an inference system, in one step.
+
+1. Rewrite the context and the question into clear, precise and well-structured natural language:
+   - Preserve the original meaning exactly; do NOT add, assume or remove information.
+   - Improve clarity, grammar and structure; split long or unclear sentences if necessary.
+   - Do NOT introduce logic symbols, code or Prolog, and do NOT answer the question.
+   - Example: "John is pretty tall and quite fast I guess. So I was wondering, like, is he actually a
+     good player or not?" -> "John is tall and fast." / "Determine whether John qualifies as a good
+     player based on these attributes."
+
+2. Decide the reasoning mode for the rewritten context and question:
+   - "fuzzy" -> graded or degree-based reasoning (uncertainty, partial truth, comparisons like young,
+     tall, high). Choose fuzzy more often, it is the broadest reasoning domain.
+   - "crisp" -> only if the problem can be written as classical facts and rules with true/false values.
+   - "no" -> mathematics, or when the problem cannot be encoded as facts/rules or inference is unnecessary.
+
+Return only JSON with the fields "reasoning_mode" (exactly one of "crisp", "fuzzy", "no"),
+"clean_context" and "clean_question".
+"""
 
 
 CRISP_PROLOG_GENERATOR_PROMPT = """
@@ -166,6 +176,7 @@ Output ONLY a JSON object with these exact keys:
 
 Remember: Your generated program will be executed, so it MUST be syntactically correct and logically complete.
 Remember: To use tool call when reasoning mode is crisp!!!! you have proper tool definition and use that tool by all means!!!
+If reasoning mode is crisp, call crisp_prolog tool, but by all means call tool!
 """
 
 
@@ -221,13 +232,43 @@ print(results)
 
 ### Output Format:
 
-Return ONLY the Python code, no markdown blocks, no explanations.
+Return ONLY executable Python code using the SIMPFUL library.
+- No explanations
+- No markdown
+- Code must run as-is
 Start directly with: from simpful import ...
 
 Your code will be executed as-is, so it MUST work perfectly.
 """
 
 
+FUZZY_SPEC_GENERATOR_PROMPT = """
+You are a fuzzy logic modeler. Describe a Mamdani fuzzy inference system that answers the
+question, as a JSON spec (it is compiled into a Simpful FuzzySystem for you).
+
+### Spec fields:
+- inputs: linguistic input variables, each with
+    - name: identifier (letters, digits, underscores)
+    - universe: [min, max]
+    - terms: fuzzy sets {term, shape, params}
+- outputs: output variables, same structure as inputs
+- rules: strings "IF (input IS term) THEN (output IS term)"; combine antecedents with AND / OR / NOT,
+  e.g. "IF (service IS poor) OR (food IS bad) THEN (tip IS low)"
+- values: the crisp value of EVERY input variable, taken or estimated from the context
+
+### Membership function shapes:
+- triangular: params [a, b, c] with a <= b <= c
+- trapezoidal: params [a, b, c, d] with a <= b <= c <= d
+- gaussian: params [mean, sigma] with sigma > 0
+
+### Requirements:
+1. Every variable and term used in a rule must be defined
+2. Terms of a variable should cover its whole universe
+3. Input values must lie inside the universe of their variable
+4. Keep it small: only the variables and rules the question needs
+"""
+
+
 EVALUATION_PROMPT = """You are an expert evaluator. You will be given:
 1. A generated summary from our system
 2. The expected correct answer
@@ -0,0 +1,129 @@
+"""
+Client-side rate limiting of OpenAI requests (requests and tokens per minute).
+
+A `RateLimiter` is installed process-wide with `set_rate_limiter`; every request
+that actually goes to the API (cache misses in llm_cache) first waits for one
+request and its estimated tokens, and afterwards settles the estimate against the
+real `usage` reported by the API. The request scheduler (scheduler.py) applies it
+together with the per-model limits.
+"""
+import asyncio
+import threading
+import time
+
+from prompt_layout import count_tokens
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute` tokens per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, amount: float) -> float:
+        """Take `amount` tokens if available; otherwise return the seconds to wait."""
+        amount = min(amount, self.capacity)  # a single huge request must still pass eventually
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are now), without taking them."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            return max(0.0, (amount - self._tokens) / self.rate)
+
+    def adjust(self, amount: float):
+        """Give back (negative) or take (positive) tokens after the fact."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+    def acquire(self, amount: float = 1):
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, amount: float = 1):
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits (either may be None)."""
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, estimated_tokens: int):
+        if self.requests:
+            self.requests.acquire(1)
+        if self.tokens:
+            self.tokens.acquire(estimated_tokens)
+
+    async def acquire_async(self, estimated_tokens: int):
+        if self.requests:
+            await self.requests.acquire_async(1)
+        if self.tokens:
+            await self.tokens.acquire_async(estimated_tokens)
+
+    def wait_time(self, estimated_tokens: int) -> float:
+        """Seconds until one request with `estimated_tokens` may be sent (0: now)."""
+        return max(self.requests.wait_time(1) if self.requests else 0.0,
+                   self.tokens.wait_time(estimated_tokens) if self.tokens else 0.0)
+
+    def take(self, estimated_tokens: int):
+        """Account one request without waiting (after `wait_time` returned 0)."""
+        if self.requests:
+            self.requests.adjust(1)
+        if self.tokens:
+            self.tokens.adjust(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, response):
+        """Correct the token bucket with the usage the API actually reported."""
+        usage = getattr(response, "usage", None)
+        if self.tokens and usage is not None:
+            self.tokens.adjust(usage.total_tokens - estimated_tokens)
+
+
+def estimate_tokens(params: dict) -> int:
+    """Token estimate of a request: its message texts counted locally, plus the completion."""
+    prompt = params.get("messages") or params.get("input") or ""
+    if isinstance(prompt, str):
+        prompt_tokens = count_tokens(prompt)
+    else:  # a few tokens of framing per message
+        prompt_tokens = sum(count_tokens(str(m.get("content") or "")) + 4 for m in prompt)
+    completion = params.get("max_tokens") or params.get("max_output_tokens") or 512
+    return prompt_tokens + completion
+
+
+_rate_limiter = None
+
+
+def set_rate_limiter(limiter):
+    """Install `limiter` for all OpenAI requests of this process (None removes it)."""
+    global _rate_limiter
+    _rate_limiter = limiter
+
+
+def get_rate_limiter():
+    return _rate_limiter
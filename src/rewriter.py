@@ -1,60 +1,172 @@
 import os
-from openai import OpenAI
-from prompts import REWRITER_PROMPT,REASONING_DECIDER_PROMPT
+import re
+from openai.types.chat import ChatCompletion
+from openai.types.responses import ParsedResponse
+from llm_cache import acached_call, cached_call
+from openai_clients import get_async_client, get_client
+from mode_router import log_decision, route_locally
+from prompt_layout import chat_messages, stage_context, user_content
+from tracing import set_attributes, traced
+from prompts import REWRITER_PROMPT,REASONING_DECIDER_PROMPT,REWRITE_AND_ROUTE_PROMPT
 from pydantic import BaseModel
 from typing import Literal
 
 class ReasoningModeOutput(BaseModel):
     reasoning_mode: Literal["crisp", "fuzzy","no"]
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+class RewriteAndRouteOutput(ReasoningModeOutput):
+    clean_context: str
+    clean_question: str
 
+client = get_client()
+async_client = get_async_client()
+
+
+def _rewrite_request(user_text: str) -> dict:
+    return dict(
+        model="gpt-4o-mini",
+        messages=chat_messages(REWRITER_PROMPT, stage_context("rewrite", user_text)),
+        temperature=0.3)
+
+
+@traced("rewrite_text")
 def rewrite_text(user_text: str) -> str:
     """
     Rewrites arbitrary user input text into clearer, more precise natural language.
     This is Step (1) of the Fuzzy-LLM pipeline.
     """
 
-    system_prompt = REWRITER_PROMPT
+    response = cached_call(client.chat.completions.create, ChatCompletion, **_rewrite_request(user_text))
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_text}
-        ] ,
-        temperature=0.3)
+    return response.choices[0].message.content.strip()
+
+
+@traced("rewrite_text")
+async def rewrite_text_async(user_text: str) -> str:
+    """Async version of `rewrite_text` (AsyncOpenAI client)."""
+
+    response = await acached_call(async_client.chat.completions.create, ChatCompletion,
+                                  **_rewrite_request(user_text))
 
     return response.choices[0].message.content.strip()
 
 
 
-def decide_reasoning_mode(clean_context: str, clean_question: str) -> str:
+def _decide_request(clean_context: str, clean_question: str) -> dict:
+    return dict(
+        model="gpt-4o-mini",
+        input=chat_messages(REASONING_DECIDER_PROMPT, user_content("decide", clean_context, clean_question)),
+        text_format=ReasoningModeOutput,
+        temperature=0.7
+    )
+
+
+@traced("decide_reasoning_mode")
+def decide_reasoning_mode(clean_context: str, clean_question: str, use_router: bool = True) -> str:
     """
     Decide whether to use crisp or fuzzy logic or if they aren't required return 'no'.
-    Uses structured output to guarantee valid results.
+    Confident cases are decided by the local router (see mode_router.py); otherwise
+    the LLM decides, using structured output to guarantee valid results.
     """
+    if use_router:
+        mode = route_locally(clean_context, clean_question)
+        if mode is not None:
+            return mode
 
-    system_prompt = REASONING_DECIDER_PROMPT
+    response = cached_call(client.responses.parse, ParsedResponse[ReasoningModeOutput],
+                           **_decide_request(clean_context, clean_question))
 
-    user_content = (
-        "Context:\n"
-        f"{clean_context}\n\n"
-        "Question:\n"
-        f"{clean_question}\n"
-        "Return only one of of three: 'crisp', 'fuzzy' or 'no'; return only those string! nothing additional! Choose fuzzy more often, Since questions often involve degrees!"
-    )
+    mode = response.output_parsed.reasoning_mode
+    log_decision(clean_context, clean_question, mode)
+    return mode
+
+
+@traced("decide_reasoning_mode")
+async def decide_reasoning_mode_async(clean_context: str, clean_question: str, use_router: bool = True) -> str:
+    """Async version of `decide_reasoning_mode` (AsyncOpenAI client)."""
+    if use_router:
+        mode = route_locally(clean_context, clean_question)
+        if mode is not None:
+            return mode
+
+    response = await acached_call(async_client.responses.parse, ParsedResponse[ReasoningModeOutput],
+                                  **_decide_request(clean_context, clean_question))
 
+    mode = response.output_parsed.reasoning_mode
+    log_decision(clean_context, clean_question, mode)
+    return mode
 
-    response = client.responses.parse(
+
+
+##### FUSED REWRITE + ROUTE #####
+
+WELL_FORMED_MAX_CHARS = 1500
+# chat shorthand, filler words and hedges the rewriter would remove
+_INFORMAL = re.compile(
+    r"\b(u|ur|r|pls|plz|thx|gonna|wanna|gotta|kinda|sorta|dunno|idk|lol|btw|i guess|like,|"
+    r"you know|i mean|so yeah|basically)\b|\bi\b(?!')", re.I)
+_SENTENCE = re.compile(r"[^.!?]+[.!?]+")
+
+
+def is_well_formed(text: str) -> bool:
+    """
+    Cheap check whether a text is already clean enough to skip the rewrite: not too
+    long, complete sentences that start with a capital letter, normal spacing and
+    punctuation, and no chat shorthand or filler words.
+    """
+    text = text.strip()
+    if not text or len(text) > WELL_FORMED_MAX_CHARS or not text.endswith((".", "!", "?")):
+        return False
+    if re.search(r"\s{2,}|([!?.,])\1|[,;:.][A-Za-z]|\s[,.;:!?]|[^.!?:\s]\n", text) or _INFORMAL.search(text):
+        return False
+    return all(sentence.strip()[:1].isupper() or sentence.strip()[:1].isdigit()
+               for sentence in _SENTENCE.findall(text))
+
+
+def _rewrite_and_route_request(raw_context: str, raw_question: str) -> dict:
+    return dict(
         model="gpt-4o-mini",
-        input=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_content}
-        ],
-        text_format=ReasoningModeOutput,
-        temperature=0.7
+        input=chat_messages(REWRITE_AND_ROUTE_PROMPT, user_content("rewrite", raw_context, raw_question)),
+        text_format=RewriteAndRouteOutput,
+        temperature=0.3
     )
 
-    return response.output_parsed.reasoning_mode
+
+@traced("rewrite_and_route")
+def rewrite_and_route(raw_context: str, raw_question: str):
+    """
+    Fused front stage: clean context, clean question and reasoning mode from a single
+    structured-output call instead of two rewrites plus a decision. Inputs that are
+    already well-formed are not rewritten; if both are, only the mode is decided (by
+    the local router when it is confident).
+
+    Returns:
+        tuple: (clean_context, clean_question, reasoning_mode)
+    """
+    if is_well_formed(raw_context) and is_well_formed(raw_question):
+        set_attributes(rewrite_skipped=True)
+        return raw_context, raw_question, decide_reasoning_mode(raw_context, raw_question)
+
+    response = cached_call(client.responses.parse, ParsedResponse[RewriteAndRouteOutput],
+                           **_rewrite_and_route_request(raw_context, raw_question))
+    return _fused_result(response)
+
+
+@traced("rewrite_and_route")
+async def rewrite_and_route_async(raw_context: str, raw_question: str):
+    """Async version of `rewrite_and_route` (AsyncOpenAI client)."""
+    if is_well_formed(raw_context) and is_well_formed(raw_question):
+        set_attributes(rewrite_skipped=True)
+        return raw_context, raw_question, await decide_reasoning_mode_async(raw_context, raw_question)
+
+    response = await acached_call(async_client.responses.parse, ParsedResponse[RewriteAndRouteOutput],
+                                  **_rewrite_and_route_request(raw_context, raw_question))
+    return _fused_result(response)
+
+
+def _fused_result(response):
+    output = response.output_parsed
+    set_attributes(rewrite_skipped=False)
+    log_decision(output.clean_context, output.clean_question, output.reasoning_mode)
+    return output.clean_context.strip(), output.clean_question.strip(), output.reasoning_mode
@@ -0,0 +1,328 @@
+"""
+Pool of long-lived sandboxed worker processes.
+
+Spawning a fresh interpreter for every generated program means paying the full
+Python startup plus the simpful/numpy/scipy (or SWI-Prolog) import on every attempt.
+Instead we keep a few warm worker processes around. Each worker imports its heavy
+libraries once and then serves jobs sent as JSON lines over its stdin, answering on
+a private copy of its stdout, so anything the job itself prints can never corrupt
+the protocol.
+
+Workers run with a memory cap, every job has its own timeout, and a worker is
+killed and replaced after a timeout, a crash or after serving `max_jobs_per_worker`
+jobs; an idle worker that died in the meantime (e.g. killed from outside) is replaced
+before it is handed out. A job handler may also answer with a generator: each value it yields is sent
+as a partial response as soon as it is ready (see `Worker.stream`), and its return
+value is the final response.
+"""
+import argparse
+import atexit
+import inspect
+import io
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from contextlib import redirect_stderr, redirect_stdout
+
+try:
+    import resource
+except ImportError:  # Windows: no rlimits / rusage
+    resource = None
+
+STARTUP_TIMEOUT = 60  # seconds a worker may take to import its libraries
+
+
+class WorkerTimeout(Exception):
+    """The job did not finish within its timeout (the worker has been killed)."""
+
+
+class WorkerCrashed(Exception):
+    """The worker process died or failed to start while serving a job."""
+
+
+class WorkerUnavailable(WorkerCrashed):
+    """The worker could not set up its engine (e.g. SWI-Prolog is not installed)."""
+
+
+class Worker:
+    """
+    A single sandboxed worker process speaking the JSON-lines protocol of `serve`.
+    Not thread-safe: a worker serves one job at a time (the pool guarantees that).
+    """
+
+    def __init__(self, script: str, memory_limit_mb: int):
+        env = dict(os.environ)
+        # numpy/scipy would otherwise start one BLAS thread per core in every worker
+        env.setdefault("OPENBLAS_NUM_THREADS", "1")
+        env.setdefault("OMP_NUM_THREADS", "1")
+        env.setdefault("MKL_NUM_THREADS", "1")
+
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", script, "--memory-limit-mb", str(memory_limit_mb)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            cwd=os.path.dirname(os.path.abspath(script)),
+            env=env,
+        )
+        self.jobs_done = 0
+        self._ready = False
+        self._messages = queue.Queue()
+
+        # A reader thread lets us wait on the pipe with a timeout on every platform.
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def _read_loop(self):
+        for line in self.process.stdout:
+            self._messages.put(line)
+        self._messages.put(None)  # EOF -> the process exited
+
+    def _receive(self, timeout):
+        try:
+            line = self._messages.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerTimeout(f"Execution timeout after {timeout} seconds")
+
+        if line is None:
+            raise WorkerCrashed(f"Worker process exited with code {self.process.wait()}")
+
+        return json.loads(line)
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _send(self, job: dict):
+        if not self._ready:
+            try:
+                ready = self._receive(STARTUP_TIMEOUT)
+            except WorkerTimeout:
+                raise WorkerCrashed("Worker process failed to start in time")
+            if not ready.get("ready"):
+                raise WorkerUnavailable(f"Worker failed to start: {ready.get('error')}")
+            self._ready = True
+
+        try:
+            self.process.stdin.write(json.dumps(job) + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise WorkerCrashed(f"Worker process exited with code {self.process.wait()}")
+
+    def run(self, job: dict, timeout: float) -> dict:
+        """Send one job to the worker and wait at most `timeout` seconds for the answer."""
+        self._send(job)
+        response = self._receive(timeout)
+        self.jobs_done += 1
+        return response
+
+    def stream(self, job: dict, timeout: float):
+        """
+        Send a job answered with partial responses: yields each partial payload as it
+        arrives and returns the final response. The whole job must finish within
+        `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        self._send(job)
+        while True:
+            message = self._receive(max(0.0, deadline - time.monotonic()))
+            if "_partial" not in message:
+                self.jobs_done += 1
+                return message
+            yield message["_partial"]
+
+    def kill(self):
+        if self.is_alive():
+            self.process.kill()
+        self.process.wait()
+
+
+class WorkerPool:
+    """
+    Thread-safe pool of warm `Worker` processes running `script`.
+
+    Workers are spawned lazily (or eagerly with `start()`), handed out one job at
+    a time, and recycled after a timeout, a crash or `max_jobs_per_worker` jobs.
+    """
+
+    def __init__(self, script: str, size: int = 4, max_jobs_per_worker: int = 100,
+                 memory_limit_mb: int = 1024):
+        self.script = script
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.memory_limit_mb = memory_limit_mb
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._spawned = 0
+        self._closed = False
+
+        atexit.register(self.shutdown)
+
+    def _spawn(self) -> Worker:
+        return Worker(self.script, self.memory_limit_mb)
+
+    def start(self):
+        """Pre-spawn workers up to the pool size so the first jobs find them warm."""
+        with self._lock:
+            while self._spawned < self.size:
+                self._idle.put(self._spawn())
+                self._spawned += 1
+
+    def _acquire(self) -> Worker:
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._spawned < self.size:
+                        worker = self._spawn()
+                        self._spawned += 1
+                        return worker
+                worker = self._idle.get()
+
+            if worker.is_alive():
+                return worker
+            self._release(worker, recycle=True)  # died while idle: replace it
+
+    def _release(self, worker: Worker, recycle: bool):
+        if self._closed:
+            worker.kill()
+            return
+
+        if not recycle and worker.is_alive() and worker.jobs_done < self.max_jobs_per_worker:
+            self._idle.put(worker)
+            return
+
+        # Replace the worker right away, so its imports run before the next job arrives
+        worker.kill()
+        try:
+            self._idle.put(self._spawn())
+        except OSError:
+            with self._lock:
+                self._spawned -= 1
+            raise
+
+    def run(self, job: dict, timeout: float) -> dict:
+        """
+        Run one job on a free worker (blocking until one is available).
+
+        Raises:
+            WorkerTimeout: the job exceeded `timeout`; the worker was recycled.
+            WorkerCrashed: the worker died while serving the job; it was recycled.
+        """
+        worker = self._acquire()
+        recycle = True
+        try:
+            response = worker.run(job, timeout)
+            recycle = False
+            return response
+        finally:
+            self._release(worker, recycle)
+
+    def stream(self, job: dict, timeout: float):
+        """
+        Like `run` for a streamed job (see `Worker.stream`). If the caller stops
+        iterating before the final response, the worker is still busy and is recycled.
+        """
+        worker = self._acquire()
+        recycle = True
+        try:
+            response = yield from worker.stream(job, timeout)
+            recycle = False
+            return response
+        finally:
+            self._release(worker, recycle)
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+
+##### WORKER SIDE #####
+
+def _limit_memory(memory_limit_mb: int):
+    if resource is None:  # rely on the job timeout only
+        return
+
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _cpu_seconds() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _max_rss_mb() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def _send_partials(protocol, partials) -> dict:
+    while True:
+        try:
+            partial = next(partials)
+        except StopIteration as stop:
+            return stop.value
+        protocol.write(json.dumps({"_partial": partial}, default=str) + "\n")
+        protocol.flush()
+
+
+def serve(handle_job, setup=None):
+    """
+    Worker main loop: read JSON jobs from stdin, answer each with `handle_job(job)`.
+
+    The protocol uses a private duplicate of the original stdout; file descriptor 1
+    itself is pointed at /dev/null so stray writes from libraries or jobs are dropped.
+    Each response carries the CPU time of the job and the worker's peak RSS in `_usage`.
+    `setup` runs once before the worker reports ready (e.g. to import simpful), with
+    its console output (such as banners) discarded.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--memory-limit-mb", type=int, default=1024)
+    args = parser.parse_args()
+
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+    if setup:
+        try:
+            with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+                setup()
+        except Exception as e:  # e.g. the engine's library is missing
+            protocol.write(json.dumps({"ready": False, "error": f"{type(e).__name__}: {e}"}) + "\n")
+            protocol.flush()
+            return
+
+    _limit_memory(args.memory_limit_mb)
+
+    protocol.write(json.dumps({"ready": True}) + "\n")
+    protocol.flush()
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        started = _cpu_seconds()
+        response = handle_job(json.loads(line))
+        if inspect.isgenerator(response):
+            response = _send_partials(protocol, response)
+        if resource is not None:
+            response["_usage"] = {
+                "cpu_seconds": _cpu_seconds() - started,
+                "max_rss_mb": _max_rss_mb(),
+            }
+        protocol.write(json.dumps(response, default=str) + "\n")
+        protocol.flush()
@@ -0,0 +1,342 @@
+"""
+Central scheduler of the OpenAI requests of a process.
+
+Every request that reaches the API (see openai_clients.py) waits here for admission.
+A request is admitted when all of these hold:
+
+- fewer requests are in flight than the adaptive concurrency limit. The limit
+  doubles per limit's worth of successful requests until the first sign of
+  overload ("slow start"), then grows by about one per limit's worth, drops by 30% on a 429 / 503
+  (at most once per cooldown), and shrinks by a tenth when recent latency climbs
+  well above its long-term average (the API is queueing)
+- the requests-per-minute / tokens-per-minute buckets of its model allow it
+  (FUZZY_LLM_MODEL_LIMITS, e.g. "gpt-4o-mini=500/200000,gpt-4o=500/30000"), as well
+  as the process-wide RateLimiter if one is installed (rate_limiter.py)
+- it is its turn: requests wait in priority lanes. "interactive" (the default) is
+  admitted LANE_WEIGHTS to 1 over "batch" (evaluation runs) when both wait, and
+  batch never holds more than BATCH_MAX_SHARE of the limit, so an interactive
+  request rarely waits behind a batch job. Within a lane, queries (tracing traces)
+  take turns, so one query with many calls can't crowd out the others.
+
+A request held back by its rate limits doesn't hold up requests for other models: the
+next one (in lane and query order) whose limits allow it goes first, and the scheduler
+only sleeps until the earliest rate-limited request may go when none of the waiting ones
+can. Requests for a rate-limited model keep their order, so small requests can't starve
+a large one.
+
+Run code in the batch lane with `with scheduler.lane("batch"): ...`, or set
+FUZZY_LLM_LANE for the whole process. Lanes only order the requests of one process.
+Separate processes share the API quota through the 429s: their limits back off.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import tracing
+from rate_limiter import RateLimiter, get_rate_limiter
+
+MAX_CONCURRENT_REQUESTS = int(os.getenv("FUZZY_LLM_MAX_CONCURRENT_REQUESTS", 64))
+INITIAL_CONCURRENCY = 16
+MIN_CONCURRENCY = 1
+OVERLOAD_DECREASE = 0.7  # factor applied to the limit on a 429
+DECREASE_COOLDOWN = 1.0  # seconds between two decreases of the limit (429s come in bursts)
+LATENCY_TOLERANCE = 2.0  # recent / long-term latency above which the API counts as congested
+
+LANES = ("interactive", "batch")
+LANE_WEIGHTS = {"interactive": 8, "batch": 1}  # admissions per round when both lanes wait
+BATCH_MAX_SHARE = 0.75  # of the concurrency limit
+
+_lane = contextvars.ContextVar("llm_lane", default=os.getenv("FUZZY_LLM_LANE", "interactive"))
+
+
+@contextmanager
+def lane(name: str):
+    """Send the requests made inside the block (and by tasks started in it) through lane `name`."""
+    if name not in LANES:
+        raise ValueError(f"Unknown lane {name!r}, expected one of {LANES}")
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def current_lane() -> str:
+    return _lane.get()
+
+
+def parse_model_limits(text: str) -> dict:
+    """"model=rpm/tpm,..." -> {model: RateLimiter} (an empty rpm or tpm means no limit)."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        model, _, values = item.partition("=")
+        rpm, _, tpm = values.partition("/")
+        limits[model.strip()] = RateLimiter(float(rpm) if rpm else None, float(tpm) if tpm else None)
+    return limits
+
+
+##### ADAPTIVE CONCURRENCY #####
+
+class AdaptiveLimit:
+    """Concurrency limit adjusted by additive increase / multiplicative decrease."""
+
+    def __init__(self, initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY, maximum=MAX_CONCURRENT_REQUESTS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.value = float(max(minimum, min(initial, maximum)))
+        self.recent_latency = None  # fast moving average
+        self.typical_latency = None  # slow moving average
+        self.slow_start = True
+        self._last_decrease = 0.0
+
+    def __int__(self):
+        return int(self.value)
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease >= DECREASE_COOLDOWN:
+            self.value = max(self.minimum, self.value * factor)
+            self._last_decrease = now
+        self.slow_start = False
+
+    def on_success(self, latency: float, in_flight: int):
+        if self.recent_latency is None:
+            self.recent_latency = self.typical_latency = latency
+        self.recent_latency += 0.3 * (latency - self.recent_latency)
+        self.typical_latency += 0.02 * (latency - self.typical_latency)
+
+        if self.recent_latency > LATENCY_TOLERANCE * self.typical_latency:
+            self._decrease(0.9)
+        elif in_flight + 1 >= int(self.value):  # only grow a limit that is actually used
+            self.value = min(self.maximum, self.value + (1.0 if self.slow_start else 1.0 / self.value))
+
+    def on_overload(self):
+        self._decrease(OVERLOAD_DECREASE)
+
+
+##### SCHEDULER #####
+
+class _Waiter:
+    def __init__(self, lane_name, flow, model, tokens, loop=None):
+        self.lane = lane_name
+        self.flow = flow
+        self.model = model
+        self.tokens = tokens
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class Ticket:
+    """An admitted request; `release` it exactly once when the request is over."""
+
+    def __init__(self, scheduler, waiter):
+        self._scheduler = scheduler
+        self._waiter = waiter
+        self.started = time.monotonic()
+
+    def release(self, response=None, overloaded=False, failed=False):
+        """
+        Args:
+            response: the API response, to settle the token estimate against its usage
+            overloaded: the API answered 429 / 503 (the concurrency limit is lowered)
+            failed: the request failed otherwise (no latency feedback)
+        """
+        self._scheduler._release(self._waiter, time.monotonic() - self.started, response, overloaded, failed)
+
+
+class Scheduler:
+    """Admits requests in lane / flow order within the concurrency and rate limits. Thread-safe."""
+
+    def __init__(self, model_limits=None, limit=None):
+        self.limit = limit or AdaptiveLimit()
+        self.model_limits = model_limits if model_limits is not None else {}
+        self._queues = {name: OrderedDict() for name in LANES}  # lane -> flow -> deque of waiters
+        self._credits = dict(LANE_WEIGHTS)
+        self._in_flight = {name: 0 for name in LANES}
+        self._timer = None
+        self._timer_due = 0.0
+        self._lock = threading.Lock()
+
+    # ---- admission order ----
+
+    def _lane_allowed(self, name):
+        if name == "batch":
+            return self._in_flight["batch"] < max(1, int(int(self.limit) * BATCH_MAX_SHARE))
+        return True
+
+    def _lane_order(self):
+        """
+        Weighted round robin over the lanes that have waiters (and room, for batch): the
+        lanes with credits left come first, the others are only tried after them.
+        """
+        waiting = [name for name in LANES if self._queues[name] and self._lane_allowed(name)]
+        if waiting and all(self._credits[name] <= 0 for name in waiting):
+            self._credits = dict(LANE_WEIGHTS)
+        return sorted(waiting, key=lambda name: self._credits[name] <= 0)
+
+    def _limiters(self, waiter):
+        return [limiter for limiter in (self.model_limits.get(waiter.model), get_rate_limiter()) if limiter]
+
+    def _rate_wait(self, waiter):
+        return max((limiter.wait_time(waiter.tokens) for limiter in self._limiters(waiter)), default=0.0)
+
+    def _next_waiter(self):
+        """
+        ((lane, flow, waiter), None) for the first waiter, in lane and flow order, that
+        the rate limits allow now and that doesn't queue behind a rate-limited request
+        for the same model; otherwise (None, seconds until the earliest one may go), or
+        (None, None) if nothing waits.
+        """
+        shortest = None
+        limited = set()  # models with a rate-limited waiter ahead
+        for name in self._lane_order():
+            for flow, waiters in self._queues[name].items():
+                for waiter in waiters:
+                    if waiter.model in limited:
+                        continue
+                    wait = self._rate_wait(waiter)
+                    if wait <= 0:
+                        return (name, flow, waiter), None
+                    limited.add(waiter.model)
+                    shortest = wait if shortest is None else min(shortest, wait)
+        return None, shortest
+
+    def _dispatch(self):
+        """Admit as many waiters as the limits allow (called with the lock held)."""
+        while sum(self._in_flight.values()) < int(self.limit):
+            found, wait = self._next_waiter()
+            if found is None:
+                if wait is not None:
+                    self._wake_after(wait)
+                return
+            name, flow, waiter = found
+            flows = self._queues[name]
+            waiters = flows[flow]
+            waiters.remove(waiter)
+
+            for limiter in self._limiters(waiter):
+                limiter.take(waiter.tokens)
+            del flows[flow]
+            if waiters:
+                flows[flow] = waiters  # to the back: the next query in the lane goes first
+            self._credits[name] -= 1
+            self._in_flight[name] += 1
+            waiter.grant()
+
+    def _wake_after(self, seconds):
+        due = time.monotonic() + seconds
+        if self._timer is not None and self._timer.is_alive():
+            if self._timer_due <= due:
+                return
+            self._timer.cancel()
+        self._timer_due = due
+        self._timer = threading.Timer(seconds, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._dispatch()
+
+    # ---- waiting ----
+
+    def _enqueue(self, waiter):
+        with self._lock:
+            self._queues[waiter.lane].setdefault(waiter.flow, deque()).append(waiter)
+            self._dispatch()
+
+    def _withdraw(self, waiter):
+        """Forget a waiter whose caller gave up (cancelled task)."""
+        with self._lock:
+            if waiter.granted:
+                self._in_flight[waiter.lane] -= 1
+            else:
+                waiters = self._queues[waiter.lane].get(waiter.flow)
+                if waiters and waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self._queues[waiter.lane][waiter.flow]
+            self._dispatch()
+
+    def _admitted(self, waiter):
+        tracing.record_queue_wait(waiter.lane, time.monotonic() - waiter.enqueued_at)
+        return Ticket(self, waiter)
+
+    def _waiter(self, model, tokens, loop=None):
+        current = tracing.current_span()
+        flow = current.trace_id if current is not None else f"thread-{threading.get_ident()}"
+        return _Waiter(current_lane(), flow, model, tokens, loop)
+
+    def acquire(self, model=None, tokens=0) -> Ticket:
+        """Block until a request for `model` with about `tokens` tokens may be sent."""
+        waiter = self._waiter(model, tokens)
+        self._enqueue(waiter)
+        waiter.event.wait()
+        return self._admitted(waiter)
+
+    async def acquire_async(self, model=None, tokens=0) -> Ticket:
+        """Async version of `acquire`."""
+        waiter = self._waiter(model, tokens, asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._withdraw(waiter)
+            raise
+        return self._admitted(waiter)
+
+    # ---- feedback ----
+
+    def _release(self, waiter, latency, response, overloaded, failed):
+        with self._lock:
+            in_flight = sum(self._in_flight.values())
+            self._in_flight[waiter.lane] -= 1
+            if overloaded:
+                self.limit.on_overload()
+            elif not failed:
+                self.limit.on_success(latency, in_flight)
+            if response is not None:
+                for limiter in self._limiters(waiter):
+                    limiter.settle(waiter.tokens, response)
+            self._dispatch()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "concurrency_limit": round(self.limit.value, 2),
+                "in_flight": dict(self._in_flight),
+                "queued": {name: sum(len(w) for w in flows.values()) for name, flows in self._queues.items()},
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """The process-wide scheduler (per-model limits from FUZZY_LLM_MODEL_LIMITS)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(parse_model_limits(os.getenv("FUZZY_LLM_MODEL_LIMITS", "")))
+        return _scheduler
+
+
+def set_scheduler(scheduler):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
@@ -0,0 +1,329 @@
+"""
+Semantic cache of whole pipeline results, for near-duplicate queries.
+
+The response cache (llm_cache.py) only helps when a request is byte-for-byte the same,
+but users often ask the same thing in slightly different words. This cache sits in
+front of the pipeline: the raw context and question are embedded as signed hashed
+vectors of character and word n-grams (no model download, 1-2 ms on the CPU) and looked
+up in an in-process IVF index. A stored result is reused, skipping every LLM stage,
+when both the context and the question are at least `threshold` cosine-similar and
+their numbers, names, negations and polarity words (comparatives, superlatives,
+quantifiers and common opposites such as high / low) match exactly, so "John is 25"
+never answers "John is 35", "Is Mary older than John?" never answers the reverse
+question and "the more suitable choice" never answers "the less suitable choice".
+
+Entries expire after `ttl_seconds`; past `max_entries` the least recently used ones
+are evicted. The index is written to `.cache/semantic_cache.npz` every SAVE_EVERY new
+entries and at exit, and loaded again on start.
+
+Enable it with FUZZY_LLM_SEMANTIC_CACHE=on (off by default, since it answers queries
+that are not identical); FUZZY_LLM_SEMANTIC_THRESHOLD sets the similarity threshold.
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import tracing
+
+DEFAULT_INDEX_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "semantic_cache.npz"
+)
+DEFAULT_THRESHOLD = 0.85
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+EMBEDDING_DIM = 512  # per text; an index vector holds the context and the question
+IVF_MIN_ENTRIES = 512  # below this every entry is compared (exact search)
+IVF_PROBES = 4  # clusters searched per lookup
+KMEANS_ITERATIONS = 10
+SAVE_EVERY = 25  # new entries between writes of the index file
+
+_WORD = re.compile(r"[a-z0-9]+")
+_TOKEN = re.compile(r"\d+(?:\.\d+)?|[A-Za-z]+n['’]t|[A-Za-z]+")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+NEGATIONS = {"not", "no", "never", "none", "nobody", "nothing", "neither", "nor", "without"}
+# Capitalized at the start of a sentence without being names
+SENTENCE_STARTERS = {
+    "the", "a", "an", "this", "that", "these", "those", "which", "what", "who", "whom", "whose",
+    "when", "where", "why", "how", "is", "are", "was", "were", "do", "does", "did", "can", "could",
+    "should", "would", "will", "shall", "may", "might", "must", "has", "have", "had", "if", "in",
+    "on", "at", "for", "from", "of", "to", "with", "by", "as", "and", "but", "or", "so", "then",
+    "there", "here", "it", "its", "he", "she", "they", "we", "i", "you", "his", "her", "their",
+    "our", "my", "your", "given", "assume", "assuming", "suppose", "consider", "please", "each",
+    "both", "one", "two", "three",
+}
+# Words that flip or scale the meaning of a question while barely changing its n-grams
+POLARITY = {
+    "more", "less", "fewer", "most", "least", "fewest", "better", "worse", "best", "worst",
+    "high", "higher", "highest", "low", "lower", "lowest", "big", "bigger", "biggest",
+    "small", "smaller", "smallest", "large", "larger", "largest", "great", "greater", "greatest",
+    "long", "longer", "longest", "short", "shorter", "shortest", "old", "older", "oldest",
+    "young", "younger", "youngest", "fast", "faster", "fastest", "slow", "slower", "slowest",
+    "strong", "stronger", "strongest", "weak", "weaker", "weakest", "good", "bad", "hot", "cold",
+    "above", "below", "over", "under", "before", "after", "increase", "decrease", "maximum",
+    "minimum", "max", "min", "all", "some", "any", "every", "each", "few", "many", "much",
+    "always", "sometimes", "often", "rarely", "seldom", "likely", "unlikely", "possible",
+    "impossible", "suitable", "unsuitable", "safe", "unsafe", "true", "false", "yes",
+}
+
+
+##### EMBEDDING #####
+
+def embed(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Unit vector of signed hashed word 1-2-grams and character 3-5-grams."""
+    words = _WORD.findall(text.lower())
+    joined = f" {' '.join(words)} "
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    features += [joined[i:i + n] for n in (3, 4, 5) for i in range(len(joined) - n + 1)]
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def anchors(text: str) -> list:
+    """
+    Numbers, names (capitalized words, except common words starting a sentence),
+    negations and polarity words, in order. Texts whose anchors differ never share a cached result.
+    """
+    found = []
+    for sentence in _SENTENCE.split(text.strip()):
+        for i, token in enumerate(_TOKEN.findall(sentence)):
+            lower = token.lower()
+            if token[0].isdigit():
+                found.append(token)
+            elif lower in NEGATIONS or lower[-3:] in ("n't", "n’t"):
+                found.append("not")
+            elif lower in POLARITY:
+                found.append(lower)
+            elif token[0].isupper() and len(token) > 1 and (i > 0 or lower not in SENTENCE_STARTERS):
+                found.append(lower)
+    return found
+
+
+def query_vector(raw_context: str, raw_question: str) -> np.ndarray:
+    """Index vector of a query; its dot product with another is the mean of both cosines."""
+    return np.concatenate([embed(raw_context), embed(raw_question)]) / np.float32(np.sqrt(2.0))
+
+
+##### INDEX #####
+
+class SemanticCache:
+    """
+    Near-duplicate lookup of pipeline results. Thread-safe.
+
+    Lookups compare against every entry until the index holds IVF_MIN_ENTRIES; then
+    the entries are clustered with k-means (about sqrt(n) clusters, retrained when the
+    index has doubled) and only the IVF_PROBES clusters nearest to the query are searched.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, threshold: float = DEFAULT_THRESHOLD,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # rows [0, len(self._entries)) of the buffers are in use; capacity doubles when full
+        self._vector_buffer = np.zeros((64, 2 * EMBEDDING_DIM), dtype=np.float32)
+        self._cluster_buffer = np.zeros(64, dtype=np.int32)
+        self._entries = []  # {context_anchors, question_anchors, result (JSON), created_at, last_access}
+        self._centroids = None
+        self._trained_size = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                self._load()
+            except (OSError, ValueError, KeyError):
+                pass  # unreadable index: start empty, it is overwritten on the next save
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def _vectors(self):
+        return self._vector_buffer[:len(self._entries)]
+
+    @property
+    def _clusters(self):
+        """Cluster of every entry."""
+        return self._cluster_buffer[:len(self._entries)]
+
+    def _set_rows(self, vectors, clusters):
+        capacity = max(64, 1 << len(vectors).bit_length())  # room to grow
+        self._vector_buffer = np.zeros((capacity, 2 * EMBEDDING_DIM), dtype=np.float32)
+        self._vector_buffer[:len(vectors)] = vectors
+        self._cluster_buffer = np.zeros(capacity, dtype=np.int32)
+        self._cluster_buffer[:len(clusters)] = clusters
+
+    # ---- lookup ----
+
+    def _candidate_rows(self, vector):
+        if self._centroids is None:
+            return np.arange(len(self._entries))
+        probes = np.argsort(self._centroids @ vector)[-IVF_PROBES:]
+        return np.flatnonzero(np.isin(self._clusters, probes))
+
+    def get(self, raw_context: str, raw_question: str):
+        """
+        The cached result of a near-duplicate query, or None. Records "semantic_cache"
+        (hit / miss) and the similarity of a hit on the current span.
+        """
+        vector = query_vector(raw_context, raw_question)
+        context_anchors, question_anchors = anchors(raw_context), anchors(raw_question)
+        now = time.time()
+
+        with self._lock:
+            rows = self._candidate_rows(vector)
+            similarities = self._vectors[rows] @ vector if rows.size else np.zeros(0)
+            for i in np.argsort(-similarities)[:10]:
+                if similarities[i] < self.threshold:
+                    break
+                row = rows[i]
+                entry = self._entries[row]
+                if now - entry["created_at"] > self.ttl_seconds:
+                    continue
+                # both texts must be similar, not just their mean
+                stored = self._vectors[row]
+                context_similarity = 2 * float(stored[:EMBEDDING_DIM] @ vector[:EMBEDDING_DIM])
+                question_similarity = 2 * float(stored[EMBEDDING_DIM:] @ vector[EMBEDDING_DIM:])
+                if min(context_similarity, question_similarity) < self.threshold:
+                    continue
+                if entry["context_anchors"] != context_anchors or entry["question_anchors"] != question_anchors:
+                    continue
+
+                entry["last_access"] = now
+                tracing.set_attributes(semantic_cache="hit", semantic_similarity=round(float(similarities[i]), 3))
+                return json.loads(entry["result"])
+
+        tracing.set_attributes(semantic_cache="miss")
+        return None
+
+    # ---- insertion and eviction ----
+
+    def put(self, raw_context: str, raw_question: str, result: dict):
+        """Store the pipeline result of a query (must be JSON-serializable)."""
+        vector = query_vector(raw_context, raw_question)
+        now = time.time()
+        entry = {
+            "context_anchors": anchors(raw_context),
+            "question_anchors": anchors(raw_question),
+            "result": json.dumps(result, ensure_ascii=False, default=str),
+            "created_at": now,
+            "last_access": now,
+        }
+
+        with self._lock:
+            row = len(self._entries)
+            if row == len(self._vector_buffer):
+                self._set_rows(self._vector_buffer, self._cluster_buffer)  # twice the capacity
+            self._vector_buffer[row] = vector
+            self._cluster_buffer[row] = np.argmax(self._centroids @ vector) if self._centroids is not None else 0
+            self._entries.append(entry)
+
+            if len(self._entries) > self.max_entries:
+                self._evict(now)
+            if len(self._entries) >= IVF_MIN_ENTRIES and len(self._entries) >= 2 * self._trained_size:
+                self._train()
+
+            self._unsaved += 1
+            if self._unsaved >= SAVE_EVERY:
+                self._save()
+
+    def _evict(self, now):
+        """Drop expired entries, then the least recently used down to 90% of `max_entries`."""
+        keep = [i for i, entry in enumerate(self._entries) if now - entry["created_at"] <= self.ttl_seconds]
+        target = int(self.max_entries * 0.9)
+        if len(keep) > target:
+            keep = sorted(sorted(keep, key=lambda i: self._entries[i]["last_access"])[-target:])
+        vectors, clusters = self._vectors[keep], self._clusters[keep]
+        self._entries = [self._entries[i] for i in keep]
+        self._set_rows(vectors, clusters)
+        if len(self._entries) < IVF_MIN_ENTRIES:
+            self._centroids, self._trained_size = None, 0
+
+    def _train(self):
+        """k-means over the stored vectors (spherical: centroids are renormalized)."""
+        count = len(self._entries)
+        k = max(2, int(np.sqrt(count)))
+        rng = np.random.default_rng(0)
+        centroids = self._vectors[rng.choice(count, k, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(self._vectors @ centroids.T, axis=1)
+            for c in range(k):
+                members = self._vectors[assignment == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._centroids = centroids
+        self._clusters[:] = np.argmax(self._vectors @ centroids.T, axis=1)
+        self._trained_size = count
+
+    # ---- persistence ----
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, vectors=self._vectors, clusters=self._clusters,
+                     centroids=self._centroids if self._centroids is not None else np.zeros((0, 0)),
+                     entries=np.array(json.dumps(self._entries)), trained_size=np.array(self._trained_size))
+        os.replace(temp_path, self.path)
+        self._unsaved = 0
+
+    def save(self):
+        """Write the index to `path` now."""
+        with self._lock:
+            self._save()
+
+    def _load(self):
+        with np.load(self.path, allow_pickle=False) as data:
+            entries = json.loads(str(data["entries"]))
+            vectors = data["vectors"].astype(np.float32)
+            if vectors.shape != (len(entries), 2 * EMBEDDING_DIM):
+                raise ValueError("index was built with another embedding size")
+            self._entries = entries
+            self._set_rows(vectors, data["clusters"])
+            self._centroids = data["centroids"].astype(np.float32) if data["centroids"].size else None
+            self._trained_size = int(data["trained_size"])
+
+
+##### RUNTIME #####
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Return the process-wide semantic cache, or None unless FUZZY_LLM_SEMANTIC_CACHE=on."""
+    global _cache
+    if os.getenv("FUZZY_LLM_SEMANTIC_CACHE", "off").lower() not in ("on", "1", "true"):
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache(
+                path=os.getenv("FUZZY_LLM_SEMANTIC_CACHE_PATH", DEFAULT_INDEX_PATH),
+                threshold=float(os.getenv("FUZZY_LLM_SEMANTIC_THRESHOLD", DEFAULT_THRESHOLD)),
+            )
+            atexit.register(_cache.save)
+        return _cache
+
+
+def set_semantic_cache(cache):
+    global _cache
+    with _cache_lock:
+        _cache = cache
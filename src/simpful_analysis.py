@@ -0,0 +1,185 @@
+"""
+Static checks of LLM-generated Simpful programs.
+
+A broken Simpful program used to be found out only after it ran in a sandbox worker.
+`code_errors` reads the program with `ast` instead and reports, in microseconds, the
+mistakes generated code typically makes: syntax errors, rules naming linguistic
+variables or terms that were never defined, undefined output variables, inputs set for
+unknown variables or never set at all.
+
+The checks follow the calls the generator prompt asks for (FuzzySet, LinguisticVariable,
+add_linguistic_variable, add_rules, set_variable, set_crisp_output_value). Anything that can't be
+resolved statically (names built at run time, variables added in loops) is not checked,
+so only certain mistakes are reported.
+"""
+import ast
+import re
+
+SUGENO_OUTPUT_METHODS = {"set_crisp_output_value", "set_output_function"}
+
+_THEN = re.compile(r"\bTHEN\b")
+_CLAUSE = re.compile(r"\(\s*([A-Za-z_]\w*)\s+IS\s+([A-Za-z_]\w*)\s*\)")
+
+
+def _string(node):
+    return node.value if isinstance(node, ast.Constant) and isinstance(node.value, str) else None
+
+
+def _callee(call):
+    if isinstance(call.func, ast.Name):
+        return call.func.id
+    if isinstance(call.func, ast.Attribute):
+        return call.func.attr
+    return None
+
+
+def _argument(call, index, keyword):
+    if len(call.args) > index:
+        return call.args[index]
+    return next((kw.value for kw in call.keywords if kw.arg == keyword), None)
+
+
+class _Program:
+    """What a Simpful program defines and uses, as far as it is known statically."""
+
+    def __init__(self, tree):
+        self.assigned = {}  # name -> last value assigned to it at module level
+        self.variables = {}  # linguistic variable -> set of terms (None: unknown)
+        self.rules = []  # (line, rule text)
+        self.inputs = {}  # variable given a value with set_variable -> line
+        self.sugeno_terms = set()  # crisp output values / output functions
+        self.imports_simpful = False
+        self.dynamic_variables = self.dynamic_rules = self.dynamic_inputs = False
+
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                self.assigned[node.targets[0].id] = node.value
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and (node.module or "").split(".")[0] == "simpful":
+                self.imports_simpful = True
+            elif isinstance(node, ast.Import) and any(a.name.split(".")[0] == "simpful" for a in node.names):
+                self.imports_simpful = True
+            elif isinstance(node, ast.Call):
+                self._call(node)
+
+    def _resolve(self, node):
+        for _ in range(5):  # follow a few levels of "A = B"
+            if not isinstance(node, ast.Name) or node.id not in self.assigned:
+                break
+            node = self.assigned[node.id]
+        return node
+
+    def _set_term(self, node):
+        node = self._resolve(node)
+        if isinstance(node, ast.Call) and _callee(node) == "FuzzySet":
+            return _string(next((kw.value for kw in node.keywords if kw.arg == "term"), None))
+        return None
+
+    def _variable_terms(self, node):
+        """Terms of a LinguisticVariable / AutoTriangle expression, None if unknown."""
+        node = self._resolve(node)
+        if not isinstance(node, ast.Call):
+            return None
+        if _callee(node) == "LinguisticVariable":
+            sets = self._resolve(_argument(node, 0, "FS_list"))
+            if not isinstance(sets, (ast.List, ast.Tuple)):
+                return None
+            terms = [self._set_term(element) for element in sets.elts]
+            return None if None in terms else set(terms)
+        if _callee(node) == "AutoTriangle":
+            terms = self._resolve(_argument(node, 1, "terms"))
+            if isinstance(terms, (ast.List, ast.Tuple)):
+                names = [_string(element) for element in terms.elts]
+                return None if None in names else set(names)
+        return None
+
+    def _call(self, call):
+        method = _callee(call) if isinstance(call.func, ast.Attribute) else None
+        name = _string(call.args[0]) if call.args else None
+
+        if method == "add_linguistic_variable":
+            if name is None:
+                self.dynamic_variables = True
+            else:
+                self.variables[name] = self._variable_terms(_argument(call, 1, "LV"))
+        elif method == "add_rules":
+            rules = self._resolve(_argument(call, 0, "rules"))
+            texts = [(element.lineno, _string(element)) for element in getattr(rules, "elts", [])]
+            if not isinstance(rules, (ast.List, ast.Tuple)) or any(text is None for _, text in texts):
+                self.dynamic_rules = True
+            self.rules.extend((line, text) for line, text in texts if text is not None)
+        elif method == "set_variable":
+            if name is None:
+                self.dynamic_inputs = True
+            else:
+                self.inputs.setdefault(name, call.lineno)
+        elif method in SUGENO_OUTPUT_METHODS and name is not None:
+            self.sugeno_terms.add(name)
+
+
+def _term_error(line, rule, variable, term, terms):
+    if terms is None or term in terms:
+        return None
+    return f"Line {line}: rule '{rule}': '{variable}' has no term '{term}' (terms: {', '.join(sorted(terms))})."
+
+
+def _rule_errors(program) -> list:
+    errors, unset = [], set()
+    known = not program.dynamic_variables
+    for line, rule in program.rules:
+        parts = _THEN.split(rule)
+        if len(parts) != 2:
+            errors.append(f"Line {line}: rule '{rule}' must look like 'IF (x IS a) THEN (z IS c)'.")
+            continue
+        antecedent, consequent = (_CLAUSE.findall(part) for part in parts)
+        if not antecedent or not consequent:
+            errors.append(f"Line {line}: rule '{rule}' has no '(variable IS term)' clause on one side.")
+        if not known:
+            continue
+
+        for variable, term in antecedent:
+            if variable not in program.variables:
+                errors.append(f"Line {line}: rule '{rule}' uses undefined linguistic variable '{variable}'.")
+            else:
+                errors.append(_term_error(line, rule, variable, term, program.variables[variable]))
+            if not program.dynamic_inputs and variable not in program.inputs and variable not in unset:
+                unset.add(variable)
+                errors.append(f"Line {line}: input variable '{variable}' is used in a rule but never "
+                              f"given a value with set_variable.")
+
+        for variable, term in consequent:
+            if program.sugeno_terms:
+                if term not in program.sugeno_terms:
+                    errors.append(f"Line {line}: rule '{rule}': '{term}' is not a crisp output value "
+                                  f"or output function.")
+            elif variable not in program.variables:
+                errors.append(f"Line {line}: rule '{rule}' uses undefined output variable '{variable}'.")
+            else:
+                errors.append(_term_error(line, rule, variable, term, program.variables[variable]))
+
+    return [error for error in errors if error]
+
+
+def code_errors(code: str) -> list:
+    """
+    Statically check a generated Simpful program before it is run.
+
+    Returns:
+        list: human readable error messages with line numbers (empty when nothing was found)
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return [f"Line {e.lineno}: syntax error: {e.msg}."]
+
+    program = _Program(tree)
+    errors = []
+    if not program.imports_simpful:
+        errors.append("simpful is never imported (start with 'from simpful import *').")
+
+    errors.extend(_rule_errors(program))
+    if not program.dynamic_variables:
+        for variable, line in sorted(program.inputs.items(), key=lambda item: item[1]):
+            if variable not in program.variables:
+                errors.append(f"Line {line}: set_variable for undefined linguistic variable '{variable}'.")
+    return errors
@@ -0,0 +1,113 @@
+"""
+Warm sandbox worker for LLM-generated Simpful code (see sandbox_pool.py).
+
+simpful (and with it numpy/scipy) is imported once at startup; every job then
+executes its code in a fresh global namespace. Besides what the code printed, the
+response carries the return value of every `FuzzySystem.inference()` call of the job
+as plain JSON numbers, so results never have to be scraped from stdout. Simpful's
+banner is switched off for all systems created by jobs. Jobs carrying a declarative
+FIS spec instead of code are compiled and evaluated directly (see fuzzy_spec.py).
+"""
+import io
+import threading
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+from fuzzy_spec import evaluate_spec
+from sandbox_pool import serve
+
+_inference_results = []  # results of the current job's inference() calls
+_depth = threading.local()  # inference() calls Mamdani_inference(): record the outer call only
+
+
+def _plain(value):
+    """Convert numpy scalars/arrays (and containers of them) to JSON-friendly values."""
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+def _recording(method):
+    def wrapper(self, *args, **kwargs):
+        _depth.value = getattr(_depth, "value", 0) + 1
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            _depth.value -= 1
+        if _depth.value == 0:
+            _inference_results.append(_plain(result))
+        return result
+    return wrapper
+
+
+def _preload():
+    import simpful
+
+    original_init = simpful.FuzzySystem.__init__
+
+    def quiet_init(self, *args, **kwargs):
+        if len(args) >= 2:  # show_banner passed positionally
+            args = args[:1] + (False,) + args[2:]
+        else:
+            kwargs["show_banner"] = False
+        original_init(self, *args, **kwargs)
+
+    simpful.FuzzySystem.__init__ = quiet_init
+    for name in ("inference", "Mamdani_inference", "Sugeno_inference"):
+        setattr(simpful.FuzzySystem, name, _recording(getattr(simpful.FuzzySystem, name)))
+
+
+def run_spec_job(spec: dict) -> dict:
+    stderr = io.StringIO()
+    results = None
+
+    with redirect_stdout(io.StringIO()), redirect_stderr(stderr):
+        try:
+            results = evaluate_spec(spec)
+        except BaseException:
+            traceback.print_exc()
+
+    return {
+        "returncode": 0 if results is not None else 1,
+        "results": results,
+        "stderr": stderr.getvalue(),
+    }
+
+
+def run_job(job: dict) -> dict:
+    if "spec" in job:
+        return run_spec_job(job["spec"])
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    returncode = 0
+    _inference_results.clear()
+
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            exec(compile(job["code"], "<simpful>", "exec"), {"__name__": "__main__"})
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                returncode = e.code
+            elif e.code is not None:
+                print(e.code, file=stderr)
+                returncode = 1
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+
+    return {
+        "returncode": returncode,
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "results": list(_inference_results),
+    }
+
+
+if __name__ == "__main__":
+    serve(run_job, setup=_preload)
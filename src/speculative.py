@@ -0,0 +1,143 @@
+"""
+Speculative execution of the reasoning branches.
+
+Deciding the reasoning mode and then running its branch is serial, and a wrong
+decision (e.g. a crisp program whose query finds no solutions) costs a whole new
+query. In speculative mode the likely branches start together with the decision:
+
+- the candidates are the modes the local router (mode_router.py) gives at least
+  SPECULATION_MIN_PROBABILITY, at most SPECULATION_MAX_BRANCHES of them
+- once the decision is known, candidates that have not finished are cancelled;
+  the chosen branch continues (or starts, if it was not a candidate)
+- if the chosen branch fails, a runner-up that already finished successfully is
+  used instead of the failed result
+
+Nothing is speculated when the router is confident, since the decision is then
+made locally without an LLM round trip. The pipeline uses this with
+FUZZY_LLM_SPECULATE=on (see pipeline.py).
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from decider import inference, inference_async
+from mode_router import get_router, router_enabled
+from rewriter import decide_reasoning_mode, decide_reasoning_mode_async
+
+SPECULATION_MIN_PROBABILITY = float(os.getenv("FUZZY_LLM_SPECULATION_MIN_PROBABILITY", 0.2))
+SPECULATION_MAX_BRANCHES = int(os.getenv("FUZZY_LLM_SPECULATION_MAX_BRANCHES", 2))
+
+# Threads running speculative branches of the blocking pipeline. Threads can't be
+# interrupted, so a losing branch that already started runs to completion here.
+_branch_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="speculative")
+
+
+def candidate_modes(clean_context: str, clean_question: str) -> list:
+    """Modes worth starting before the decision, most likely first ([] if the router decides alone)."""
+    router = get_router()
+    probabilities = router.probabilities(clean_context, clean_question)
+    if router_enabled() and max(probabilities.values()) >= router.threshold:
+        return []
+
+    ranked = sorted(probabilities, key=probabilities.get, reverse=True)
+    return [mode for mode in ranked if probabilities[mode] >= SPECULATION_MIN_PROBABILITY][:SPECULATION_MAX_BRANCHES]
+
+
+def branch_failed(result) -> bool:
+    """
+    Whether an inference result is a failure a runner-up branch may replace: an
+    error, a fuzzy model that could not be run, or a Prolog query without solutions.
+    """
+    if not isinstance(result, dict):
+        return False  # text answer
+    if result.get("error") or result.get("success") is False:
+        return True
+    results = result.get("results")
+    return isinstance(results, dict) and results.get("success") is False
+
+
+def _finished_ok(future) -> bool:
+    # works for concurrent.futures.Future and asyncio.Task alike
+    return (future.done() and not future.cancelled() and future.exception() is None
+            and not branch_failed(future.result()))
+
+
+def _outcome(mode, branches, result):
+    """Pick the final (mode, result) and record how the speculation went."""
+    outcome = "hit" if mode in branches else "miss"
+    if branch_failed(result):
+        for other, future in branches.items():
+            if other != mode and _finished_ok(future):
+                print(f"[INFO] The {mode} branch failed, using the finished {other} branch")
+                mode, result, outcome = other, future.result(), "fallback"
+                break
+
+    tracing.set_attributes(speculation=outcome, mode=mode)
+    tracing.metrics.speculation.inc(outcome=outcome)
+    return mode, result
+
+
+@tracing.traced("speculative_inference")
+def speculative_inference(clean_context: str, clean_question: str, on_decided=None):
+    """
+    Steps (2) and (3) of the pipeline, with the likely branches running while the
+    mode is decided.
+
+    Args:
+        on_decided: optional callback receiving the decided mode as soon as it is known
+
+    Returns:
+        tuple: (mode whose result is returned, inference result)
+    """
+    candidates = candidate_modes(clean_context, clean_question)
+    tracing.set_attributes(candidates=candidates)
+    branches = {
+        mode: _branch_executor.submit(contextvars.copy_context().run, inference, mode, clean_question, clean_context)
+        for mode in candidates
+    }
+
+    try:
+        mode = decide_reasoning_mode(clean_context, clean_question)
+    except BaseException:
+        for future in branches.values():
+            future.cancel()
+        raise
+
+    for other, future in branches.items():
+        if other != mode:
+            future.cancel()  # only stops branches that have not started yet
+    if on_decided is not None:
+        on_decided(mode)
+
+    chosen = branches.get(mode)
+    result = chosen.result() if chosen is not None else inference(mode, clean_question, clean_context)
+    return _outcome(mode, branches, result)
+
+
+@tracing.traced("speculative_inference")
+async def speculative_inference_async(clean_context: str, clean_question: str, on_decided=None):
+    """Async version of `speculative_inference`; losing branches are cancelled as tasks."""
+    candidates = candidate_modes(clean_context, clean_question)
+    tracing.set_attributes(candidates=candidates)
+    branches = {mode: asyncio.ensure_future(inference_async(mode, clean_question, clean_context))
+                for mode in candidates}
+
+    try:
+        mode = await decide_reasoning_mode_async(clean_context, clean_question)
+        for other, task in branches.items():
+            if other != mode:
+                task.cancel()
+        if on_decided is not None:
+            on_decided(mode)
+
+        chosen = branches.get(mode)
+        result = await (chosen if chosen is not None else inference_async(mode, clean_question, clean_context))
+        return _outcome(mode, branches, result)
+    finally:
+        for task in branches.values():
+            if task.done() and not task.cancelled():
+                task.exception()  # retrieved, so a losing branch's error isn't logged as unhandled
+            else:
+                task.cancel()
@@ -0,0 +1,338 @@
+"""
+Per-stage tracing and metrics for the reasoning pipeline.
+
+Stages are wrapped in spans (`span(...)` context manager or `@traced(...)` decorator).
+A span records its wall time, status and attributes such as retry counts, LLM token
+usage (with the provider's prefix-cache hits), cache hits, cost and sandbox CPU/RSS. Token, cost and cache counters are
+inclusive: an LLM call is added to the current span and to all of its parents, so
+the root span of a query holds the totals for the whole query.
+
+Finished spans are passed to the registered exporters (`add_exporter`); setting
+FUZZY_LLM_TRACE_FILE appends every span as one JSON line to that file. Stage
+latencies, token usage and cache hits are also kept in the in-process `metrics`
+registry, which renders in the Prometheus text format (`metrics.render()`).
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# USD per 1M tokens: (input, output)
+PRICING_PER_MILLION = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+CACHED_INPUT_DISCOUNT = 0.5  # prompt tokens served from the provider's prefix cache cost half
+BATCH_DISCOUNT = 0.5  # requests run through the Batch API cost half (see batch_runner.py)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+##### METRICS #####
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.type = "counter"
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.type = "histogram"
+        self.buckets = buckets
+        self._values = {}  # labels -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                labels = dict(key)
+                for bound, count in zip(self.buckets, state):
+                    samples.append((f"{self.name}_bucket", {**labels, "le": str(bound)}, count))
+                samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, state[-2]))
+                samples.append((f"{self.name}_count", labels, state[-2]))
+                samples.append((f"{self.name}_sum", labels, state[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.stage_latency = Histogram("fuzzy_llm_stage_latency_seconds", "Wall time per pipeline stage")
+        self.stage_errors = Counter("fuzzy_llm_stage_errors_total", "Stages that raised an exception")
+        self.llm_calls = Counter("fuzzy_llm_llm_calls_total", "LLM calls by stage and cache outcome")
+        self.llm_tokens = Counter("fuzzy_llm_llm_tokens_total", "LLM tokens by stage and kind")
+        self.llm_cost = Counter("fuzzy_llm_llm_cost_usd_total", "Estimated LLM cost in USD by stage")
+        self.sandbox_cpu = Counter("fuzzy_llm_sandbox_cpu_seconds_total", "Sandbox CPU time by engine")
+        self.retries = Counter("fuzzy_llm_retries_total", "Failed attempts that were retried, by stage")
+        self.llm_retries = Counter("fuzzy_llm_api_retries_total",
+                                   "OpenAI requests retried after a transient failure, by reason")
+        self.llm_queue_wait = Histogram("fuzzy_llm_queue_wait_seconds",
+                                        "Time OpenAI requests waited for the scheduler, by lane")
+        self.router_decisions = Counter("fuzzy_llm_router_decisions_total",
+                                        "Reasoning modes chosen by the local router or the LLM")
+        self.speculation = Counter("fuzzy_llm_speculation_total",
+                                   "Speculative inference outcomes: hit, miss or fallback")
+        self.context_cuts = Counter("fuzzy_llm_context_cuts_total",
+                                    "Contexts cut to a stage's token limit, by stage")
+        self.static_rejections = Counter("fuzzy_llm_static_rejections_total",
+                                         "Generated programs rejected by the static checks, by engine")
+        self.prefix_cache_hit_rate = Histogram("fuzzy_llm_prefix_cache_hit_rate",
+                                               "Share of each call's prompt tokens served from the provider's prefix cache",
+                                               buckets=(0.0, 0.25, 0.5, 0.75, 0.9, 1.0))
+
+    def _metrics(self):
+        return [value for value in vars(self).values() if isinstance(value, (Counter, Histogram))]
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                label_text = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+##### SPANS #####
+
+class Span:
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = dict(attributes)
+        self.start_time = time.time()
+        self.duration = None
+        self.status = "ok"
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, key, amount):
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+_exporters = []
+
+
+def add_exporter(exporter):
+    """Register a callable that receives every finished `Span`."""
+    _exporters.append(exporter)
+
+
+def remove_exporter(exporter):
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+
+class JSONLExporter:
+    """Appends finished spans to a JSONL file, one span per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+if os.getenv("FUZZY_LLM_TRACE_FILE"):
+    add_exporter(JSONLExporter(os.getenv("FUZZY_LLM_TRACE_FILE")))
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record `name` as a (child) span of the current one for the duration of the block."""
+    current = Span(name, parent=_current_span.get(), **attributes)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.set(error=f"{type(e).__name__}: {e}")
+        metrics.stage_errors.inc(stage=name)
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        metrics.stage_latency.observe(current.duration, stage=name)
+        for exporter in list(_exporters):
+            exporter(current)
+
+
+def traced(name):
+    """Decorator running a (sync or async) function inside `span(name)`."""
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def set_attributes(**attributes):
+    """Set attributes on the current span (no-op outside of any span)."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def record_retry():
+    """Count one failed attempt of the current stage that is going to be retried."""
+    current = _current_span.get()
+    if current is not None:
+        current.add("retries", 1)
+        metrics.retries.inc(stage=current.name)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens=0) -> float:
+    input_price, output_price = PRICING_PER_MILLION.get(model, (0.0, 0.0))
+    input_cost = (prompt_tokens - cached_tokens * CACHED_INPUT_DISCOUNT) * input_price
+    return (input_cost + completion_tokens * output_price) / 1_000_000
+
+
+def _rollup(key, amount):
+    current = _current_span.get()
+    while current is not None:
+        current.add(key, amount)
+        current = current.parent
+
+
+def record_llm_call(model, response=None, cache_hit=False, batch=False):
+    """
+    Account one LLM call (tokens, cost, cache outcome) to the current span and its
+    parents; `batch` calls were answered by the Batch API, at its price.
+    """
+    current = _current_span.get()
+    stage = current.name if current else "none"
+
+    metrics.llm_calls.inc(stage=stage, cache="hit" if cache_hit else "miss")
+    _rollup("llm_calls", 1)
+    if cache_hit:
+        _rollup("cache_hits", 1)
+        return
+
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+
+    # chat.completions reports prompt/completion tokens, the responses API input/output tokens
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None) or getattr(usage, "input_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+    if batch:
+        cost *= BATCH_DISCOUNT
+
+    metrics.llm_tokens.inc(prompt_tokens, stage=stage, kind="prompt")
+    metrics.llm_tokens.inc(cached_tokens, stage=stage, kind="cached_prompt")
+    metrics.llm_tokens.inc(completion_tokens, stage=stage, kind="completion")
+    metrics.llm_cost.inc(cost, stage=stage)
+    if prompt_tokens:
+        metrics.prefix_cache_hit_rate.observe(cached_tokens / prompt_tokens, stage=stage)
+    _rollup("prompt_tokens", prompt_tokens)
+    _rollup("cached_prompt_tokens", cached_tokens)
+    _rollup("completion_tokens", completion_tokens)
+    _rollup("cost_usd", cost)
+    if current is not None and current.attributes.get("prompt_tokens"):
+        current.set(prefix_cache_hit_rate=round(
+            current.attributes.get("cached_prompt_tokens", 0) / current.attributes["prompt_tokens"], 3))
+
+
+def record_queue_wait(lane, seconds):
+    """Account the time an LLM request waited for the request scheduler (see scheduler.py)."""
+    metrics.llm_queue_wait.observe(seconds, lane=lane)
+    _rollup("queue_wait", seconds)
+
+
+def record_context_cut(stage, dropped_tokens):
+    """Account a context cut to the token limit of `stage` (see prompt_layout.py)."""
+    metrics.context_cuts.inc(stage=stage)
+    _rollup("context_tokens_dropped", dropped_tokens)
+
+
+def record_sandbox_usage(engine, usage):
+    """Attach CPU time / peak RSS reported by a sandbox worker to the current span."""
+    if not usage:
+        return
+    set_attributes(sandbox_cpu_seconds=usage.get("cpu_seconds"),
+                   sandbox_max_rss_mb=usage.get("max_rss_mb"))
+    metrics.sandbox_cpu.inc(usage.get("cpu_seconds") or 0.0, engine=engine)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of `values` (None for an empty list)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
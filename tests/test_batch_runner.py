@@ -0,0 +1,97 @@
+"""
+Test of Batch API mode against the stub Batch API of fake_llm_server: queries whose
+LLM calls depend on each other take one round per call, an interrupted run resumes
+from its work directory without sending anything twice, and requests that failed with
+a transient error are sent again.
+"""
+import json
+import os
+import sys
+import threading
+
+import pytest
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+os.environ.setdefault("OPENAI_API_KEY", "fake-key")  # the pipeline modules create clients at import
+
+from batch_runner import BatchCollector, run_batched  # noqa: E402
+from fake_llm_server import FakeBatches, FakeLLM, FakeServer, make_handler  # noqa: E402
+from llm_cache import MemoryLRUCache, cached_call  # noqa: E402
+from prompt_layout import chat_messages  # noqa: E402
+from prompts import REWRITER_PROMPT  # noqa: E402
+
+CASES = {f"case-{i}": {"id": f"case-{i}", "text": f"Query number {i}."} for i in range(3)}
+EXPECTED = {case_id: {"id": case_id, "answer": f"{case['text']} Again."} for case_id, case in CASES.items()}
+
+
+@pytest.fixture
+def stub_batches():
+    fake = FakeLLM()
+    batches = FakeBatches(fake, batch_ms=0)
+    server = FakeServer(("127.0.0.1", 0), make_handler(fake, batches=batches))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OpenAI(base_url=f"http://127.0.0.1:{server.server_address[1]}/v1", api_key="fake-key",
+                    max_retries=0)
+    yield batches, client
+    server.shutdown()
+    server.server_close()
+
+
+def _two_calls(client):
+    """A query of two dependent LLM calls (the stub rewriter echoes its input)."""
+    cache = MemoryLRUCache()
+
+    def rewrite(text):
+        response = cached_call(client.chat.completions.create, ChatCompletion, cache=cache,
+                               model="gpt-4o-mini", messages=chat_messages(REWRITER_PROMPT, text))
+        return response.choices[0].message.content
+
+    def process(case):
+        return {"id": case["id"], "answer": rewrite(rewrite(case["text"]) + " Again.")}
+    return process
+
+
+def _submitted(batches):
+    """Request lines of every batch the stub received."""
+    return sum(batch["request_counts"]["total"] for batch, _ in batches.batches.values())
+
+
+def test_dependent_calls_take_one_round_each(stub_batches, tmp_path):
+    batches, client = stub_batches
+    collector = BatchCollector(str(tmp_path), client=client)
+
+    assert run_batched(CASES, _two_calls(client), collector, poll_seconds=0.01) == EXPECTED
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("round")) == [
+        "round01_completions_0.jsonl", "round02_completions_0.jsonl"]
+    assert _submitted(batches) == 6
+    assert collector.usage["requests"] == 6
+
+
+def test_interrupted_run_resumes_from_the_work_dir(stub_batches, tmp_path, monkeypatch):
+    batches, client = stub_batches
+    interrupted = BatchCollector(str(tmp_path), client=client)
+    monkeypatch.setattr(interrupted, "wait", lambda poll_seconds: None)  # stopped while round 1 runs
+    assert run_batched(CASES, _two_calls(client), interrupted, max_rounds=1) == {}
+    with open(tmp_path / "batches.json", "r", encoding="utf-8") as f:
+        assert [record["done"] for record in json.load(f)] == [False]
+
+    resumed = BatchCollector(str(tmp_path), client=client)
+    assert run_batched(CASES, _two_calls(client), resumed, poll_seconds=0.01) == EXPECTED
+    assert len(batches.batches) == 2 and _submitted(batches) == 6  # round 1 was not sent again
+
+    again = BatchCollector(str(tmp_path), client=client)
+    assert run_batched(CASES, _two_calls(client), again, poll_seconds=0.01) == EXPECTED
+    assert len(batches.batches) == 2  # every answer comes from responses.jsonl
+
+
+def test_transient_errors_are_sent_again(stub_batches, tmp_path):
+    batches, client = stub_batches
+    batches.error_rate = 0.5
+    collector = BatchCollector(str(tmp_path), client=client)
+
+    assert run_batched(CASES, _two_calls(client), collector, poll_seconds=0.01) == EXPECTED
+    assert _submitted(batches) > 6
+    assert collector.errors == {}
@@ -0,0 +1,137 @@
+"""
+Unit tests of the vectorized fuzzy engine: its results must match Simpful's Mamdani
+inference on the same spec, row by row.
+"""
+import copy
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fuzzy_batch  # noqa: E402
+from fake_llm_server import SYNTHETIC_FUZZY_SPEC  # noqa: E402
+from fuzzy_batch import BatchFuzzySystem, batch_spec_errors, evaluate_batch, parse_rule  # noqa: E402
+from fuzzy_spec import FuzzySpec, evaluate_spec  # noqa: E402
+
+TIPPING_SPEC = {
+    "inputs": [
+        {"name": "service", "universe": [0, 10], "terms": [
+            {"term": "poor", "shape": "gaussian", "params": [0, 2]},
+            {"term": "good", "shape": "gaussian", "params": [5, 2]},
+            {"term": "excellent", "shape": "gaussian", "params": [10, 2]},
+        ]},
+        {"name": "food", "universe": [0, 10], "terms": [
+            {"term": "rancid", "shape": "trapezoidal", "params": [0, 0, 2, 5]},
+            {"term": "delicious", "shape": "trapezoidal", "params": [5, 8, 10, 10]},
+        ]},
+    ],
+    "outputs": [
+        {"name": "tip", "universe": [0, 30], "terms": [
+            {"term": "small", "shape": "triangular", "params": [0, 5, 10]},
+            {"term": "average", "shape": "triangular", "params": [10, 15, 20]},
+            {"term": "generous", "shape": "triangular", "params": [20, 25, 30]},
+        ]},
+    ],
+    "rules": [
+        "IF (service IS poor) OR (food IS rancid) THEN (tip IS small)",
+        "IF (service IS good) THEN (tip IS average)",
+        "IF (service IS excellent) AND (NOT (food IS rancid)) THEN (tip IS generous)",
+    ],
+    "values": [],
+}
+
+RISK_SPEC = {
+    "inputs": [
+        {"name": "debt", "universe": [0, 100], "terms": [
+            {"term": "low", "shape": "triangular", "params": [0, 0, 50]},
+            {"term": "high", "shape": "triangular", "params": [30, 100, 100]},
+        ]},
+        {"name": "income", "universe": [0, 200], "terms": [
+            {"term": "low", "shape": "trapezoidal", "params": [0, 0, 40, 80]},
+            {"term": "high", "shape": "trapezoidal", "params": [60, 120, 200, 200]},
+        ]},
+    ],
+    "outputs": [
+        {"name": "risk", "universe": [0, 1], "terms": [
+            {"term": "low", "shape": "triangular", "params": [0, 0, 0.5]},
+            {"term": "high", "shape": "triangular", "params": [0.5, 1, 1]},
+        ]},
+        {"name": "limit", "universe": [0, 50], "terms": [
+            {"term": "small", "shape": "gaussian", "params": [5, 5]},
+            {"term": "large", "shape": "gaussian", "params": [40, 8]},
+        ]},
+    ],
+    "rules": [
+        "IF ((debt IS high) AND (income IS low)) OR (NOT (income IS high)) THEN (risk IS high)",
+        "IF (debt IS low) AND (income IS high) THEN (risk IS low)",
+        "IF (income IS high) THEN (limit IS large)",
+        "IF (income IS low) OR (debt IS high) THEN (limit IS small)",
+    ],
+    "values": [],
+}
+
+ROWS = {
+    "synthetic": {"evidence": [0.0, 0.1, 0.35, 0.5, 0.62, 0.8, 1.0]},
+    "tipping": {"service": [0, 2.5, 5, 7.3, 10, 9], "food": [10, 3, 5, 8, 0, 9.5]},
+    "risk": {"debt": [0, 20, 45, 70, 100, 55], "income": [200, 30, 90, 70, 10, 150]},
+}
+SPECS = {"synthetic": SYNTHETIC_FUZZY_SPEC, "tipping": TIPPING_SPEC, "risk": RISK_SPEC}
+
+
+def _simpful_rows(spec, inputs):
+    """Simpful's result for every row of `inputs`, one `inference()` per row."""
+    rows = len(next(iter(inputs.values())))
+    results = []
+    for row in range(rows):
+        point = copy.deepcopy(spec)
+        point["values"] = [{"variable": name, "value": float(column[row])} for name, column in inputs.items()]
+        results.append(evaluate_spec(point))
+    return results
+
+
+# ---- equivalence with Simpful ----
+
+@pytest.mark.parametrize("name", SPECS)
+def test_matches_simpful(name):
+    spec, inputs = SPECS[name], ROWS[name]
+    batch = evaluate_batch(spec, inputs)
+    for row, expected in enumerate(_simpful_rows(spec, inputs)):
+        assert set(batch) == set(expected)
+        for output, value in expected.items():
+            assert batch[output][row] == pytest.approx(value, abs=1e-6), (name, row, output)
+
+
+def test_chunks_give_the_same_results(monkeypatch):
+    inputs = {"service": np.linspace(0, 10, 50), "food": np.linspace(10, 0, 50)}
+    whole = BatchFuzzySystem(TIPPING_SPEC).evaluate(inputs)["tip"]
+    monkeypatch.setattr(fuzzy_batch, "ROW_CHUNK", 7)
+    assert np.allclose(BatchFuzzySystem(TIPPING_SPEC).evaluate(inputs)["tip"], whole, rtol=1e-12)
+
+
+# ---- rules and inputs ----
+
+def test_parse_rule():
+    assert parse_rule("IF (a IS x) AND (NOT (b IS y)) THEN (c IS z)") == (
+        ("AND", ("IS", "a", "x"), ("NOT", ("IS", "b", "y"))), "c", "z")
+    for rule in ("(a IS x) THEN (c IS z)", "IF (a IS x) THEN (c IS z) AND (d IS w)", "IF ((a IS x) THEN (c IS z)"):
+        with pytest.raises(ValueError):
+            parse_rule(rule)
+
+
+def test_inputs_must_be_complete_columns():
+    system = BatchFuzzySystem(TIPPING_SPEC)
+    with pytest.raises(ValueError, match="food"):
+        system.evaluate({"service": [1, 2]})
+    with pytest.raises(ValueError, match="same length"):
+        system.evaluate({"service": [1, 2], "food": [3]})
+    assert system.evaluate({"service": [], "food": []})["tip"].size == 0
+
+
+def test_batch_spec_errors_check_columns_not_values():
+    spec = FuzzySpec.model_validate(TIPPING_SPEC)
+    assert batch_spec_errors(spec, ROWS["tipping"]) == []
+    assert batch_spec_errors(spec, {"service": [1]}) == [
+        "No input column for variable 'food'; available columns: service."]
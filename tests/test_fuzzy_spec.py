@@ -0,0 +1,127 @@
+"""
+Unit tests of the declarative fuzzy spec: validation messages, normalization and the
+system key, and Simpful inference of a valid spec.
+"""
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from fake_llm_server import SYNTHETIC_FUZZY_SPEC  # noqa: E402
+from fuzzy_spec import FuzzySpec, evaluate_spec, normalize_spec, spec_errors, system_key  # noqa: E402
+
+
+def _spec(**changes):
+    spec = copy.deepcopy(SYNTHETIC_FUZZY_SPEC)
+    spec.update(changes)
+    return spec
+
+
+def _errors(spec):
+    return spec_errors(FuzzySpec.model_validate(spec))
+
+
+def _with_input_terms(*terms):
+    spec = _spec()
+    spec["inputs"][0]["terms"] = list(terms)
+    return spec
+
+
+# ---- validation ----
+
+def test_valid_spec_has_no_errors():
+    assert _errors(SYNTHETIC_FUZZY_SPEC) == []
+
+
+def test_empty_spec_lists_every_missing_part():
+    assert _errors({"inputs": [], "outputs": [], "rules": [], "values": []}) == [
+        "At least one input variable is required.",
+        "At least one output variable is required.",
+        "At least one rule is required.",
+    ]
+
+
+@pytest.mark.parametrize("name", ["2fast", "risk level", "IF", "not"])
+def test_invalid_variable_names(name):
+    spec = _spec()
+    spec["outputs"][0]["name"] = name
+    assert any(error.startswith(f"Invalid variable name '{name}'") for error in _errors(spec))
+
+
+@pytest.mark.parametrize("universe", [[1, 0], [0, 0], [0], [0, 1, 2]])
+def test_universe_must_be_min_max(universe):
+    spec = _spec()
+    spec["outputs"][0]["universe"] = universe
+    assert "Variable 'outcome': universe must be [min, max] with min < max." in _errors(spec)
+
+
+def test_membership_function_parameters():
+    spec = _with_input_terms(
+        {"term": "low", "shape": "triangular", "params": [0, 0.5]},
+        {"term": "mid", "shape": "trapezoidal", "params": [0.2, 0.6, 0.4, 0.8]},
+        {"term": "high", "shape": "gaussian", "params": [1, 0]},
+    )
+    assert _errors(spec)[:3] == [
+        "Term 'evidence.low': triangular needs 3 params, got 2.",
+        "Term 'evidence.mid': trapezoidal params must be in non-decreasing order.",
+        "Term 'evidence.high': sigma must be > 0.",
+    ]
+
+
+def test_rules_must_use_known_variables_and_terms():
+    spec = _spec(rules=[
+        "IF (evidence IS huge) THEN (outcome IS likely)",
+        "IF (outcome IS likely) THEN (evidence IS low)",
+        "IF (evidence IS low) THEN outcome",
+        "IF (evidence IS low) THEN (outcome IS likely); import os",
+        "evidence IS low",
+    ])
+    assert _errors(spec) == [
+        "Rule 'IF (evidence IS huge) THEN (outcome IS likely)': 'evidence' has no term 'huge'.",
+        "Rule 'IF (outcome IS likely) THEN (evidence IS low)': 'outcome' is not an input variable.",
+        "Rule 'IF (outcome IS likely) THEN (evidence IS low)': 'evidence' is not an output variable.",
+        "Rule 'IF (evidence IS low) THEN outcome': no '(variable IS term)' clause in 'outcome'.",
+        "Rule 'IF (evidence IS low) THEN (outcome IS likely); import os' must look like "
+        "'IF (x IS a) AND (y IS b) THEN (z IS c)'.",
+        "Rule 'evidence IS low' must look like 'IF (x IS a) AND (y IS b) THEN (z IS c)'.",
+    ]
+
+
+def test_values_must_cover_the_inputs_within_their_universes():
+    assert _errors(_spec(values=[{"variable": "evidence", "value": 1.5}])) == [
+        "Value 1.5 of 'evidence' is outside its universe [0.0, 1.0]."]
+    assert _errors(_spec(values=[{"variable": "speed", "value": 1}])) == [
+        "Value given for unknown input variable 'speed'.",
+        "No value given for input variable 'evidence'.",
+    ]
+
+
+def test_duplicate_variable():
+    spec = _spec()
+    spec["outputs"][0]["name"] = "evidence"
+    assert "Variable 'evidence' is defined twice." in _errors(spec)
+
+
+# ---- normalization ----
+
+def test_system_key_ignores_values_order_and_layout():
+    reordered = _spec(values=[{"variable": "evidence", "value": 0.1}],
+                      rules=["IF  (evidence IS high) THEN (outcome IS likely)"] + SYNTHETIC_FUZZY_SPEC["rules"])
+    reordered["inputs"][0]["terms"].reverse()
+    assert normalize_spec(reordered) == normalize_spec(SYNTHETIC_FUZZY_SPEC)
+    assert system_key(reordered) == system_key(FuzzySpec.model_validate(SYNTHETIC_FUZZY_SPEC))
+
+    changed = _spec()
+    changed["inputs"][0]["terms"][1]["params"] = [0.3, 0.55, 0.7]
+    assert system_key(changed) != system_key(SYNTHETIC_FUZZY_SPEC)
+
+
+# ---- inference ----
+
+def test_evaluate_spec_follows_the_rules():
+    low = evaluate_spec(_spec(values=[{"variable": "evidence", "value": 0.1}]))["outcome"]
+    high = evaluate_spec(_spec(values=[{"variable": "evidence", "value": 0.9}]))["outcome"]
+    assert low < 0.5 < high
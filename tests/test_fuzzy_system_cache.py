@@ -0,0 +1,68 @@
+"""
+Unit tests of the compiled fuzzy system cache and of answering a known query template
+with new numbers (no LLM involved).
+"""
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import fuzzy_system_cache  # noqa: E402
+from engine_tools import run_compiled_fuzzy, run_known_fuzzy  # noqa: E402
+from fake_llm_server import SYNTHETIC_FUZZY_SPEC  # noqa: E402
+from fuzzy_system_cache import FuzzySystemCache, context_template, input_positions  # noqa: E402
+
+CONTEXT = "The evidence strength is 0.8 out of 1."
+QUESTION = "How likely is the outcome?"
+
+
+@pytest.fixture(autouse=True)
+def system_cache():
+    previous = fuzzy_system_cache._system_cache
+    cache = FuzzySystemCache(store=None)
+    fuzzy_system_cache.set_system_cache(cache)
+    yield cache
+    fuzzy_system_cache.set_system_cache(previous)
+
+
+def _spec(value=0.8):
+    spec = copy.deepcopy(SYNTHETIC_FUZZY_SPEC)
+    spec["values"] = [{"variable": "evidence", "value": value}]
+    return spec
+
+
+def test_template_ignores_numbers_and_layout():
+    template, numbers = context_template(CONTEXT, QUESTION)
+    other, other_numbers = context_template("The evidence  strength is 0.3 out of 1.", QUESTION)
+    assert template == other
+    assert numbers == [0.8, 1.0] and other_numbers == [0.3, 1.0]
+
+
+def test_input_positions_need_a_unique_number():
+    assert input_positions(_spec(0.8), [0.8, 1.0]) == {"evidence": 0}
+    assert input_positions(_spec(0.8), [0.8, 0.8]) is None
+    assert input_positions(_spec(0.5), [0.8, 1.0]) is None
+
+
+def test_known_query_with_new_numbers_skips_generation():
+    assert run_known_fuzzy(CONTEXT, QUESTION) is None
+    first = run_compiled_fuzzy(_spec(0.8), CONTEXT, QUESTION)
+
+    reused = run_known_fuzzy("The evidence strength is 0.2 out of 1.", QUESTION)
+    assert reused["success"] and reused["system_key"] == first["system_key"]
+    assert reused["results"] == run_compiled_fuzzy(_spec(0.2))["results"]
+
+
+def test_changed_fixed_number_is_not_reused():
+    run_compiled_fuzzy(_spec(0.8), CONTEXT, QUESTION)
+    assert run_known_fuzzy("The evidence strength is 0.2 out of 2.", QUESTION) is None
+
+
+def test_value_outside_the_universe_is_not_reused(system_cache):
+    run_compiled_fuzzy(_spec(0.8), CONTEXT, QUESTION)
+    assert run_known_fuzzy("The evidence strength is 7 out of 1.", QUESTION) is None
+    assert system_cache.lookup_context("The evidence strength is -0.5 out of 1.", QUESTION) is None
+    assert system_cache.lookup_context("The evidence strength is 1 out of 1.", QUESTION) is not None
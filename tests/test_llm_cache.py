@@ -0,0 +1,161 @@
+"""
+Unit tests of the LLM response cache: request keys, the memory and SQLite tiers
+(TTL, size-based eviction) and how the tiers and `cached_call` work together.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import llm_cache  # noqa: E402
+from llm_cache import MemoryLRUCache, SQLiteCache, TieredCache, cached_call, discard, request_key  # noqa: E402
+
+
+class Verdict(BaseModel):
+    answer: str
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_cache.time, "time", clock)
+    return clock
+
+
+def _messages(text):
+    return [{"role": "user", "content": text}]
+
+
+# ---- request_key ----
+
+def test_request_key_ignores_parameter_order():
+    first = request_key(Verdict, {"model": "m", "temperature": 0.3, "messages": _messages("hi")})
+    second = request_key(Verdict, {"messages": _messages("hi"), "temperature": 0.3, "model": "m"})
+    assert first == second
+
+
+def test_request_key_covers_everything_that_shapes_the_response():
+    params = {"model": "m", "temperature": 0.3, "messages": _messages("hi")}
+    key = request_key(Verdict, params)
+    assert key != request_key(Verdict, dict(params, temperature=0.7))
+    assert key != request_key(Verdict, dict(params, messages=_messages("hi!")))
+    assert key != request_key(dict, params)  # another endpoint / response type
+
+    class OtherVerdict(BaseModel):
+        answer: int
+
+    assert request_key(Verdict, dict(params, text_format=Verdict)) != \
+        request_key(Verdict, dict(params, text_format=OtherVerdict))
+
+
+# ---- memory tier ----
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = MemoryLRUCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"  # "b" is now the least recently used
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+
+# ---- SQLite tier ----
+
+def test_sqlite_entries_expire_after_ttl(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), ttl_seconds=60)
+    cache.set("key", "value")
+    clock.now += 59
+    assert cache.get("key") == "value"
+    clock.now += 2
+    assert cache.get("key") is None
+    assert cache._total_bytes == 0
+
+
+def test_sqlite_evicts_least_recently_used_over_max_bytes(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_bytes=30)
+    for key in ("a", "b", "c"):
+        cache.set(key, "x" * 10)
+        clock.now += 1
+    cache.get("a")  # "b" is now the least recently used
+    clock.now += 1
+    cache.set("d", "x" * 10)
+
+    # evicted down to 90% of max_bytes: the two least recently used entries go
+    assert cache.get("b") is None and cache.get("c") is None
+    assert cache.get("a") == cache.get("d") == "x" * 10
+    assert cache._total_bytes == 20
+
+
+def test_sqlite_evicts_expired_entries_first(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), ttl_seconds=60, max_bytes=20)
+    cache.set("old", "x" * 10)
+    clock.now += 30
+    cache.set("recent", "x" * 10)
+    cache.get("old")
+    clock.now += 31  # "old" expired, though it was used last
+    cache.set("new", "x" * 10)
+    assert cache.get("recent") == "x" * 10 and cache.get("new") == "x" * 10
+    assert cache._total_bytes == 20
+
+
+def test_sqlite_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    SQLiteCache(path).set("key", "value")
+    reopened = SQLiteCache(path)
+    assert reopened.get("key") == "value" and reopened._total_bytes == len("value")
+
+
+# ---- tiers ----
+
+def test_tiers_backfill_faster_tiers(tmp_path):
+    memory, disk = MemoryLRUCache(), SQLiteCache(str(tmp_path / "cache.sqlite"))
+    cache = TieredCache(memory, disk)
+    disk.set("key", "value")
+    assert memory.get("key") is None
+    assert cache.get("key") == "value"
+    assert memory.get("key") == "value"
+
+    cache.delete("key")
+    assert memory.get("key") is None and disk.get("key") is None
+
+
+def test_async_lookup_backfills_memory(tmp_path):
+    memory, disk = MemoryLRUCache(), SQLiteCache(str(tmp_path / "cache.sqlite"))
+    disk.set("key", "value")
+    assert asyncio.run(llm_cache._aget(TieredCache(memory, disk), "key")) == "value"
+    assert memory.get("key") == "value"
+
+
+# ---- cached_call ----
+
+def test_cached_call_answers_repeats_from_the_cache():
+    calls = []
+
+    def create(**params):
+        calls.append(params)
+        return Verdict(answer=f"answer {len(calls)}")
+
+    cache = MemoryLRUCache()
+    first = cached_call(create, Verdict, cache=cache, model="m", messages=_messages("hi"))
+    again = cached_call(create, Verdict, cache=cache, model="m", messages=_messages("hi"))
+    assert first == again == Verdict(answer="answer 1") and len(calls) == 1
+
+    assert cached_call(create, Verdict, bypass=True, cache=cache, model="m", messages=_messages("hi")) \
+        == Verdict(answer="answer 2")
+
+    discard(Verdict, cache=cache, model="m", messages=_messages("hi"))
+    assert cached_call(create, Verdict, cache=cache, model="m", messages=_messages("hi")) \
+        == Verdict(answer="answer 3")
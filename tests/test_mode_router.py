@@ -0,0 +1,93 @@
+"""
+Unit tests of the local reasoning-mode router: features, the keyword scorer and its
+confidence threshold, training, the decision log and the runtime switch.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import mode_router  # noqa: E402
+from mode_router import ModeRouter, features, load_decisions, log_decision, route_locally, train  # noqa: E402
+
+ARITHMETIC = ("Tom buys 3 apples at $2 each and 4 pears at $1 each.", "How much does Tom spend in total?")
+GRADED = ("Anna is very experienced and her references are strong.", "How likely is Anna to succeed?")
+RULES = ("All birds can fly. Tweety is a bird.", "Can Tweety fly?")
+
+
+@pytest.fixture
+def router():
+    previous = mode_router._router
+    router = ModeRouter()
+    mode_router.set_router(router)
+    yield router
+    mode_router.set_router(previous)
+
+
+def test_features():
+    vector = features("1 2 3 4 5", "How many 7?")
+    assert vector["bias"] == 1.0
+    assert vector["rule:quantity_question"] == 1.0
+    assert vector["rule:numbers"] == 3.0  # capped
+    assert vector["q:how_many"] == vector["q:<num>"] == vector["c:<num>"] == 1.0
+    assert "c:1" not in vector
+
+
+def test_keyword_scorer_routes_clear_cases():
+    router = ModeRouter()
+    assert router.route(*ARITHMETIC) == "no"
+    assert router.route(*GRADED) == "fuzzy"
+    assert sum(router.probabilities(*RULES).values()) == pytest.approx(1.0)
+
+
+def test_unsure_queries_go_to_the_llm():
+    mode, confidence = ModeRouter().predict(*RULES)
+    assert mode == "crisp" and confidence < mode_router.DEFAULT_CONFIDENCE
+    assert ModeRouter().route(*RULES) is None
+    assert ModeRouter(threshold=confidence).route(*RULES) == "crisp"
+
+
+def test_training_learns_from_examples(tmp_path):
+    examples = [(f"All {kind} in group {i} follow the rule. Item {i} is one of them.",
+                 f"Does item {i} follow the rule?", "crisp") for i, kind in enumerate(["cats", "dogs"] * 10)]
+    examples += [(f"Player {i} is fairly quick and quite strong.", f"How good is player {i}?", "fuzzy")
+                 for i in range(20)]
+    trained = train(examples)
+    unseen = ("All cows in group 99 follow the rule. Item 99 is one of them.", "Does item 99 follow the rule?")
+    assert ModeRouter().route(*unseen) is None
+    assert trained.route(*unseen) == "crisp"
+    assert trained.route("Player 99 is rather slow and quite weak.", "How good is player 99?") == "fuzzy"
+
+    path = str(tmp_path / "router.json")
+    trained.save(path)
+    loaded = ModeRouter.load(path, threshold=0.5)
+    assert loaded.weights == trained.weights and loaded.threshold == 0.5
+
+
+def test_decision_log_keeps_the_latest_decision(tmp_path):
+    path = str(tmp_path / "decisions.jsonl")
+    log_decision(*RULES, "fuzzy", path=path)
+    log_decision(*RULES, "crisp", path=path)
+    log_decision(*GRADED, "fuzzy", path=path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"context": "c", "question": "q", "mode": "maybe"}) + "\n")
+        f.write('{"context": "partial')
+
+    assert sorted(load_decisions(path)) == sorted([(*RULES, "crisp"), (*GRADED, "fuzzy")])
+
+
+def test_decision_log_can_be_switched_off(tmp_path, monkeypatch):
+    monkeypatch.setenv("FUZZY_LLM_ROUTER_LOG", "off")
+    path = str(tmp_path / "decisions.jsonl")
+    log_decision(*RULES, "crisp", path=path)
+    assert not os.path.exists(path)
+
+
+def test_route_locally(router, monkeypatch):
+    assert route_locally(*ARITHMETIC) == "no"
+    assert route_locally(*RULES) is None
+    monkeypatch.setenv("FUZZY_LLM_ROUTER", "off")
+    assert route_locally(*ARITHMETIC) is None
@@ -0,0 +1,115 @@
+"""
+Unit tests of the Prolog reader and the static checks built on it (no Prolog engine needed).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from prolog_analysis import (PString, Struct, Var, check_program, parse_program, parse_term,  # noqa: E402
+                             prepare_program, program_errors, quote_atom, tokenize)
+
+
+def _values(text):
+    return [token.value for token in tokenize(text)]
+
+
+# ---- =.. ----
+
+def test_univ_before_layout_is_one_token():
+    assert _values("p(T, L) :- T =.. L.") == ["p", "(", "T", ",", "L", ")", ":-", "T", "=..", "L", "."]
+
+
+def test_univ_parses_as_operator():
+    assert parse_term("T =.. [f, X]") == Struct("=..", (Var("T"), Struct("[|]", (
+        Struct("f", ()), Struct("[|]", (Var("X"), Struct("[]", ())))))))
+
+
+def test_univ_program_is_accepted():
+    assert program_errors("p(T, L) :- T =.. L.\nq(X) :- X =.. [f, a].") == []
+
+
+def test_symbol_atom_before_end_is_still_split():
+    assert [t.kind for t in tokenize("x(Y) :- Y = +.\n")][-2:] == ["name", "end"]
+
+
+# ---- names and variables ----
+
+def test_unicode_atoms_and_variables():
+    assert parse_term("likes(josé, café)") == Struct("likes", (Struct("josé", ()), Struct("café", ())))
+    assert parse_term("p(Ärger, _ö)") == Struct("p", (Var("Ärger"), Var("_ö")))
+    assert program_errors("likes(josé, café).\nfan(X) :- likes(X, café).", "fan(josé)") == []
+
+
+def test_quote_atom_round_trips():
+    for name in ("josé", "hello", "Hello", "two words", "it's", "a\\b", "[]x"):
+        assert parse_term(quote_atom(name)) == Struct(name, ())
+
+
+# ---- quoted atoms, strings and character codes ----
+
+def test_quoted_atoms():
+    assert parse_term("'hello world'") == Struct("hello world", ())
+    assert parse_term("'it''s'") == Struct("it's", ())
+    assert parse_term(r"'a\'b'") == Struct("a'b", ())
+    assert parse_term(r"'line\n'") == Struct("line\n", ())
+    assert parse_term("'Bob'(x)") == Struct("Bob", (Struct("x", ()),))
+
+
+def test_strings():
+    assert parse_term('"say ""hi"""') == PString('say "hi"')
+
+
+def test_character_codes():
+    assert parse_term("0'a") == 97
+    assert parse_term("0' ") == 32
+    assert parse_term("0''' ") == 39
+    assert parse_term(r"0'\n") == 10
+    assert parse_term("X = 0'.") == Struct("=", (Var("X"), 46))
+
+
+# ---- operators ----
+
+def test_operator_priorities():
+    assert parse_term("X is 1 + 2 * 3") == Struct("is", (Var("X"), Struct("+", (1, Struct("*", (2, 3))))))
+    assert parse_term("a :- b, c ; d -> e") == Struct(":-", (Struct("a", ()), Struct(";", (
+        Struct(",", (Struct("b", ()), Struct("c", ()))), Struct("->", (Struct("d", ()), Struct("e", ())))))))
+    assert parse_term("X = a - 1 - 2") == Struct("=", (Var("X"), Struct("-", (Struct("-", (Struct("a", ()), 1)), 2))))
+    assert parse_term("2 ^ 3 ^ 4") == Struct("^", (2, Struct("^", (3, 4))))
+
+
+def test_prefix_operators_and_operator_atoms():
+    assert parse_term(r"\+ p(X)") == Struct("\\+", (Struct("p", (Var("X"),)),))
+    assert parse_term("X = (-)") == Struct("=", (Var("X"), Struct("-", ())))
+    assert parse_term("maplist(=(a), L)") == Struct("maplist", (Struct("=", (Struct("a", ()),)), Var("L")))
+    assert parse_term("X @=< Y") == Struct("@=<", (Var("X"), Var("Y")))
+
+
+def test_dcg_and_directives():
+    clauses = parse_program(":- dynamic counter/1.\ngreeting --> [hello], name.\nname --> [world].")
+    assert [clause.term.name for clause in clauses] == [":-", "-->", "-->"]
+
+
+# ---- unreadable text is a warning, not an error ----
+
+def test_parse_failures_are_warnings():
+    errors, warnings = check_program("p(X) :- X = [1, 2.\n")
+    assert errors == []
+    assert warnings[0].startswith("possible syntax error at line 1")
+
+    errors, warnings = check_program("p(1).", "p(X")
+    assert errors == [] and warnings[0].startswith("possible syntax error in the query")
+
+
+def test_non_callable_head_is_an_error():
+    assert program_errors("1 :- true.") == ["line 1: clause head is not a callable term"]
+
+
+# ---- tabling ----
+
+def test_left_recursion_is_tabled():
+    program, tabled = prepare_program("path(X, Y) :- path(X, Z), edge(Z, Y).\npath(X, Y) :- edge(X, Y).\n"
+                                      "edge(a, b).")
+    assert tabled == ["path/2"]
+    assert program.startswith(":- table path/2.\n")
+    assert len(parse_program(program)) == 4
@@ -0,0 +1,131 @@
+"""
+Smoke test of the crisp Prolog path against a real SWI-Prolog engine: consulting a
+program in a pooled worker, streaming its solutions, tabling a left-recursive
+predicate, and recovering from killed workers (pool and knowledge base session).
+
+    python -m pytest tests
+
+The tests that need the engine are skipped when `swipl` is not installed (CI sets
+FUZZY_LLM_REQUIRE_SWIPL=1 to fail instead); the one that checks how a missing engine
+is reported only runs then.
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from engine_tools import get_prolog_pool, run_crisp_prolog, stream_crisp_prolog  # noqa: E402
+from prolog_session import PrologSession  # noqa: E402
+
+HAVE_SWIPL = shutil.which("swipl") is not None
+if not HAVE_SWIPL and os.getenv("FUZZY_LLM_REQUIRE_SWIPL"):
+    pytest.fail("FUZZY_LLM_REQUIRE_SWIPL is set but swipl is not installed", pytrace=False)
+needs_swipl = pytest.mark.skipif(not HAVE_SWIPL, reason="SWI-Prolog is not installed")
+
+FAMILY = """
+parent(tom, bob).
+parent(tom, liz).
+parent(bob, ann).
+grandparent(X, Z) :- parent(X, Y), parent(Y, Z).
+"""
+
+CYCLIC_GRAPH = """
+edge(a, b).
+edge(b, c).
+edge(c, a).
+path(X, Y) :- path(X, Z), edge(Z, Y).
+path(X, Y) :- edge(X, Y).
+"""
+
+
+@needs_swipl
+def test_consult_and_stream_solutions():
+    stream = stream_crisp_prolog(FAMILY, "parent(tom, X)")
+    assert list(stream) == [{"X": "bob"}, {"X": "liz"}]
+    assert stream.error is None and not stream.truncated
+
+    result = run_crisp_prolog(FAMILY, "grandparent(tom, ann)")
+    assert result["results"]["success"] is True
+
+
+@needs_swipl
+def test_jobs_do_not_share_clauses():
+    assert run_crisp_prolog("fact(a).", "fact(X)")["results"]["bindings"] == {"X": ["a"]}
+    assert run_crisp_prolog("fact(b).", "fact(X)")["results"]["bindings"] == {"X": ["b"]}
+
+
+@needs_swipl
+def test_inference_limit_stops_runaway_recursion():
+    # the cut keeps count/1 from being tabled, so only the inference limit stops it
+    result = run_crisp_prolog("count(N) :- !, M is N + 1, count(M).", "count(0)", inference_limit=100_000)
+    assert result["error"] == "resource_exceeded"
+
+
+@needs_swipl
+def test_stream_stops_at_max_solutions():
+    stream = stream_crisp_prolog("start(1).", "start(S), between(S, inf, X)", max_solutions=5)
+    assert [solution["X"] for solution in stream] == [1, 2, 3, 4, 5]
+    assert stream.truncated
+
+
+@needs_swipl
+def test_left_recursion_terminates_only_because_of_tabling():
+    # sent to a worker as is (no prepare_program), path/2 recurses until the inference limit
+    untabled = get_prolog_pool().run({"program": CYCLIC_GRAPH, "query": "path(a, X)",
+                                      "inference_limit": 1_000_000, "max_solutions": 100}, timeout=30)
+    assert untabled["error"] == "resource_exceeded"
+
+    result = run_crisp_prolog(CYCLIC_GRAPH, "path(a, X)", inference_limit=1_000_000)
+    assert sorted(result["results"]["bindings"]["X"]) == ["a", "b", "c"]
+
+
+@needs_swipl
+def test_pool_replaces_killed_workers():
+    pool = get_prolog_pool()
+    pool.start()
+    for worker in list(pool._idle.queue):
+        worker.kill()
+
+    result = run_crisp_prolog(FAMILY, "parent(tom, X)")
+    assert result["results"]["bindings"] == {"X": ["bob", "liz"]}
+
+
+@needs_swipl
+def test_session_replays_deltas_after_worker_kill():
+    with PrologSession(FAMILY) as kb:
+        assert kb.assertz("parent(liz, joe)", "parent(liz, max)")["asserted"] == 2
+        assert kb.retract("parent(liz, max)")["retracted"] == 1
+        kb._worker.kill()
+
+        result = kb.query("grandparent(tom, X)")
+        assert result["results"]["bindings"] == {"X": ["ann", "joe"]}
+
+
+@needs_swipl
+def test_session_tables_left_recursion_and_refreshes_tables():
+    with PrologSession(CYCLIC_GRAPH) as kb:
+        assert kb.tabled == ["path/2"]
+        assert sorted(kb.query("path(a, X)")["results"]["bindings"]["X"]) == ["a", "b", "c"]
+        kb.assertz("edge(c, d)")
+        assert sorted(kb.query("path(a, X)")["results"]["bindings"]["X"]) == ["a", "b", "c", "d"]
+
+
+def test_session_rejects_non_callable_heads():
+    with pytest.raises(ValueError, match="not a callable term"):
+        PrologSession("1 :- true.")
+
+
+@needs_swipl
+def test_session_reports_failing_directive():
+    with pytest.raises(ValueError, match="undefined_directive"):
+        PrologSession(":- undefined_directive(1).\np(1).")
+
+
+@pytest.mark.skipif(HAVE_SWIPL, reason="SWI-Prolog is installed")
+def test_missing_engine_is_reported():
+    result = run_crisp_prolog(FAMILY, "parent(tom, X)")
+    assert result["error"] == "engine_unavailable"
+    assert "Worker failed to start" in result["message"]
@@ -0,0 +1,46 @@
+"""
+Unit tests of the per-stage context limits: code generation and the mode decision
+see the whole context, other stages are capped and every cut is recorded.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import tracing  # noqa: E402
+from prompt_layout import GAP_MARKER, cap_tokens, context_limit, count_tokens, user_content  # noqa: E402
+
+LONG_CONTEXT = " ".join(f"Fact {i}: item {i} weighs {i * 3} kilograms." for i in range(600))
+
+
+def test_codegen_and_decide_get_the_whole_context():
+    assert context_limit("codegen") is None and context_limit("decide") is None
+    for stage in ("codegen", "decide"):
+        content = user_content(stage, LONG_CONTEXT, "Which item is heaviest?")
+        assert LONG_CONTEXT in content and GAP_MARKER not in content
+
+
+def test_limit_can_be_set_per_stage(monkeypatch):
+    monkeypatch.setenv("FUZZY_LLM_CONTEXT_TOKENS_CODEGEN", "500")
+    assert context_limit("codegen") == 500
+    assert GAP_MARKER in user_content("codegen", LONG_CONTEXT)
+
+
+def test_cap_keeps_start_and_end():
+    capped = cap_tokens(LONG_CONTEXT, 300)
+    assert count_tokens(capped) <= 300
+    assert capped.startswith("Fact 0:") and capped.endswith("Fact 599: item 599 weighs 1797 kilograms.")
+    assert cap_tokens("Short.", 300) == "Short." and cap_tokens(LONG_CONTEXT, None) == LONG_CONTEXT
+
+
+def test_cuts_are_recorded_in_the_trace(capsys):
+    with tracing.span("pipeline") as root:
+        with tracing.span("summarize"):
+            user_content("summary", "Short context.")
+        assert "context_tokens_dropped" not in root.attributes
+
+        with tracing.span("summarize"):
+            content = user_content("summary", LONG_CONTEXT)
+    dropped = root.attributes["context_tokens_dropped"]
+    assert dropped > 0 and GAP_MARKER in content
+    assert "[WARN] summary context cut" in capsys.readouterr().out
@@ -0,0 +1,116 @@
+"""
+Unit tests of the client-side rate limiter: token buckets, request and token limits,
+settling estimates against the reported usage, and token estimates of requests.
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import rate_limiter  # noqa: E402
+from rate_limiter import RateLimiter, TokenBucket, estimate_tokens  # noqa: E402
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+
+def _response(total_tokens):
+    return SimpleNamespace(usage=SimpleNamespace(total_tokens=total_tokens))
+
+
+# ---- token bucket ----
+
+def test_bucket_starts_full_and_refills_continuously(clock):
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.try_acquire(60) == 0.0
+    assert bucket.try_acquire(1) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_acquire(1) == 0.0
+
+
+def test_bucket_never_exceeds_its_capacity(clock):
+    bucket = TokenBucket(per_minute=60)
+    clock.now += 3600
+    assert bucket.try_acquire(60) == 0.0
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+
+
+def test_oversized_request_waits_for_a_full_bucket(clock):
+    bucket = TokenBucket(per_minute=60)
+    bucket.try_acquire(30)
+    assert bucket.wait_time(1000) == pytest.approx(30.0)
+    clock.now += 30
+    assert bucket.try_acquire(1000) == 0.0
+
+
+def test_wait_time_does_not_take_tokens(clock):
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.wait_time(60) == 0.0
+    assert bucket.try_acquire(60) == 0.0
+
+
+def test_adjust_gives_back_and_takes(clock):
+    bucket = TokenBucket(per_minute=60)
+    bucket.try_acquire(60)
+    bucket.adjust(-30)
+    assert bucket.wait_time(30) == 0.0
+    bucket.adjust(40)  # may go negative: the next request waits longer
+    assert bucket.wait_time(1) == pytest.approx(11.0)
+
+
+# ---- rate limiter ----
+
+def test_request_and_token_limits(clock):
+    limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=600)
+    limiter.take(100)
+    assert limiter.wait_time(100) == 0.0
+    limiter.take(100)
+    assert limiter.wait_time(100) == pytest.approx(30.0)  # out of requests (2/min)
+    clock.now += 30
+    assert limiter.wait_time(100) == 0.0
+
+    limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=600)
+    limiter.take(500)
+    assert limiter.wait_time(200) == pytest.approx(10.0)  # out of tokens (10/s)
+
+
+def test_settle_corrects_the_estimate(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+    limiter.take(500)
+    limiter.settle(500, _response(100))  # the request used 400 tokens less than estimated
+    assert limiter.wait_time(500) == 0.0
+    limiter.settle(0, SimpleNamespace(usage=None))
+    assert limiter.wait_time(500) == 0.0
+
+
+def test_unlimited():
+    limiter = RateLimiter()
+    limiter.take(10 ** 9)
+    assert limiter.wait_time(10 ** 9) == 0.0
+
+
+# ---- estimates ----
+
+def test_estimate_tokens():
+    messages = [{"role": "system", "content": "You are terse."}, {"role": "user", "content": "Hi"}]
+    prompt = rate_limiter.count_tokens("You are terse.") + rate_limiter.count_tokens("Hi") + 8
+    assert estimate_tokens({"messages": messages}) == prompt + 512
+    assert estimate_tokens({"input": messages, "max_output_tokens": 50}) == prompt + 50
+    assert estimate_tokens({"input": "Hi", "max_tokens": 10}) == rate_limiter.count_tokens("Hi") + 10
@@ -0,0 +1,168 @@
+"""
+Unit tests of the request scheduler: the adaptive concurrency limit, lane weights and
+flow turns, and rate-limited models not holding up requests for other models.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import scheduler as scheduler_module  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+from scheduler import AdaptiveLimit, Scheduler, Ticket, _Waiter, lane, parse_model_limits  # noqa: E402
+
+
+def _enqueue(scheduler, lane_name, flow, model="gpt-4o-mini", tokens=0):
+    waiter = _Waiter(lane_name, flow, model, tokens)
+    scheduler._enqueue(waiter)
+    return waiter
+
+
+def _admission_order(scheduler, waiters):
+    """Release every admitted request in turn; the waiters in the order they were admitted."""
+    order = [waiter for waiter in waiters if waiter.granted]
+    position = 0
+    while position < len(order):
+        Ticket(scheduler, order[position]).release()
+        order.extend(waiter for waiter in waiters if waiter.granted and waiter not in order)
+        position += 1
+    return order
+
+
+# ---- adaptive concurrency (AIMD) ----
+
+def test_slow_start_grows_by_one_per_success():
+    limit = AdaptiveLimit(initial=4, maximum=64)
+    for _ in range(4):
+        limit.on_success(latency=1.0, in_flight=int(limit) - 1)
+    assert limit.value == 8
+
+
+def test_limit_only_grows_when_used():
+    limit = AdaptiveLimit(initial=4)
+    limit.on_success(latency=1.0, in_flight=0)
+    assert limit.value == 4
+
+
+def test_overload_decreases_multiplicatively_then_grows_additively(monkeypatch):
+    limit = AdaptiveLimit(initial=20)
+    limit.on_overload()
+    assert limit.value == pytest.approx(14) and not limit.slow_start
+    limit.on_overload()  # same burst of 429s: within the cooldown
+    assert limit.value == pytest.approx(14)
+
+    for _ in range(14):
+        limit.on_success(latency=1.0, in_flight=int(limit) - 1)
+    assert 14.9 < limit.value < 15.1  # about one per limit's worth of successes
+
+    monkeypatch.setattr(limit, "_last_decrease", limit._last_decrease - scheduler_module.DECREASE_COOLDOWN)
+    limit.on_overload()
+    assert limit.value == pytest.approx(0.7 * 15, abs=0.1)
+
+
+def test_latency_climb_shrinks_the_limit():
+    limit = AdaptiveLimit(initial=10)
+    for _ in range(20):
+        limit.on_success(latency=1.0, in_flight=0)
+    limit.on_success(latency=10.0, in_flight=0)
+    assert limit.value == pytest.approx(9) and not limit.slow_start
+
+
+def test_limit_stays_within_bounds():
+    limit = AdaptiveLimit(initial=100, minimum=2, maximum=8)
+    assert limit.value == 8
+    for _ in range(20):
+        limit._last_decrease = 0.0
+        limit.on_overload()
+    assert limit.value == 2
+
+
+# ---- lanes and flows ----
+
+def test_lane_weights():
+    scheduler = Scheduler(limit=AdaptiveLimit(initial=1, maximum=1))
+    waiters = [_enqueue(scheduler, "interactive", f"query-{i}") for i in range(20)]
+    waiters += [_enqueue(scheduler, "batch", f"eval-{i}") for i in range(5)]
+
+    lanes = "".join(waiter.lane[0] for waiter in _admission_order(scheduler, waiters))
+    assert lanes == "iiiiiiiib" + "iiiiiiiib" + "iiii" + "bbb"
+
+
+def test_batch_keeps_room_for_interactive_requests():
+    scheduler = Scheduler(limit=AdaptiveLimit(initial=8, maximum=8))
+    batch = [_enqueue(scheduler, "batch", f"eval-{i}") for i in range(8)]
+    assert sum(waiter.granted for waiter in batch) == 6  # BATCH_MAX_SHARE of 8
+    assert _enqueue(scheduler, "interactive", "query").granted
+
+
+def test_queries_take_turns_within_a_lane():
+    scheduler = Scheduler(limit=AdaptiveLimit(initial=1, maximum=1))
+    waiters = [_enqueue(scheduler, "interactive", "running")]
+    waiters += [_enqueue(scheduler, "interactive", "a") for _ in range(3)]
+    waiters += [_enqueue(scheduler, "interactive", flow) for flow in ("b", "c")]
+    order = [waiter.flow for waiter in _admission_order(scheduler, waiters)]
+    assert order == ["running", "a", "b", "c", "a", "a"]
+
+
+def test_unknown_lane():
+    with pytest.raises(ValueError):
+        with lane("bulk"):
+            pass
+
+
+# ---- rate limits ----
+
+def test_rate_limited_model_does_not_block_other_models():
+    scheduler = Scheduler({"gpt-4o": RateLimiter(requests_per_minute=1)})
+    first = _enqueue(scheduler, "interactive", "q1", model="gpt-4o")
+    second = _enqueue(scheduler, "interactive", "q1", model="gpt-4o")
+    other = _enqueue(scheduler, "interactive", "q1", model="gpt-4o-mini")
+    try:
+        assert first.granted and not second.granted
+        assert other.granted
+        assert scheduler.stats()["queued"] == {"interactive": 1, "batch": 0}
+        assert 0 < scheduler._timer_due - scheduler_module.time.monotonic() <= 60
+    finally:
+        scheduler._timer.cancel()
+
+
+def test_rate_limited_requests_keep_their_order():
+    scheduler = Scheduler({"gpt-4o": RateLimiter(tokens_per_minute=1000)})
+    big = _enqueue(scheduler, "interactive", "q1", model="gpt-4o", tokens=900)
+    large = _enqueue(scheduler, "interactive", "q2", model="gpt-4o", tokens=800)
+    small = _enqueue(scheduler, "interactive", "q3", model="gpt-4o", tokens=50)
+    try:
+        assert big.granted
+        assert not large.granted and not small.granted  # small fits, but queues behind large
+    finally:
+        scheduler._timer.cancel()
+
+
+def test_parse_model_limits():
+    limits = parse_model_limits("gpt-4o-mini=500/200000, gpt-4o=/30000")
+    assert limits["gpt-4o-mini"].requests.capacity == 500 and limits["gpt-4o-mini"].tokens.capacity == 200000
+    assert limits["gpt-4o"].requests is None and limits["gpt-4o"].tokens.capacity == 30000
+    assert parse_model_limits("") == {}
+
+
+# ---- async waiting ----
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    scheduler = Scheduler(limit=AdaptiveLimit(initial=1, maximum=1))
+
+    async def run():
+        ticket = await scheduler.acquire_async("gpt-4o-mini")
+        waiting = asyncio.ensure_future(scheduler.acquire_async("gpt-4o-mini"))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"]["interactive"] == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert scheduler.stats()["queued"]["interactive"] == 0
+        ticket.release()
+        assert scheduler.stats()["in_flight"]["interactive"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,60 @@
+"""
+Unit tests of the semantic cache: near-duplicate queries hit, queries with another
+meaning (numbers, names, negations, polarity words) miss.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from semantic_cache import SemanticCache, anchors  # noqa: E402
+
+CONTEXT = ("Alice has 5 years of experience and strong references. Bob has 3 years of experience "
+           "and excellent communication skills.")
+QUESTION = "Which of the two candidates is the more suitable choice for the senior role?"
+RESULT = {"answer": "Alice"}
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache(path=None)
+    cache.put(CONTEXT, QUESTION, RESULT)
+    return cache
+
+
+def test_near_duplicate_hits(cache):
+    assert cache.get(CONTEXT + " ", QUESTION.replace("senior role", "senior role ")) == RESULT
+    assert cache.get(CONTEXT, "Which of the two candidates is the more suitable choice for the senior role") == RESULT
+
+
+@pytest.mark.parametrize("question", [
+    QUESTION.replace("more suitable", "less suitable"),
+    QUESTION.replace("more suitable", "most suitable"),
+    QUESTION.replace("more suitable", "least suitable"),
+    QUESTION.replace("suitable", "unsuitable"),
+])
+def test_opposite_question_misses(cache, question):
+    assert cache.get(CONTEXT, question) is None
+
+
+@pytest.mark.parametrize("before, after", [("a high risk", "a low risk"), ("higher", "lower"),
+                                           ("always", "never"), ("all", "some")])
+def test_polarity_words_are_anchors(before, after):
+    context = f"The project has {before} of delay."
+    assert anchors(context) != anchors(context.replace(before, after))
+
+
+def test_high_and_low_risk_do_not_share_results():
+    cache = SemanticCache(path=None)
+    context = "The portfolio holds mostly small-cap stocks in emerging markets."
+    cache.put(context, "Does this portfolio carry a high risk?", {"answer": "yes"})
+    assert cache.get(context, "Does this portfolio carry a low risk?") is None
+    assert cache.get(context, "Does this portfolio carry a high risk?") == {"answer": "yes"}
+
+
+def test_numbers_names_and_negations_miss(cache):
+    assert cache.get(CONTEXT.replace("5 years", "2 years"), QUESTION) is None
+    assert cache.get(CONTEXT.replace("Bob", "Carl"), QUESTION) is None
+    assert cache.get(CONTEXT.replace("strong references", "no references"), QUESTION) is None